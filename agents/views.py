@@ -1,11 +1,14 @@
+from functools import partial
 from rest_framework import viewsets, permissions, filters
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q
+from django.db.models import Q, Count, Max
 from .models import Agent
 from .serializers import AgentSerializer
 from users.permissions import IsStandardOrAdmin
+from conversations.conditional import ConditionalGetMixin
 
-class AgentViewSet(viewsets.ModelViewSet):
+class AgentViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = AgentSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -26,6 +29,22 @@ class AgentViewSet(viewsets.ModelViewSet):
             Q(is_public=True) | Q(created_by=user)
         )
     
+    def list(self, request, *args, **kwargs):
+        summary = self.filter_queryset(self.get_queryset()).order_by().aggregate(
+            count=Count('id'),
+            updated_at=Max('updated_at')
+        )
+        return self.conditional(
+            request, summary, None, partial(super().list, request, *args, **kwargs)
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        agent = self.get_object()
+        return self.conditional(
+            request, [agent.updated_at], agent.updated_at,
+            lambda: Response(self.get_serializer(agent).data)
+        )
+    
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [IsStandardOrAdmin()]
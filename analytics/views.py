@@ -1,7 +1,7 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Count, Avg, F, Q
+from django.db.models import Count, Avg, F
 from django.utils import timezone
 from .models import ConversationAnalysis, AgentPerformance, UserActivity
 from .serializers import (
@@ -10,7 +10,12 @@ from .serializers import (
 )
 from users.permissions import IsAdminUser
 from conversations.permissions import HasConversationAccess
-from conversations.models import Conversation, Message, Agent
+from conversations.models import Conversation, Message, Agent, ConversationVisibility
+from conversations.completion_cache import completion_cache
+from conversations.scheduler import get_turn_scheduler
+from conversations.rate_limiter import get_rate_limiter
+from conversations.call_policy import call_policy
+from conversations.access import access_cache
 
 class ConversationAnalysisViewSet(viewsets.ModelViewSet):
     serializer_class = ConversationAnalysisSerializer
@@ -33,8 +38,8 @@ class ConversationAnalysisViewSet(viewsets.ModelViewSet):
         # Check access to the conversation
         self.check_object_permissions(request, conversation)
         
-        # Get messages
-        messages = Message.objects.filter(conversation=conversation)
+        # Get messages, including those a fork inherits
+        messages = conversation.history()
         
         if not messages.exists():
             return Response(
@@ -83,7 +88,7 @@ class AgentPerformanceViewSet(viewsets.ModelViewSet):
         self.check_object_permissions(request, conversation)
         
         # Get messages grouped by agent
-        agent_messages = Message.objects.filter(conversation=conversation).values('agent').annotate(
+        agent_messages = conversation.history().values('agent').annotate(
             message_count=Count('id')
         )
         
@@ -137,9 +142,7 @@ class UserActivityViewSet(viewsets.ModelViewSet):
         
         # Calculate metrics
         conversations_created = Conversation.objects.filter(created_by=user).count()
-        conversations_participated = Conversation.objects.filter(
-            Q(created_by=user) | Q(user_access__user=user)
-        ).distinct().count()
+        conversations_participated = ConversationVisibility.objects.filter(user=user).count()
         agents_created = Agent.objects.filter(created_by=user).count()
         total_messages = Message.objects.filter(conversation__created_by=user).count()
         
@@ -156,3 +159,16 @@ class UserActivityViewSet(viewsets.ModelViewSet):
         )
         
         return Response(UserActivitySerializer(activity).data)
+
+class LLMMetricsViewSet(viewsets.ViewSet):
+    """Runtime metrics of the LLM call path in the serving process."""
+    permission_classes = [IsAdminUser]
+    
+    def list(self, request):
+        return Response({
+            'completion_cache': completion_cache.stats(),
+            'turn_scheduler': get_turn_scheduler().stats(),
+            'rate_limiter': get_rate_limiter().stats(),
+            'call_policy': call_policy.stats(),
+            'access_cache': access_cache.stats()
+        })
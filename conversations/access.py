@@ -0,0 +1,187 @@
+import logging
+import threading
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from .models import Conversation, UserAccess
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Levels a user can have on a conversation, besides the UserAccess levels
+OWNER = 'owner'
+PUBLIC = 'public'
+NONE = 'none'
+
+READ_LEVELS = (OWNER, 'admin', 'edit', 'view', PUBLIC)
+WRITE_LEVELS = (OWNER, 'admin', 'edit')
+DELETE_LEVELS = (OWNER, 'admin')
+
+# Stores a decision only if the conversation's version is still the one read
+# before the decision was looked up
+LUA_STORE = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return 1
+"""
+
+class AccessCache:
+    """
+    Shared cache of access decisions, keyed by (user, conversation).
+    
+    A decision is the user's level on the conversation: owner, their UserAccess
+    level, public (no grant, but the conversation is public) or none. Decisions
+    of one conversation live in one Redis hash, so a change to the
+    conversation drops all of them at once while a grant or revocation only
+    drops the affected user's entry. Each invalidation also bumps a
+    per-conversation version, and a decision is only stored if the version
+    has not changed since before it was looked up, so a request that read the
+    old state cannot cache it after the invalidation. Entries expire after
+    ACCESS_CACHE_TTL seconds as a safety net. Roles are not part of the decision: they are
+    checked on the user object of the request, so role changes apply at once.
+    Redis errors fall back to the database.
+    """
+    key_prefix = 'conv_access:'
+    version_prefix = 'conv_access_version:'
+    
+    def __init__(self, enabled=None, ttl=None):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._scripts = {}
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'stale_writes': 0,
+            'redis_errors': 0,
+        }
+    
+    def _enabled(self):
+        return settings.ACCESS_CACHE_ENABLED if self.enabled is None else self.enabled
+    
+    def _ttl(self):
+        return self.ttl or settings.ACCESS_CACHE_TTL
+    
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+    
+    def _key(self, conversation_id):
+        return f'{self.key_prefix}{conversation_id}'
+    
+    def _version_key(self, conversation_id):
+        return f'{self.version_prefix}{conversation_id}'
+    
+    def _script(self, source):
+        redis_client = get_redis()
+        key = (id(redis_client), source)
+        if key not in self._scripts:
+            self._scripts[key] = redis_client.register_script(source)
+        return self._scripts[key]
+    
+    @staticmethod
+    def compute(user_id, conversation_id):
+        """Look the decision up in the database; None if the conversation does not exist."""
+        grant = UserAccess.objects.filter(conversation=OuterRef('pk'), user_id=user_id).values('access_level')
+        row = Conversation.objects.filter(id=conversation_id).annotate(
+            grant=Subquery(grant[:1])
+        ).values_list('created_by_id', 'is_public', 'grant').first()
+        if row is None:
+            return None
+        
+        created_by_id, is_public, grant = row
+        if created_by_id is not None and str(created_by_id) == str(user_id):
+            return OWNER
+        if grant:
+            return grant
+        return PUBLIC if is_public else NONE
+    
+    def level(self, user_id, conversation_id):
+        """The user's access level on the conversation, or None if it does not exist."""
+        if not self._enabled():
+            return self.compute(user_id, conversation_id)
+        
+        key = self._key(conversation_id)
+        version_key = self._version_key(conversation_id)
+        try:
+            pipe = get_redis().pipeline()
+            pipe.hget(key, str(user_id))
+            pipe.get(version_key)
+            cached, version = pipe.execute()
+        except Exception as e:
+            logger.warning("Access cache read failed: %s", e)
+            self._count('redis_errors')
+            return self.compute(user_id, conversation_id)
+        
+        if cached is not None:
+            self._count('hits')
+            return cached.decode()
+        
+        self._count('misses')
+        level = self.compute(user_id, conversation_id)
+        if level is not None:
+            try:
+                stored = self._script(LUA_STORE)(
+                    keys=[key, version_key],
+                    args=[(version or b'').decode(), str(user_id), level, self._ttl()]
+                )
+                if not stored:
+                    self._count('stale_writes')
+            except Exception as e:
+                logger.warning("Access cache write failed: %s", e)
+                self._count('redis_errors')
+        return level
+    
+    def invalidate(self, conversation_id, user_id=None):
+        """
+        Drop cached decisions of one user, or of everyone, on a conversation,
+        and bump its version so lookups already in flight do not store what
+        they read. Runs after the current transaction commits, so lookups that
+        start afterwards read the new state.
+        """
+        if not self._enabled():
+            return
+        
+        def drop():
+            try:
+                pipe = get_redis().pipeline()
+                pipe.incr(self._version_key(conversation_id))
+                pipe.expire(self._version_key(conversation_id), self._ttl())
+                if user_id is None:
+                    pipe.delete(self._key(conversation_id))
+                else:
+                    pipe.hdel(self._key(conversation_id), str(user_id))
+                pipe.execute()
+                self._count('invalidations')
+            except Exception as e:
+                logger.warning("Access cache invalidation failed: %s", e)
+                self._count('redis_errors')
+        
+        transaction.on_commit(drop)
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+access_cache = AccessCache()
+
+def can_access(user, conversation_id, method='GET'):
+    """Whether user may perform an HTTP method on a conversation."""
+    if not user.is_authenticated:
+        return False
+    if user.role == 'admin':
+        return True
+    
+    level = access_cache.level(user.pk, conversation_id)
+    if method in ('GET', 'HEAD', 'OPTIONS'):
+        return level in READ_LEVELS
+    if method == 'DELETE':
+        return level in DELETE_LEVELS
+    return level in WRITE_LEVELS
@@ -0,0 +1,7 @@
+from django.apps import AppConfig
+
+class ConversationsConfig(AppConfig):
+    name = 'conversations'
+    
+    def ready(self):
+        from . import signals
@@ -0,0 +1,174 @@
+import json
+import zlib
+from datetime import timedelta
+from itertools import islice
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Conversation, ConversationArchive, Message
+from .context import context_builder
+from .export import MESSAGE_FIELDS, encode_record
+from .search import get_message_search
+
+class NotArchivable(Exception):
+    pass
+
+def _embedding_model():
+    # vector_store depends on conversations, not the other way round
+    return apps.get_model('vector_store', 'Embedding')
+
+def archive_conversation(conversation_id):
+    """
+    Move the messages of a completed conversation into a ConversationArchive.
+    
+    The messages and their embedding rows are deleted from the hot tables in
+    the same transaction; the conversation keeps its counters, so listings do
+    not change. Returns the archive.
+    """
+    Embedding = _embedding_model()
+    with transaction.atomic():
+        conversation = Conversation.objects.select_for_update().get(id=conversation_id)
+        if conversation.archived_at is not None:
+            raise NotArchivable("Conversation is already archived")
+        if conversation.is_active or conversation.completed_at is None:
+            raise NotArchivable("Only completed conversations can be archived")
+        # Forks read their history from the messages table of their ancestors
+        if conversation.parent_id is not None or conversation.forks.exists():
+            raise NotArchivable("Forked conversations cannot be archived")
+        
+        messages = Message.objects.filter(conversation_id=conversation_id)
+        embeddings = {
+            row['message_id']: row
+            for row in Embedding.objects.filter(message__conversation_id=conversation_id).values(
+                'id', 'message_id', 'vector_id', 'dimensions'
+            )
+        }
+        
+        ids = []
+        lines = []
+        for message in messages.order_by('timestamp', 'id').values(*MESSAGE_FIELDS, 'created_at').iterator():
+            embedding = embeddings.get(message['id'])
+            if embedding is not None:
+                message['embedding'] = {k: v for k, v in embedding.items() if k != 'message_id'}
+            ids.append(message['id'])
+            lines.append(encode_record(message))
+        raw = b''.join(lines)
+        
+        archive = ConversationArchive.objects.create(
+            conversation_id=conversation_id,
+            data=zlib.compress(raw, settings.ARCHIVE_COMPRESSION_LEVEL),
+            message_count=len(lines),
+            raw_size=len(raw)
+        )
+        
+        # Deleting through the ORM would run the per-message signals, which
+        # must not take the messages out of the conversation counters
+        Embedding.objects.filter(message__conversation_id=conversation_id).delete()
+        messages._raw_delete(messages.db)
+        get_message_search().remove(ids)
+        Conversation.objects.filter(id=conversation_id).update(archived_at=archive.archived_at)
+        transaction.on_commit(lambda: context_builder.invalidate(conversation_id))
+    return archive
+
+# Compressed bytes fed to the decompressor, and decompressed bytes taken out, per step
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+def _parse(line):
+    record = json.loads(line)
+    record['timestamp'] = parse_datetime(record['timestamp'])
+    record['created_at'] = parse_datetime(record['created_at'])
+    return record
+
+def _message(conversation_id, record):
+    fields = {k: v for k, v in record.items() if k not in ('agent', 'embedding')}
+    return Message(conversation_id=conversation_id, agent_id=record['agent'], **fields)
+
+def archived_records(conversation):
+    """
+    The message records of an archived conversation, in transcript order.
+    
+    The archive is decompressed incrementally and each line parsed as it is
+    reached, so only the compressed archive and the records not yet consumed
+    are in memory, however large the transcript.
+    """
+    data = ConversationArchive.objects.filter(conversation_id=conversation.id).values_list(
+        'data', flat=True
+    ).first()
+    if data is None:
+        return
+    
+    data = memoryview(data)
+    decompressor = zlib.decompressobj()
+    pending = b''
+    for start in range(0, len(data), DECOMPRESS_CHUNK_SIZE):
+        chunk = data[start:start + DECOMPRESS_CHUNK_SIZE]
+        while chunk:
+            pending += decompressor.decompress(chunk, DECOMPRESS_CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+            *lines, pending = pending.split(b'\n')
+            for line in lines:
+                yield _parse(line)
+    pending += decompressor.flush()
+    for line in pending.split(b'\n'):
+        if line:
+            yield _parse(line)
+
+def archived_messages(conversation):
+    """Unsaved Message instances read from the archive one at a time, in transcript order."""
+    for record in archived_records(conversation):
+        yield _message(conversation.id, record)
+
+def restore_conversation(conversation_id, batch_size=None):
+    """
+    Move an archived conversation's messages back into the messages table,
+    batch_size records at a time.
+    """
+    Embedding = _embedding_model()
+    batch_size = batch_size or settings.MESSAGE_IMPORT_BATCH_SIZE
+    with transaction.atomic():
+        conversation = Conversation.objects.select_for_update().get(id=conversation_id)
+        if conversation.archived_at is None:
+            return conversation
+        
+        records = archived_records(conversation)
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            messages = [_message(conversation_id, record) for record in batch]
+            Message.objects.bulk_create(messages)
+            Embedding.objects.bulk_create([
+                Embedding(message_id=record['id'], **record['embedding'])
+                for record in batch if record.get('embedding')
+            ])
+            get_message_search().index(messages)
+            
+            # created_at is auto_now_add, so the original values are put back after the insert
+            for message, record in zip(messages, batch):
+                message.created_at = record['created_at']
+            Message.objects.bulk_update(messages, ['created_at'])
+        
+        ConversationArchive.objects.filter(conversation_id=conversation_id).delete()
+        Conversation.objects.filter(id=conversation_id).update(archived_at=None)
+        conversation.archived_at = None
+    return conversation
+
+def restore_if_archived(conversation):
+    """Bring an archived conversation back before it is written to."""
+    if conversation.archived_at is not None:
+        restore_conversation(conversation.id)
+        conversation.archived_at = None
+    return conversation
+
+def archivable(days=None):
+    """Completed, inactive conversations that finished more than days ago and are not forked."""
+    days = settings.ARCHIVE_AFTER_DAYS if days is None else days
+    return Conversation.objects.filter(
+        is_active=False,
+        archived_at__isnull=True,
+        completed_at__lt=timezone.now() - timedelta(days=days),
+        parent__isnull=True,
+        forks__isnull=True
+    )
@@ -0,0 +1,300 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+class LLMUnavailable(Exception):
+    """The provider cannot serve the call right now; the caller may try again later."""
+    pass
+
+class CircuitOpenError(LLMUnavailable):
+    pass
+
+class DeadlineExceeded(LLMUnavailable):
+    pass
+
+RETRYABLE_STATUS_CODES = (408, 500, 502, 503, 504)
+
+def is_retryable_error(error):
+    """
+    Timeouts, connection failures and 5xx responses are worth another attempt.
+    429s are not: the rate limiter already queues those.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return True
+    if getattr(error, 'status_code', None) in RETRYABLE_STATUS_CODES:
+        return True
+    # groq and openai raise their own APIConnectionError/APITimeoutError classes
+    return any(
+        cls.__name__ in ('APIConnectionError', 'TimeoutException', 'TransportError')
+        for cls in type(error).__mro__
+    )
+
+class CircuitBreaker:
+    """
+    Fails fast once the provider looks degraded.
+    
+    The breaker opens when at least LLM_CIRCUIT_FAILURE_RATE of the last
+    LLM_CIRCUIT_WINDOW calls failed (given LLM_CIRCUIT_MIN_CALLS of them). After
+    LLM_CIRCUIT_RESET_TIMEOUT seconds a single trial call is let through; its
+    outcome closes the breaker again or re-opens it.
+    """
+    def __init__(self):
+        self.state = 'closed'
+        self.opened_at = 0
+        self.trial_in_flight = False
+        self.outcomes = deque(maxlen=settings.LLM_CIRCUIT_WINDOW)
+        self.lock = threading.Lock()
+    
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < settings.LLM_CIRCUIT_RESET_TIMEOUT:
+                    return False
+                self.state = 'half_open'
+                self.trial_in_flight = False
+            if self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+    
+    def record(self, success):
+        with self.lock:
+            if self.state == 'half_open':
+                self.trial_in_flight = False
+                if success:
+                    self.state = 'closed'
+                    self.outcomes.clear()
+                else:
+                    self._open()
+                return
+            
+            self.outcomes.append(success)
+            if self.state == 'closed' and self.failure_rate() >= settings.LLM_CIRCUIT_FAILURE_RATE \
+                    and len(self.outcomes) >= settings.LLM_CIRCUIT_MIN_CALLS:
+                self._open()
+    
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        logger.warning("LLM circuit breaker opened")
+    
+    def failure_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+class LatencyTracker:
+    """Recent latencies of successful calls, for percentile estimates."""
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+    
+    def add(self, latency):
+        with self.lock:
+            self.samples.append(latency)
+    
+    def percentile(self, percent):
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+    
+    def __len__(self):
+        return len(self.samples)
+
+def round_latency(latency):
+    return None if latency is None else round(latency, 3)
+
+class CallPolicy:
+    """
+    Deadlines, retries, hedging and circuit breaking for LLM calls.
+    
+    A call gets LLM_CALL_DEADLINE seconds in total; every attempt is handed the
+    time that is left so it can pass it on as the request timeout. Retryable
+    failures are retried up to LLM_CALL_MAX_RETRIES times with exponential
+    backoff and full jitter, as long as the deadline allows.
+    
+    Idempotent calls may be hedged: when the first attempt is still running
+    after the recent p95 latency (LLM_HEDGE_PERCENTILE), a second identical
+    request is sent and whichever answers first wins. Hedges draw on a budget
+    of LLM_HEDGE_MAX_RATIO of all calls so a slow provider does not get
+    double the load.
+    
+    Breakers, latencies and the hedge budget are kept per bucket (provider and
+    model) and per process.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._latencies = {}
+        self._hedge_credits = 0.0
+        self._executor = None
+        self._pid = None
+        self._counters = {
+            'calls': 0,
+            'failures': 0,
+            'retries': 0,
+            'hedges': 0,
+            'hedge_wins': 0,
+            'deadline_exceeded': 0,
+            'short_circuited': 0,
+        }
+    
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+    
+    def breaker(self, name):
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker()
+            return self._breakers[name]
+    
+    def latencies(self, name):
+        with self._lock:
+            if name not in self._latencies:
+                self._latencies[name] = LatencyTracker()
+            return self._latencies[name]
+    
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.LLM_POOL_SIZE * 2, thread_name_prefix='llm-call'
+                )
+                self._pid = os.getpid()
+            return self._executor
+    
+    def _earn_hedge_credit(self):
+        with self._lock:
+            # Every call earns a fraction of a hedge, so hedges stay a small share
+            self._hedge_credits = min(self._hedge_credits + settings.LLM_HEDGE_MAX_RATIO, 10.0)
+    
+    def _take_hedge_credit(self):
+        with self._lock:
+            if self._hedge_credits < 1:
+                return False
+            self._hedge_credits -= 1
+            return True
+    
+    def _hedge_delay(self, name):
+        latencies = self.latencies(name)
+        if not settings.LLM_HEDGE_ENABLED or len(latencies) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return latencies.percentile(settings.LLM_HEDGE_PERCENTILE)
+    
+    def _attempt(self, name, fn, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"LLM call to {name} exceeded its deadline")
+        
+        started_at = time.monotonic()
+        result = fn(min(remaining, settings.LLM_TIMEOUT))
+        self.latencies(name).add(time.monotonic() - started_at)
+        return result
+    
+    def _hedged_attempt(self, name, fn, deadline):
+        delay = self._hedge_delay(name)
+        if delay is None or delay >= deadline - time.monotonic():
+            return self._attempt(name, fn, deadline)
+        
+        executor = self._get_executor()
+        primary = executor.submit(self._attempt, name, fn, deadline)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_hedge_credit():
+            return primary.result()
+        
+        self._count('hedges')
+        backup = executor.submit(self._attempt, name, fn, deadline)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(
+                pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                raise DeadlineExceeded(f"LLM call to {name} exceeded its deadline")
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        self._count('hedge_wins')
+                    # The slower request is left to finish; its result is dropped
+                    return future.result()
+                error = future.exception()
+        raise error
+    
+    def execute(self, name, fn, hedge=False, retry_if=None, deadline=None):
+        """
+        Call fn(timeout) under the policy for bucket name and return its result.
+        
+        hedge allows duplicate requests, so only use it for idempotent calls.
+        retry_if() is consulted before each retry, e.g. to stop retrying once a
+        stream has delivered output.
+        """
+        breaker = self.breaker(name)
+        deadline = time.monotonic() + (deadline or settings.LLM_CALL_DEADLINE)
+        self._count('calls')
+        if hedge:
+            self._earn_hedge_credit()
+        
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                self._count('short_circuited')
+                raise CircuitOpenError(f"LLM provider {name} is unavailable, try again later")
+            
+            try:
+                if hedge:
+                    result = self._hedged_attempt(name, fn, deadline)
+                else:
+                    result = self._attempt(name, fn, deadline)
+                breaker.record(True)
+                return result
+            except Exception as e:
+                retryable = is_retryable_error(e)
+                breaker.record(not retryable)
+                if isinstance(e, DeadlineExceeded):
+                    self._count('deadline_exceeded')
+                
+                backoff = random.uniform(0, min(
+                    settings.LLM_RETRY_MAX_BACKOFF, settings.LLM_RETRY_BACKOFF * 2 ** attempt
+                ))
+                if not retryable or attempt >= settings.LLM_CALL_MAX_RETRIES \
+                        or time.monotonic() + backoff >= deadline \
+                        or (retry_if is not None and not retry_if()):
+                    self._count('failures')
+                    raise
+                
+                logger.info("Retrying LLM call to %s after %s", name, e)
+                self._count('retries')
+                attempt += 1
+                time.sleep(backoff)
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            buckets = list(self._breakers.items())
+        stats['buckets'] = {}
+        for name, breaker in buckets:
+            latencies = self.latencies(name)
+            stats['buckets'][name] = {
+                'circuit': breaker.state,
+                'failure_rate': round(breaker.failure_rate(), 3),
+                'latency_p50': round_latency(latencies.percentile(50)),
+                'latency_p95': round_latency(latencies.percentile(95)),
+                'latency_p99': round_latency(latencies.percentile(99)),
+                'latency_samples': len(latencies),
+            }
+        return stats
+
+call_policy = CallPolicy()
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+class CompletionCache:
+    """
+    Content-addressed cache of LLM completions.
+    
+    Entries are keyed by a hash of everything that determines the completion and
+    live in two tiers: a bounded in-process LRU with TTL, and a shared Redis tier
+    so replays on other workers hit as well. Redis errors only cost a miss.
+    """
+    key_prefix = 'llm_completion:'
+    
+    def __init__(self, max_entries=None, ttl=None, use_redis=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            'local_hits': 0,
+            'redis_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'redis_errors': 0,
+        }
+    
+    @staticmethod
+    def make_key(provider, model, system_prompt, user_prompt, temperature, max_tokens):
+        payload = json.dumps(
+            [provider, model, system_prompt, user_prompt, temperature, max_tokens],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+    
+    def _max_entries(self):
+        return self.max_entries or settings.LLM_CACHE_MAX_ENTRIES
+    
+    def _ttl(self):
+        return self.ttl or settings.LLM_CACHE_TTL
+    
+    def _redis_enabled(self):
+        return settings.LLM_CACHE_REDIS if self.use_redis is None else self.use_redis
+    
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+    
+    def _store_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries():
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+    
+    def get(self, key):
+        """Return the cached completion for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._counters['local_hits'] += 1
+                    return value
+                del self._entries[key]
+        
+        if self._redis_enabled():
+            try:
+                value = get_redis().get(self.key_prefix + key)
+            except Exception as e:
+                logger.warning("Completion cache read failed: %s", e)
+                self._count('redis_errors')
+                value = None
+            
+            if value is not None:
+                value = value.decode()
+                self._store_local(key, value)
+                self._count('redis_hits')
+                return value
+        
+        self._count('misses')
+        return None
+    
+    def set(self, key, value):
+        self._store_local(key, value)
+        self._count('stores')
+        
+        if self._redis_enabled():
+            try:
+                get_redis().set(self.key_prefix + key, value, ex=self._ttl())
+            except Exception as e:
+                logger.warning("Completion cache write failed: %s", e)
+                self._count('redis_errors')
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        lookups = stats['local_hits'] + stats['redis_hits'] + stats['misses']
+        stats['hit_rate'] = (lookups - stats['misses']) / lookups if lookups else 0.0
+        stats['pid'] = os.getpid()
+        return stats
+
+completion_cache = CompletionCache()
@@ -1,17 +1,38 @@
 import json
 import asyncio
-from collections import deque
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Conversation, UserAccess
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Conversation
+from .access import can_access
+from .event_log import get_event_log, parse_event_id
 
 User = get_user_model()
 
 class ConversationConsumer(AsyncWebsocketConsumer):
-    # Class-level conversation queues
-    conversation_queues = {}
-    conversation_locks = {}
+    """
+    Live events of a conversation, plus a replay mode.
+    
+    A client starts a replay by sending {"type": "replay"} with an optional
+    speed multiplier, since timestamp and include_metrics flag; the stored
+    messages (and vector metric samples) are then sent as replay_message and
+    replay_metrics events, spaced by their original gaps divided by speed
+    (each gap capped at REPLAY_MAX_DELAY seconds), and closed by
+    replay_finished. replay_pause, replay_resume, replay_speed and
+    replay_stop control a running replay.
+    
+    Broadcast events carry an event_id. A client that reconnects passes the
+    last id it saw, as ?last_event_id= or in a {"type": "resume"} command,
+    and is sent the events it missed followed by resumed, or resync_required
+    if the event log no longer reaches back that far. Live events may arrive
+    while missed ones are sent, so clients skip ids they have already seen.
+    """
+    replay_task = None
     
     async def connect(self):
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
@@ -32,8 +53,15 @@ class ConversationConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        
+        # Joining the group first means no event falls between the log and live
+        last_event_id = parse_qs(self.scope.get('query_string', b'').decode()).get('last_event_id')
+        if last_event_id:
+            await self.resume(last_event_id[0])
     
     async def disconnect(self, close_code):
+        self.stop_replay()
+        
         # Leave the conversation group
         await self.channel_layer.group_discard(
             self.conversation_group_name,
@@ -41,125 +69,200 @@ class ConversationConsumer(AsyncWebsocketConsumer):
         )
     
     async def receive(self, text_data):
-        # We don't expect to receive messages from clients in this consumer
-        pass
+        # Clients only send replay commands
+        try:
+            command = json.loads(text_data)
+        except (TypeError, ValueError):
+            command = None
+        if not isinstance(command, dict):
+            await self.send_error("Commands must be JSON objects")
+            return
+        
+        kind = command.get('type')
+        if kind == 'resume':
+            await self.resume(command.get('last_event_id'))
+        elif kind == 'replay':
+            await self.start_replay(command)
+        elif kind == 'replay_stop':
+            self.stop_replay()
+        elif kind == 'replay_speed':
+            speed = self.parse_speed(command.get('speed'))
+            if speed is None:
+                await self.send_error("speed must be a number above 0")
+            else:
+                self.replay_speed = speed
+        elif kind == 'replay_pause':
+            if self.replay_task is not None:
+                self.replay_running.clear()
+        elif kind == 'replay_resume':
+            if self.replay_task is not None:
+                self.replay_running.set()
+        else:
+            await self.send_error(f"Unknown command: {kind}")
     
-    @database_sync_to_async
-    def has_conversation_access(self, user, conversation_id):
-        # Anonymous users don't have access
-        if not user.is_authenticated:
-            return False
+    async def resume(self, last_event_id):
+        """Send the logged events after last_event_id."""
+        try:
+            parse_event_id(last_event_id)
+        except (TypeError, ValueError):
+            await self.send_error("last_event_id must be an event id")
+            return
         
+        events, complete = await sync_to_async(get_event_log().since)(self.conversation_id, last_event_id)
+        if not complete:
+            await self.send(text_data=json.dumps({'type': 'resync_required'}))
+            return
+        for event_id, payload in events:
+            await self.send(text_data=json.dumps({**payload, 'event_id': event_id}))
+        await self.send(text_data=json.dumps({
+            'type': 'resumed',
+            'count': len(events),
+            'last_event_id': events[-1][0] if events else last_event_id
+        }))
+    
+    async def send_error(self, detail):
+        await self.send(text_data=json.dumps({'type': 'error', 'detail': detail}))
+    
+    @staticmethod
+    def parse_speed(value):
         try:
-            conversation = Conversation.objects.get(id=conversation_id)
-            
-            # Admin users have access to all conversations
-            if user.role == 'admin':
-                return True
-            
-            # Creator has access
-            if conversation.created_by == user:
-                return True
-            
-            # Public conversations are accessible to all authenticated users
-            if conversation.is_public:
-                return True
-            
-            # Check for explicit access
-            return UserAccess.objects.filter(
-                user=user,
-                conversation_id=conversation_id
-            ).exists()
+            speed = float(1 if value is None else value)
+        except (TypeError, ValueError):
+            return None
+        if not 0 < speed:
+            return None
+        return min(speed, settings.REPLAY_MAX_SPEED)
+    
+    async def start_replay(self, command):
+        speed = self.parse_speed(command.get('speed'))
+        if speed is None:
+            await self.send_error("speed must be a number above 0")
+            return
+        since = None
+        if command.get('since'):
+            since = parse_datetime(str(command['since']))
+            if since is None:
+                await self.send_error("since must be a datetime")
+                return
+            # Times without an offset are in the server's time zone
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        
+        # A new replay replaces the running one
+        self.stop_replay()
+        self.replay_speed = speed
+        self.replay_running = asyncio.Event()
+        self.replay_running.set()
+        try:
+            replay = await self.open_replay(bool(command.get('include_metrics', True)), since)
         except Conversation.DoesNotExist:
-            return False
+            await self.send_error("Conversation not found")
+            return
+        self.replay_task = asyncio.ensure_future(self.run_replay(replay))
     
-    async def new_message(self, event):
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'new_message',
-            'message': event['message']
-        }))
+    def stop_replay(self):
+        if self.replay_task is not None:
+            self.replay_task.cancel()
+            self.replay_task = None
+    
+    @database_sync_to_async
+    def open_replay(self, include_metrics, since):
+        from .replay import Replay
+        return Replay(self.conversation_id, include_metrics=include_metrics, since=since)
+    
+    async def run_replay(self, replay):
+        await self.send(text_data=json.dumps({'type': 'replay_started', 'speed': self.replay_speed}))
+        sent = 0
+        previous = None
+        while True:
+            events = await database_sync_to_async(replay.next_chunk)()
+            if not events:
+                break
+            for timestamp, event in events:
+                if previous is not None:
+                    gap = (timestamp - previous).total_seconds()
+                    await asyncio.sleep(min(gap, settings.REPLAY_MAX_DELAY) / self.replay_speed)
+                await self.replay_running.wait()
+                await self.send(text_data=json.dumps(event))
+                previous = timestamp
+                sent += 1
+        await self.send(text_data=json.dumps({'type': 'replay_finished', 'events': sent}))
+        self.replay_task = None
+    
+    @database_sync_to_async
+    def has_conversation_access(self, user, conversation_id):
+        # Anonymous users, unknown conversations and missing grants are all refused
+        return can_access(user, conversation_id)
     
-    async def conversation_updated(self, event):
-        # Send conversation update to WebSocket
-        await self.send(text_data=json.dumps(event))
+    async def broadcast_event(self, event):
+        # Forward a group event to the WebSocket as-is
+        await self.send(text_data=json.dumps(event['payload']))
     
     @classmethod
-    def new_message(cls, conversation_id, message):
+    def broadcast(cls, conversation_id, payload, log=True):
+        """
+        Send a payload to every subscriber of a conversation. Logged payloads
+        get an event_id that reconnecting clients resume from.
+        """
         from channels.layers import get_channel_layer
         from asgiref.sync import async_to_sync
         
+        if log:
+            event_id = get_event_log().append(conversation_id, payload)
+            if event_id is not None:
+                payload = {**payload, 'event_id': event_id}
+        
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
             f'conversation_{conversation_id}',
             {
-                'type': 'new_message',
-                'message': message
+                'type': 'broadcast_event',
+                'payload': payload
             }
         )
     
     @classmethod
-    def conversation_updated(cls, conversation_id, event):
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'conversation_{conversation_id}',
-            {
-                'type': 'conversation_updated',
-                **event
-            }
-        )
-
+    def new_message(cls, conversation_id, message):
+        cls.broadcast(conversation_id, {
+            'type': 'new_message',
+            'message': message
+        })
+    
     @classmethod
-    async def get_conversation_lock(cls, conversation_id):
-        """Get or create a lock for a specific conversation"""
-        if conversation_id not in cls.conversation_locks:
-            cls.conversation_locks[conversation_id] = asyncio.Lock()
-        return cls.conversation_locks[conversation_id]
-        
+    def messages_imported(cls, conversation_id, messages):
+        """Announce a bulk import with one event instead of one per message."""
+        cls.broadcast(conversation_id, {
+            'type': 'messages_imported',
+            'count': len(messages),
+            'first_timestamp': messages[0].timestamp.isoformat(),
+            'last_timestamp': messages[-1].timestamp.isoformat()
+        })
+    
     @classmethod
-    async def queue_agent_turn(cls, conversation_id, agent_id, callback):
-        """Queue an agent's turn in the conversation"""
-        if conversation_id not in cls.conversation_queues:
-            cls.conversation_queues[conversation_id] = deque()
-            
-        # Create a future to be resolved when it's this agent's turn
-        loop = asyncio.get_event_loop()
-        future = loop.create_future()
-        
-        # Add to queue
-        cls.conversation_queues[conversation_id].append((agent_id, future, callback))
-        
-        # If this is the only item in the queue, process it immediately
-        if len(cls.conversation_queues[conversation_id]) == 1:
-            await cls.process_next_turn(conversation_id)
-            
-        # Wait for this agent's turn to complete
-        return await future
-        
+    def conversation_updated(cls, conversation_id, event):
+        cls.broadcast(conversation_id, {
+            'type': 'conversation_updated',
+            **event
+        })
+    
     @classmethod
-    async def process_next_turn(cls, conversation_id):
-        """Process the next turn in the conversation queue"""
-        if not cls.conversation_queues.get(conversation_id):
-            return
-            
-        # Get the next agent in the queue
-        agent_id, future, callback = cls.conversation_queues[conversation_id][0]
-        
-        try:
-            # Get the conversation lock
-            async with await cls.get_conversation_lock(conversation_id):
-                # Execute the callback
-                result = await callback()
-                future.set_result(result)
-        except Exception as e:
-            future.set_exception(e)
-        finally:
-            # Remove from queue
-            cls.conversation_queues[conversation_id].popleft()
-            
-            # Process the next turn if there are more in the queue
-            if cls.conversation_queues[conversation_id]:
-                await cls.process_next_turn(conversation_id)
+    def message_delta(cls, conversation_id, message_id, agent_id, index, delta):
+        """
+        Broadcast a chunk of a message that is still being generated. Deltas
+        are not logged: message_completed carries the whole message.
+        """
+        cls.broadcast(conversation_id, {
+            'type': 'message_delta',
+            'message_id': message_id,
+            'agent_id': agent_id,
+            'index': index,
+            'delta': delta
+        }, log=False)
+    
+    @classmethod
+    def message_completed(cls, conversation_id, message):
+        """Broadcast the persisted message that closes a stream of deltas."""
+        cls.broadcast(conversation_id, {
+            'type': 'message_completed',
+            'message': message
+        })
@@ -0,0 +1,201 @@
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.db import transaction
+from .tokenizer import count_tokens
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+class TranscriptEntry:
+    __slots__ = ('message_id', 'agent_id', 'agent_name', 'content', 'tokens')
+    
+    def __init__(self, message_id, agent_id, agent_name, content, tokens):
+        self.message_id = message_id
+        self.agent_id = agent_id
+        self.agent_name = agent_name
+        self.content = content
+        self.tokens = tokens
+    
+    def render(self, agent_id=None):
+        sender = "You" if agent_id and self.agent_id == agent_id else self.agent_name
+        return f"{sender}: {self.content}"
+
+class Transcript:
+    """
+    Messages of one conversation in (timestamp, id) order plus a rolling summary.
+    prefix[i] is the token count of entries[:i], so the tokens of any suffix are
+    a single subtraction.
+    """
+    def __init__(self, version):
+        self.version = version
+        self.entries = []
+        self.prefix = [0]
+        self.last_key = None
+        self.summary = None
+        self.summary_upto = 0
+        self.lock = threading.Lock()
+
+class ConversationContextBuilder:
+    """
+    Assembles the conversation history sent to the LLM.
+    
+    Each conversation's transcript is cached in-process and only messages newer
+    than the last cached one are fetched on later turns. The history handed to
+    the model is the longest suffix that fits the token budget; when summaries
+    are enabled, the turns that fell out of the window are folded into a cached
+    summary that is refreshed once LLM_CONTEXT_SUMMARY_STEP more messages have
+    fallen out of it.
+    """
+    def __init__(self, max_conversations=None, summarizer=None):
+        self.max_conversations = max_conversations
+        self.summarizer = summarizer
+        self._transcripts = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _version_key(self, conversation_id):
+        return f'conversation_context_version:{conversation_id}'
+    
+    def invalidate(self, conversation_id):
+        """
+        Drop cached transcripts of a conversation in every process: the
+        version counter lives in Redis and is checked on every build. Runs
+        after the current transaction commits, so no process can cache the
+        old messages under the new version.
+        """
+        def drop():
+            with self._lock:
+                self._transcripts.pop(conversation_id, None)
+            try:
+                get_redis().incr(self._version_key(conversation_id))
+            except Exception as e:
+                logger.warning("Could not invalidate cached transcripts: %s", e)
+        
+        transaction.on_commit(drop)
+    
+    def _get_transcript(self, conversation_id):
+        try:
+            version = int(get_redis().get(self._version_key(conversation_id)) or 0)
+        except Exception as e:
+            # Without the shared version a cached transcript may be stale
+            logger.warning("Could not read transcript version: %s", e)
+            return Transcript(None)
+        max_conversations = self.max_conversations or settings.LLM_CONTEXT_CACHE_SIZE
+        
+        with self._lock:
+            transcript = self._transcripts.get(conversation_id)
+            if transcript is None or transcript.version != version:
+                transcript = Transcript(version)
+                self._transcripts[conversation_id] = transcript
+            self._transcripts.move_to_end(conversation_id)
+            
+            while len(self._transcripts) > max_conversations:
+                self._transcripts.popitem(last=False)
+        return transcript
+    
+    def _append_new_messages(self, transcript, conversation):
+        # Forks read the messages they inherit along with their own
+        messages = conversation.history()
+        if transcript.last_key:
+            messages = messages.after(*transcript.last_key)
+        messages = messages.for_context().order_by('timestamp', 'id')
+        
+        for message in messages:
+            # Messages saved before token counts were stored are counted here
+            tokens = message.content_tokens
+            if tokens is None:
+                tokens = count_tokens(message.content)
+            
+            transcript.entries.append(TranscriptEntry(
+                message.id,
+                message.agent.id,
+                message.agent.name,
+                message.content,
+                tokens
+            ))
+            transcript.prefix.append(transcript.prefix[-1] + tokens)
+            transcript.last_key = (message.timestamp, message.id)
+    
+    def _sync(self, conversation):
+        """
+        Append messages created since the last sync to the cached transcript.
+        Edits, deletions and messages inserted behind the newest one
+        invalidate the transcript instead (see conversations.signals).
+        """
+        transcript = self._get_transcript(conversation.id)
+        with transcript.lock:
+            self._append_new_messages(transcript, conversation)
+        return transcript
+    
+    def _summarize(self, transcript, upto):
+        """Fold entries[summary_upto:upto] into the rolling summary."""
+        new_entries = transcript.entries[transcript.summary_upto:upto]
+        text = "\n\n".join(entry.render() for entry in new_entries)
+        try:
+            transcript.summary = self.summarizer(transcript.summary, text)
+            transcript.summary_upto = upto
+        except Exception as e:
+            logger.warning("Could not summarize conversation history: %s", e)
+    
+    def build(self, conversation, agent_id=None, token_budget=None):
+        """Return the formatted history for the next turn, trimmed to token_budget."""
+        budget = token_budget or settings.LLM_CONTEXT_TOKEN_BUDGET
+        transcript = self._sync(conversation)
+        
+        with transcript.lock:
+            entries = transcript.entries
+            prefix = transcript.prefix
+            
+            # Oldest start whose suffix fits the budget; the newest message is always kept
+            start = bisect.bisect_left(prefix, prefix[-1] - budget)
+            start = min(start, max(len(entries) - 1, 0))
+            if settings.LLM_CONTEXT_MAX_MESSAGES:
+                start = max(start, len(entries) - settings.LLM_CONTEXT_MAX_MESSAGES)
+            
+            # Refresh the summary in steps; until then the window reaches back to
+            # where the summary ends so no turn falls between the two
+            summary = None
+            if start > 0 and self.summarizer is not None:
+                if start - transcript.summary_upto >= settings.LLM_CONTEXT_SUMMARY_STEP:
+                    self._summarize(transcript, start)
+                if transcript.summary_upto:
+                    summary = transcript.summary
+                    start = min(start, transcript.summary_upto)
+            
+            lines = [entry.render(agent_id) for entry in entries[start:]]
+        
+        if summary:
+            lines.insert(0, f"Summary of the earlier conversation: {summary}")
+        return "\n\n".join(lines)
+
+def llm_summarizer(previous_summary, new_history):
+    """Summarize older turns with the configured LLM provider."""
+    from .llm_providers import get_provider
+    from .llm_service import call_llm
+    
+    provider = get_provider()
+    prompt = "Summarize the following conversation in under 150 words, keeping names, decisions and open questions."
+    if previous_summary:
+        prompt += f"\n\nSummary so far: {previous_summary}"
+    
+    response = call_llm(
+        provider.model,
+        count_tokens(prompt) + count_tokens(new_history) + 300,
+        lambda timeout: provider.get_client().chat.completions.create(
+            model=provider.model,
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": new_history}
+            ],
+            temperature=0,
+            max_tokens=300,
+            timeout=timeout
+        )
+    )
+    return response.choices[0].message.content.strip()
+
+context_builder = ConversationContextBuilder(
+    summarizer=llm_summarizer if settings.LLM_CONTEXT_SUMMARY else None
+)
@@ -0,0 +1,126 @@
+from django.db.models import F, Q, Case, When, Value, Count, Sum, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from .models import Conversation, Message
+
+def _newer_than_last(timestamp):
+    return Q(last_message_at__isnull=True) | Q(last_message_at__lte=timestamp)
+
+def messages_added(conversation_id, messages):
+    """
+    Count newly created messages into their conversation with a single UPDATE,
+    so concurrent writers never lose an increment.
+    """
+    messages = list(messages)
+    if not messages:
+        return
+    
+    newest = max(messages, key=lambda message: (message.timestamp, message.id))
+    Conversation.objects.filter(id=conversation_id).update(
+        message_count=F('message_count') + len(messages),
+        content_tokens=F('content_tokens') + sum(m.content_tokens or 0 for m in messages),
+        thinking_tokens=F('thinking_tokens') + sum(m.thinking_tokens or 0 for m in messages),
+        last_message_at=Case(
+            When(_newer_than_last(newest.timestamp), then=Value(newest.timestamp)),
+            default=F('last_message_at')
+        ),
+        last_agent=Case(
+            When(_newer_than_last(newest.timestamp), then=Value(newest.agent_id)),
+            default=F('last_agent')
+        )
+    )
+
+def message_edited(message, previous_tokens):
+    """
+    Apply the change in token counts of an edited message, floored at zero in
+    case the counters were never backfilled. The conversation's updated_at
+    moves as well, so conditional GETs of its messages see the edit.
+    """
+    content_delta = (message.content_tokens or 0) - previous_tokens[0]
+    thinking_delta = (message.thinking_tokens or 0) - previous_tokens[1]
+    Conversation.objects.filter(id=message.conversation_id).update(
+        content_tokens=Greatest(F('content_tokens') + content_delta, Value(0)),
+        thinking_tokens=Greatest(F('thinking_tokens') + thinking_delta, Value(0)),
+        updated_at=timezone.now()
+    )
+
+def message_removed(message):
+    """
+    Take a deleted message out of its conversation's counters. updated_at moves
+    too, so the conversation's Last-Modified reflects the removal.
+    """
+    updated = Conversation.objects.filter(id=message.conversation_id, message_count__gt=0).update(
+        message_count=F('message_count') - 1,
+        updated_at=timezone.now(),
+        content_tokens=Case(
+            When(content_tokens__gte=message.content_tokens or 0,
+                 then=F('content_tokens') - (message.content_tokens or 0)),
+            default=Value(0)
+        ),
+        thinking_tokens=Case(
+            When(thinking_tokens__gte=message.thinking_tokens or 0,
+                 then=F('thinking_tokens') - (message.thinking_tokens or 0)),
+            default=Value(0)
+        )
+    )
+    
+    # Only removing the newest message moves last_message_at back
+    if updated and Conversation.objects.filter(
+        id=message.conversation_id, last_message_at__lte=message.timestamp
+    ).exists():
+        # A fork falls back to the newest message it inherited
+        conversation = Conversation.objects.only('id', 'lineage').get(id=message.conversation_id)
+        newest = conversation.history().order_by(
+            '-timestamp', '-id'
+        ).values('timestamp', 'agent_id').first()
+        Conversation.objects.filter(id=message.conversation_id).update(
+            last_message_at=newest['timestamp'] if newest else None,
+            last_agent=newest['agent_id'] if newest else None
+        )
+
+def with_forks(conversation_ids):
+    """The given conversations and every fork descending from them."""
+    ids = set(conversation_ids)
+    frontier = ids
+    while frontier:
+        frontier = set(Conversation.objects.filter(parent_id__in=frontier).values_list('id', flat=True)) - ids
+        ids |= frontier
+    return ids
+
+def repair(conversation_ids=None):
+    """
+    Recompute the counters of the given conversations (default: all) from
+    their messages, one UPDATE with correlated subqueries. Forks also count
+    the messages they inherit, so they are recomputed one by one from their
+    history. Archived conversations keep theirs, as their messages are not in
+    the table. Returns the number of conversations updated.
+    """
+    messages = Message.objects.filter(conversation=OuterRef('pk')).order_by()
+    totals = messages.values('conversation')
+    newest = messages.order_by('-timestamp', '-id')
+    
+    conversations = Conversation.objects.filter(archived_at__isnull=True)
+    if conversation_ids is not None:
+        conversations = conversations.filter(id__in=conversation_ids)
+    
+    updated = 0
+    for fork in conversations.filter(parent__isnull=False).only('id', 'lineage'):
+        history = fork.history()
+        last = history.order_by('-timestamp', '-id').values('timestamp', 'agent_id').first()
+        updated += Conversation.objects.filter(id=fork.id).update(
+            last_message_at=last['timestamp'] if last else None,
+            last_agent=last['agent_id'] if last else None,
+            **history.aggregate(
+                message_count=Count('pk'),
+                content_tokens=Coalesce(Sum('content_tokens'), 0),
+                thinking_tokens=Coalesce(Sum('thinking_tokens'), 0)
+            )
+        )
+    
+    return updated + conversations.filter(parent__isnull=True).update(
+        message_count=Coalesce(Subquery(totals.annotate(n=Count('pk')).values('n')), 0),
+        content_tokens=Coalesce(Subquery(totals.annotate(n=Sum('content_tokens')).values('n')), 0),
+        thinking_tokens=Coalesce(Subquery(totals.annotate(n=Sum('thinking_tokens')).values('n')), 0),
+        last_message_at=Subquery(newest.values('timestamp')[:1]),
+        last_agent=Subquery(newest.values('agent_id')[:1])
+    )
@@ -0,0 +1,146 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from django.conf import settings
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+def parse_event_id(event_id):
+    """An event id ("<milliseconds>-<sequence>", as in Redis streams) as a comparable tuple."""
+    milliseconds, _, sequence = str(event_id).partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+class EventLog:
+    """
+    Bounded per-conversation log of the events broadcast to WebSocket
+    subscribers, so a client that reconnects can fetch what it missed
+    instead of reloading the conversation.
+    
+    Event ids increase monotonically within a conversation. Each log keeps
+    the newest EVENT_LOG_MAX_EVENTS events and is dropped after EVENT_LOG_TTL
+    seconds without new events. since() reports whether the log still
+    reaches back to the client's last id; if not, the client has to reload.
+    """
+    def __init__(self, max_events=None, ttl=None):
+        self.max_events = max_events
+        self.ttl = ttl
+    
+    def _max_events(self):
+        return self.max_events or settings.EVENT_LOG_MAX_EVENTS
+    
+    def _ttl(self):
+        return self.ttl or settings.EVENT_LOG_TTL
+    
+    def append(self, conversation_id, payload):
+        """Log a payload and return its event id (None if it could not be logged)."""
+        raise NotImplementedError
+    
+    def since(self, conversation_id, last_event_id):
+        """
+        (events, complete): the logged (event id, payload) pairs after
+        last_event_id, oldest first, and whether none were dropped in between.
+        """
+        raise NotImplementedError
+
+class InMemoryEventLog(EventLog):
+    """Per-process log for a single worker and for tests."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        # conversation id -> (events, last id, last append time), least recently appended first
+        self._logs = OrderedDict()
+    
+    def _next_id(self, last_id):
+        milliseconds = int(time.time() * 1000)
+        if last_id is not None and milliseconds <= last_id[0]:
+            return last_id[0], last_id[1] + 1
+        return milliseconds, 0
+    
+    def append(self, conversation_id, payload):
+        now = time.monotonic()
+        with self._lock:
+            events, last_id, _ = self._logs.pop(conversation_id, (deque(maxlen=self._max_events()), None, now))
+            last_id = self._next_id(last_id)
+            events.append((last_id, payload))
+            self._logs[conversation_id] = (events, last_id, now)
+            
+            # Logs are dropped once idle for the TTL, oldest activity first
+            while self._logs:
+                oldest = next(iter(self._logs))
+                if now - self._logs[oldest][2] <= self._ttl():
+                    break
+                del self._logs[oldest]
+        return '%d-%d' % last_id
+    
+    def since(self, conversation_id, last_event_id):
+        last_id = parse_event_id(last_event_id)
+        with self._lock:
+            log = self._logs.get(conversation_id)
+            events = list(log[0]) if log else []
+        if not events or last_id < events[0][0]:
+            return [], False
+        return [('%d-%d' % event_id, payload) for event_id, payload in events if event_id > last_id], True
+
+class RedisEventLog(EventLog):
+    """
+    Log kept in one Redis stream per conversation, shared by every worker.
+    Streams are trimmed approximately to the size limit on each append, and
+    Redis errors are logged rather than failing the broadcast.
+    """
+    prefix = 'conv_events:'
+    
+    def append(self, conversation_id, payload):
+        key = f'{self.prefix}{conversation_id}'
+        try:
+            pipe = get_redis().pipeline()
+            pipe.xadd(key, {'payload': json.dumps(payload)}, maxlen=self._max_events(), approximate=True)
+            pipe.expire(key, self._ttl())
+            event_id, _ = pipe.execute()
+        except Exception as e:
+            logger.warning("Event log append failed: %s", e)
+            return None
+        return event_id.decode()
+    
+    def since(self, conversation_id, last_event_id):
+        milliseconds, sequence = parse_event_id(last_event_id)
+        key = f'{self.prefix}{conversation_id}'
+        try:
+            pipe = get_redis().pipeline()
+            pipe.xrange(key, count=1)
+            pipe.xrange(key, min=f'{milliseconds}-{sequence + 1}', count=self._max_events())
+            pipe.xrevrange(key, count=1)
+            first, events, last = pipe.execute()
+        except Exception as e:
+            logger.warning("Event log read failed: %s", e)
+            return [], False
+        
+        if not first or (milliseconds, sequence) < parse_event_id(first[0][0].decode()):
+            return [], False
+        # Trimming is approximate, so the stream can hold more than one read returns
+        if events and events[-1][0] != last[0][0]:
+            return [], False
+        return [
+            (event_id.decode(), json.loads(fields[b'payload'])) for event_id, fields in events
+        ], True
+
+EVENT_LOGS = {
+    'memory': InMemoryEventLog,
+    'redis': RedisEventLog,
+}
+
+_event_log = None
+_event_log_lock = threading.Lock()
+
+def get_event_log():
+    """Return the process-wide event log selected by EVENT_LOG_BACKEND."""
+    global _event_log
+    with _event_log_lock:
+        if _event_log is None:
+            backend = settings.EVENT_LOG_BACKEND.lower()
+            if backend not in EVENT_LOGS:
+                raise ValueError(f"Unsupported event log backend: {backend}")
+            _event_log = EVENT_LOGS[backend]()
+        return _event_log
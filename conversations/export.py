@@ -0,0 +1,98 @@
+import json
+import datetime
+import zlib
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from .models import Conversation, ConversationAgent, Message, history_filter
+
+CONVERSATION_FIELDS = (
+    'id', 'topic', 'objective', 'system_prompt', 'max_turns', 'temperature',
+    'language', 'created_by', 'is_public', 'created_at', 'updated_at',
+    'completed_at', 'is_active', 'constraints', 'message_count',
+    'content_tokens', 'thinking_tokens', 'parent', 'fork_timestamp', 'fork_message_id'
+)
+
+MESSAGE_FIELDS = (
+    'id', 'agent', 'content', 'timestamp', 'thinking', 'confidence',
+    'sentiment', 'keywords', 'embedding_id', 'content_tokens', 'thinking_tokens'
+)
+
+class RecordEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder cuts datetimes to milliseconds; keyset cursors and
+        # archives need them exact
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+def encode_record(record):
+    return json.dumps(record, cls=RecordEncoder, ensure_ascii=False).encode() + b'\n'
+
+def export_lines(conversations, chunk_size=None):
+    """
+    Yield a conversation set as NDJSON: a "conversation" record per
+    conversation, followed by its "message" records in transcript order.
+    
+    Rows are read with iterator(), which uses a server-side cursor on
+    PostgreSQL, so neither the conversations nor their messages are ever all
+    in memory. Forks are exported with the messages they inherit, and
+    messages of archived conversations come from their archive.
+    """
+    from .archive import archived_records
+    
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    rows = conversations.prefetch_related(None).values(*CONVERSATION_FIELDS, 'archived_at', 'lineage')
+    for conversation in rows.iterator(chunk_size=chunk_size):
+        lineage = conversation.pop('lineage')
+        conversation['agents'] = list(
+            ConversationAgent.objects.filter(conversation_id=conversation['id']).values_list('agent_id', flat=True)
+        )
+        yield encode_record({'type': 'conversation', **conversation})
+        
+        if conversation['archived_at'] is not None:
+            messages = (
+                {field: record[field] for field in MESSAGE_FIELDS}
+                for record in archived_records(Conversation(id=conversation['id'], archived_at=conversation['archived_at']))
+            )
+        else:
+            messages = Message.objects.filter(history_filter(conversation['id'], lineage)).order_by(
+                'timestamp', 'id'
+            ).values(*MESSAGE_FIELDS).iterator(chunk_size=chunk_size)
+        for message in messages:
+            yield encode_record({'type': 'message', 'conversation': conversation['id'], **message})
+
+def buffered(lines, size=64 * 1024):
+    """Join small lines into chunks of about size bytes before they are written."""
+    buffer = []
+    length = 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+def gzipped(chunks):
+    """Compress a stream of chunks into a single gzip member, chunk by chunk."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_response(conversations, filename, compress=False):
+    """Stream conversations as an NDJSON download, gzipped if compress is set."""
+    chunks = buffered(export_lines(conversations))
+    if compress:
+        response = StreamingHttpResponse(gzipped(chunks), content_type='application/gzip')
+        filename += '.jsonl.gz'
+    else:
+        response = StreamingHttpResponse(chunks, content_type='application/x-ndjson')
+        filename += '.jsonl'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,77 @@
+import uuid
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+from .models import Conversation, ConversationAgent
+
+# Settings a fork starts with, unless they are overridden
+INHERITED_FIELDS = (
+    'topic', 'objective', 'system_prompt', 'max_turns', 'temperature', 'language',
+    'constraints', 'enable_meta_cognition', 'enable_recursive_thinking',
+    'enable_vector_monitoring', 'enable_emergent_behavior'
+)
+
+class NotForkable(Exception):
+    pass
+
+def fork_conversation(conversation_id, message_id=None, agents=None, created_by=None, **overrides):
+    """
+    Branch a conversation after one of its messages (default: the newest).
+    
+    The fork only records its parent and the fork point; the messages before
+    it are read from the ancestors by Conversation.history() and never copied,
+    so forking costs the same whatever the length of the history. New
+    messages are written to the fork alone. The counters are taken over from
+    the parent when forking at its newest message and summed over the
+    inherited prefix otherwise. Returns the fork.
+    """
+    with transaction.atomic():
+        # Locks out new messages in the parent while the fork point is chosen
+        parent = Conversation.objects.select_for_update().get(id=conversation_id)
+        if parent.archived_at is not None:
+            raise NotForkable("Archived conversations must be restored before they are forked")
+        
+        history = parent.history()
+        if message_id is None:
+            point = history.order_by('-timestamp', '-id').values('id', 'timestamp', 'agent_id').first()
+        else:
+            point = history.filter(id=message_id).values('id', 'timestamp', 'agent_id').first()
+            if point is None:
+                raise NotForkable(f"Message {message_id} is not part of the conversation")
+        
+        fork = Conversation(
+            id=overrides.pop('id', None) or str(uuid.uuid4()),
+            created_by=created_by,
+            is_active=False,
+            parent=parent,
+            **{field: getattr(parent, field) for field in INHERITED_FIELDS}
+        )
+        for field, value in overrides.items():
+            setattr(fork, field, value)
+        
+        if point is not None:
+            fork.fork_timestamp = point['timestamp']
+            fork.fork_message_id = point['id']
+            fork.lineage = parent.fork_lineage(point['timestamp'], point['id'])
+            fork.last_message_at = point['timestamp']
+            fork.last_agent_id = point['agent_id']
+            if message_id is None:
+                fork.message_count = parent.message_count
+                fork.content_tokens = parent.content_tokens
+                fork.thinking_tokens = parent.thinking_tokens
+            else:
+                totals = history.upto(point['timestamp'], point['id']).aggregate(
+                    message_count=Count('pk'),
+                    content_tokens=Coalesce(Sum('content_tokens'), 0),
+                    thinking_tokens=Coalesce(Sum('thinking_tokens'), 0)
+                )
+                for field, value in totals.items():
+                    setattr(fork, field, value)
+        fork.save()
+        
+        if agents is None:
+            agents = parent.conversationagent_set.filter(left_at__isnull=True).values_list('agent_id', flat=True)
+        ConversationAgent.objects.bulk_create([
+            ConversationAgent(conversation=fork, agent_id=getattr(agent, 'pk', agent)) for agent in agents
+        ])
+    return fork
@@ -0,0 +1,45 @@
+import uuid
+from django.conf import settings
+from django.db import transaction
+from .models import Message
+from .context import context_builder
+from .search import get_message_search
+from . import counters
+
+def import_messages(conversation_id, rows, batch_size=None):
+    """
+    Insert validated message rows into a conversation in one transaction.
+    
+    Rows are written with bulk_create in chunks of MESSAGE_IMPORT_BATCH_SIZE,
+    so per-message signals do not fire; token counts are filled in here and
+    the conversation counters and search index are updated once for the whole
+    import. Returns
+    the created messages in transcript order.
+    """
+    batch_size = batch_size or settings.MESSAGE_IMPORT_BATCH_SIZE
+    messages = []
+    for row in rows:
+        message = Message(
+            id=row.get('id') or str(uuid.uuid4()),
+            conversation_id=conversation_id,
+            agent_id=row['agent'],
+            content=row['content'],
+            timestamp=row['timestamp'],
+            thinking=row.get('thinking'),
+            confidence=row.get('confidence'),
+            sentiment=row.get('sentiment'),
+            keywords=row.get('keywords'),
+            embedding_id=row.get('embedding_id')
+        )
+        message.update_token_counts()
+        messages.append(message)
+    messages.sort(key=lambda message: (message.timestamp, message.id))
+    
+    with transaction.atomic():
+        for start in range(0, len(messages), batch_size):
+            Message.objects.bulk_create(messages[start:start + batch_size])
+        counters.messages_added(conversation_id, messages)
+        get_message_search().index(messages)
+        # Imported messages may predate cached transcripts
+        transaction.on_commit(lambda: context_builder.invalidate(conversation_id))
+    return messages
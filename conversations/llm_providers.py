@@ -0,0 +1,201 @@
+import os
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+import httpx
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+PROVIDERS = {}
+_instances = {}
+_instances_lock = threading.Lock()
+
+def register_provider(name):
+    """Class decorator that makes a provider selectable through LLM_PROVIDER."""
+    def decorator(cls):
+        cls.name = name
+        PROVIDERS[name] = cls
+        return cls
+    return decorator
+
+def get_provider(name=None):
+    """Return the process-wide provider instance for name (default: LLM_PROVIDER)."""
+    provider = (name or settings.LLM_PROVIDER).lower()
+    
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unsupported LLM provider: {provider}")
+    
+    if provider not in _instances:
+        with _instances_lock:
+            if provider not in _instances:
+                _instances[provider] = PROVIDERS[provider]()
+    return _instances[provider]
+
+class LLMProvider:
+    """
+    Base class for LLM backends.
+    
+    Clients are built lazily on first use and then shared by every caller in the
+    process, so TLS sessions and keep-alive connections survive across turns.
+    SDK retries are turned off; retries are left to the call policy.
+    """
+    name = None
+    default_model = None
+    default_embedding_model = None
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+    
+    @property
+    def model(self):
+        return settings.LLM_MODEL or self.default_model
+    
+    @property
+    def embedding_model(self):
+        return settings.LLM_EMBEDDING_MODEL or self.default_embedding_model
+    
+    def http_options(self):
+        """Connection pool and timeout settings of the HTTP client."""
+        return {
+            'timeout': httpx.Timeout(settings.LLM_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT),
+            'limits': httpx.Limits(
+                max_connections=settings.LLM_POOL_SIZE,
+                max_keepalive_connections=settings.LLM_POOL_SIZE
+            ),
+        }
+    
+    def _check_pid(self):
+        # Connections inherited from a parent process (gunicorn/celery prefork) are unusable
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._client = None
+    
+    def get_client(self):
+        with self._lock:
+            self._check_pid()
+            if self._client is None:
+                self._client = self.create_client()
+            return self._client
+    
+    def http_client(self):
+        return httpx.Client(**self.http_options())
+    
+    def create_client(self):
+        raise NotImplementedError
+
+@register_provider('groq')
+class GroqProvider(LLMProvider):
+    default_model = "llama3-70b-8192"
+    default_embedding_model = "llama3-embedding-v1"
+    
+    def create_client(self):
+        import groq
+        return groq.Client(
+            api_key=settings.GROQ_API_KEY, http_client=self.http_client(), max_retries=0
+        )
+
+@register_provider('openai')
+class OpenAICompatibleProvider(LLMProvider):
+    """Any backend that speaks the OpenAI chat completions API (OpenAI, vLLM, Ollama, ...)."""
+    default_model = "gpt-3.5-turbo"
+    default_embedding_model = "text-embedding-ada-002"
+    
+    def _sdk(self):
+        try:
+            import openai
+        except ImportError:
+            raise ImproperlyConfigured("The openai package is required for LLM_PROVIDER=openai")
+        return openai
+    
+    def create_client(self):
+        return self._sdk().OpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            http_client=self.http_client(),
+            max_retries=0
+        )
+
+@register_provider('stub')
+class StubProvider(LLMProvider):
+    """Deterministic offline backend for load tests and local development."""
+    default_model = "stub-1"
+    default_embedding_model = "stub-embedding-1"
+    
+    def create_client(self):
+        return StubClient(latency=settings.LLM_STUB_LATENCY)
+
+STUB_VOCABULARY = (
+    "the", "idea", "agent", "model", "consider", "perhaps", "however", "pattern",
+    "question", "evidence", "together", "explore", "structure", "meaning", "signal",
+    "suggest", "context", "notice", "because", "further", "system", "reason",
+)
+
+STUB_EMBEDDING_DIMENSIONS = 1536
+
+def stub_completion_text(messages, max_tokens=None):
+    """Build a reply that depends only on the prompt, so identical prompts give identical replies."""
+    prompt = "\n".join(message["content"] for message in messages)
+    digest = hashlib.sha256(prompt.encode()).hexdigest()
+    rng = random.Random(digest)
+    word_count = min(max_tokens or 60, 60)
+    text = " ".join(rng.choice(STUB_VOCABULARY) for _ in range(word_count))
+    text = f"{text.capitalize()}."
+    
+    if "Thinking:" in prompt:
+        text += f" Thinking: stub reasoning {digest[:12]}"
+    return text
+
+def _stub_response(model, messages, text):
+    prompt_tokens = sum(len(message["content"].split()) for message in messages)
+    completion_tokens = len(text.split())
+    return SimpleNamespace(
+        model=model,
+        choices=[SimpleNamespace(
+            index=0,
+            message=SimpleNamespace(role="assistant", content=text),
+            finish_reason="stop"
+        )],
+        usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens
+        )
+    )
+
+def _stub_chunks(text):
+    words = text.split(" ")
+    for index, word in enumerate(words):
+        delta = word if index == 0 else f" {word}"
+        yield SimpleNamespace(choices=[SimpleNamespace(
+            index=0,
+            delta=SimpleNamespace(content=delta),
+            finish_reason=None
+        )])
+
+def _stub_embedding(text):
+    rng = random.Random(hashlib.sha256(text.encode()).hexdigest())
+    return SimpleNamespace(data=[SimpleNamespace(
+        index=0,
+        embedding=[rng.uniform(-1, 1) for _ in range(STUB_EMBEDDING_DIMENSIONS)]
+    )])
+
+class StubClient:
+    """Mimics the parts of the groq/openai client used by this project."""
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+        self.embeddings = SimpleNamespace(create=self._create_embedding)
+    
+    def _create_completion(self, model, messages, max_tokens=None, stream=False, **kwargs):
+        time.sleep(self.latency)
+        text = stub_completion_text(messages, max_tokens)
+        if stream:
+            return _stub_chunks(text)
+        return _stub_response(model, messages, text)
+    
+    def _create_embedding(self, model, input, **kwargs):
+        return _stub_embedding(input)
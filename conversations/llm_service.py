@@ -1,25 +1,47 @@
+import time
 import uuid
 import json
 from datetime import datetime
-import groq
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 from .models import Conversation, Message, Agent
+from .llm_providers import get_provider
+from .context import context_builder
+from .tokenizer import count_tokens
+from .completion_cache import completion_cache
+from .rate_limiter import get_rate_limiter, bucket_name, usage_tokens
+from .call_policy import call_policy, LLMUnavailable, DeadlineExceeded
 
 def get_llm_client():
-    """Get the appropriate LLM client based on settings."""
-    provider = settings.LLM_PROVIDER.lower()
-    
-    if provider == 'groq':
-        return groq.Client(api_key=settings.GROQ_API_KEY)
-    else:
-        raise ValueError(f"Unsupported LLM provider: {provider}")
+    """Get the pooled LLM client for the configured provider."""
+    return get_provider().get_client()
+
+def call_llm(model, tokens, create, usage=usage_tokens, hedge=False, retry_if=None):
+    """
+    Run create(timeout) under the call policy and within the shared rate limits.
+    create gets the time left of the attempt after waiting for rate limit
+    budget. tokens is the expected usage of one request; see
+    CallPolicy.execute for hedge and retry_if.
+    """
+    bucket = bucket_name(get_provider(), model)
+    return call_policy.execute(
+        bucket,
+        lambda timeout: get_rate_limiter().call(
+            bucket, tokens, create, usage=usage, timeout=timeout
+        ),
+        hedge=hedge,
+        retry_if=retry_if
+    )
 
 def format_conversation_history(messages, agent_id=None):
-    """Format conversation history for the LLM prompt."""
+    """
+    Format conversation history for the LLM prompt.
+    Pass messages with their agent joined, e.g. from Conversation.message_window().
+    """
     formatted_messages = []
     
     for msg in messages:
-        if agent_id and msg.agent.id == agent_id:
+        if agent_id and msg.agent_id == agent_id:
             sender = "You"
         else:
             sender = msg.agent.name
@@ -28,15 +50,25 @@ def format_conversation_history(messages, agent_id=None):
     
     return "\n\n".join(formatted_messages)
 
-def generate_agent_response(agent, conversation, messages):
+THINKING_MARKER = "Thinking:"
+RESPONSE_MAX_TOKENS = 500
+
+def build_prompts(agent, conversation, messages=None):
     """
-    Generate a response from an agent in a conversation.
-    Note: For concurrent conversations, use generate_agent_response_async instead.
+    Build the system and user prompts for an agent's turn.
+    Without an explicit message list the token-budgeted cached context is used,
+    or the conversation's message window when the context cache is disabled.
     """
-    client = get_llm_client()
-    
     # Format conversation history
-    conversation_history = format_conversation_history(messages, agent.id)
+    if messages is None and settings.LLM_CONTEXT_CACHE_SIZE:
+        conversation_history = context_builder.build(conversation, agent.id)
+    else:
+        if messages is None:
+            messages = conversation.message_window(
+                last=settings.LLM_CONTEXT_MAX_MESSAGES or None,
+                token_budget=settings.LLM_CONTEXT_TOKEN_BUDGET
+            )
+        conversation_history = format_conversation_history(messages, agent.id)
     
     # Create system prompt
     system_prompt = f"""You are {agent.name}, with the following instructions: {agent.instructions}
@@ -51,7 +83,7 @@ def generate_agent_response(agent, conversation, messages):
     """
     
     if conversation.enable_meta_cognition:
-        system_prompt += "\nInclude your thinking process by adding 'Thinking: [your thought process]' at the end of your response."
+        system_prompt += f"\nInclude your thinking process by adding '{THINKING_MARKER} [your thought process]' at the end of your response."
     
     if conversation.constraints:
         constraints = json.dumps(conversation.constraints)
@@ -64,46 +96,209 @@ def generate_agent_response(agent, conversation, messages):
     Now it's your turn to respond. Remember to stay in character as {agent.name}.
     """
     
-    # Generate response
+    return system_prompt, user_prompt
+
+def build_message_data(conversation, content, message_id=None):
+    """Split the thinking section off a completion and build the message payload."""
+    # Extract thinking if meta-cognition is enabled
+    thinking = None
+    if conversation.enable_meta_cognition and THINKING_MARKER in content:
+        parts = content.split(THINKING_MARKER)
+        content = parts[0].strip()
+        thinking = parts[1].strip() if len(parts) > 1 else None
+    
+    return {
+        "id": message_id or str(uuid.uuid4()),
+        "content": content,
+        "timestamp": datetime.now().isoformat(),
+        "thinking": thinking
+    }
+
+def get_cache_key(conversation, system_prompt, user_prompt, use_cache=None):
+    """
+    Return the completion cache key for a prompt, or None when it should not be cached.
+    By default only deterministic (temperature 0) completions are cached.
+    """
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    if use_cache is None:
+        use_cache = conversation.temperature == 0
+    if not use_cache:
+        return None
+    
+    provider = get_provider()
+    return completion_cache.make_key(
+        provider.name, provider.model, system_prompt, user_prompt,
+        conversation.temperature, RESPONSE_MAX_TOKENS
+    )
+
+def complete_prompt(conversation, system_prompt, user_prompt, use_cache=None):
+    """Run a prepared prompt through the LLM and build the message payload."""
+    client = get_llm_client()
+    
+    cache_key = get_cache_key(conversation, system_prompt, user_prompt, use_cache)
+    if cache_key:
+        content = completion_cache.get(cache_key)
+        if content is not None:
+            return build_message_data(conversation, content)
+    
+    # Generate response within the shared request and token budget
+    provider = get_provider()
+    prompt_tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
     try:
-        response = client.chat.completions.create(
-            model="llama3-70b-8192" if settings.LLM_PROVIDER.lower() == 'groq' else "gpt-3.5-turbo",
+        response = call_llm(
+            provider.model,
+            prompt_tokens + RESPONSE_MAX_TOKENS,
+            lambda timeout: client.chat.completions.create(
+                model=provider.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=conversation.temperature,
+                max_tokens=RESPONSE_MAX_TOKENS,
+                timeout=timeout
+            ),
+            hedge=True
+        )
+        
+        content = response.choices[0].message.content
+        if cache_key:
+            completion_cache.set(cache_key, content)
+        
+        return build_message_data(conversation, content)
+    except LLMUnavailable:
+        raise
+    except Exception as e:
+        raise Exception(f"Error generating response: {str(e)}")
+
+def generate_agent_response(agent, conversation, messages=None, use_cache=None):
+    """
+    Generate a response from an agent in a conversation.
+    Callers order turns with the turn scheduler (see tasks.run_conversation_turn).
+    """
+    system_prompt, user_prompt = build_prompts(agent, conversation, messages)
+    return complete_prompt(conversation, system_prompt, user_prompt, use_cache)
+
+def generate_round(agents, conversation, messages=None, use_cache=None, max_concurrency=None):
+    """
+    Generate one response per agent, all from the same snapshot of the history.
+    
+    Prompts are built up front, then the completions run concurrently on at most
+    max_concurrency threads. Returns (agent, message_data, error) tuples in the
+    order of agents, whatever order the completions finished in.
+    """
+    prompts = [build_prompts(agent, conversation, messages) for agent in agents]
+    max_concurrency = max_concurrency or settings.LLM_ROUND_MAX_CONCURRENCY
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(agents)))) as executor:
+        futures = [
+            executor.submit(complete_prompt, conversation, system_prompt, user_prompt, use_cache)
+            for system_prompt, user_prompt in prompts
+        ]
+    
+    results = []
+    for agent, future in zip(agents, futures):
+        try:
+            results.append((agent, future.result(), None))
+        except Exception as e:
+            results.append((agent, None, e))
+    return results
+
+def stream_agent_response(agent, conversation, messages=None, on_delta=None, message_id=None, use_cache=None):
+    """
+    Generate a response while streaming the visible content as it arrives.
+    
+    on_delta is called with each new chunk of response text. When meta-cognition
+    is enabled, everything from the thinking marker onwards is withheld from the
+    deltas and only returned in the final message data.
+    """
+    client = get_llm_client()
+    system_prompt, user_prompt = build_prompts(agent, conversation, messages)
+    hide_thinking = conversation.enable_meta_cognition
+    
+    # A cached completion is delivered as a single delta
+    cache_key = get_cache_key(conversation, system_prompt, user_prompt, use_cache)
+    if cache_key:
+        content = completion_cache.get(cache_key)
+        if content is not None:
+            message_data = build_message_data(conversation, content, message_id)
+            if on_delta is not None and message_data["content"]:
+                on_delta(message_data["content"])
+            return message_data
+    
+    provider = get_provider()
+    prompt_tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
+    
+    streamed = []
+    
+    def consume_stream(timeout):
+        deadline = time.monotonic() + timeout
+        stream = client.chat.completions.create(
+            model=provider.model,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
             temperature=conversation.temperature,
-            max_tokens=500
+            max_tokens=RESPONSE_MAX_TOKENS,
+            stream=True,
+            timeout=timeout
         )
         
-        content = response.choices[0].message.content
+        content = ""
+        sent = 0
+        marker_at = -1
+        for chunk in stream:
+            # The request timeout only bounds each read, so check the deadline here
+            if time.monotonic() > deadline:
+                raise DeadlineExceeded("LLM response stream exceeded its deadline")
+            
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            content += delta
+            
+            if on_delta is None or marker_at >= 0:
+                continue
+            
+            if hide_thinking:
+                # Hold back a tail that could be the start of a split marker
+                marker_at = content.find(THINKING_MARKER, sent)
+                if marker_at >= 0:
+                    visible_end = marker_at
+                else:
+                    visible_end = max(sent, len(content) - len(THINKING_MARKER) + 1)
+            else:
+                visible_end = len(content)
+            
+            if visible_end > sent:
+                streamed.append(True)
+                on_delta(content[sent:visible_end])
+                sent = visible_end
         
-        # Extract thinking if meta-cognition is enabled
-        thinking = None
-        if conversation.enable_meta_cognition and "Thinking:" in content:
-            parts = content.split("Thinking:")
-            content = parts[0].strip()
-            thinking = parts[1].strip() if len(parts) > 1 else None
+        # Flush whatever was held back once the stream ends without a marker
+        if on_delta is not None and marker_at < 0 and sent < len(content):
+            on_delta(content[sent:])
+        return content
+    
+    # The slot is held until the stream is drained; streams carry no usage, so
+    # the reservation is settled with an estimate of the streamed text. Once
+    # clients have seen deltas a retry would repeat them, so it is not attempted.
+    try:
+        content = call_llm(
+            provider.model,
+            prompt_tokens + RESPONSE_MAX_TOKENS,
+            consume_stream,
+            usage=lambda content: prompt_tokens + count_tokens(content),
+            retry_if=lambda: not streamed
+        )
         
-        # Create message object
-        message_data = {
-            "id": str(uuid.uuid4()),
-            "content": content,
-            "timestamp": datetime.now().isoformat(),
-            "thinking": thinking
-        }
+        if cache_key:
+            completion_cache.set(cache_key, content)
         
-        return message_data
+        return build_message_data(conversation, content, message_id)
+    except LLMUnavailable:
+        raise
     except Exception as e:
         raise Exception(f"Error generating response: {str(e)}")
-
-async def generate_agent_response_async(agent, conversation, messages):
-    """Async version of generate_agent_response"""
-    from .consumers import ConversationConsumer
-    
-    # Queue this agent's turn
-    return await ConversationConsumer.queue_agent_turn(
-        conversation.id,
-        agent.id,
-        lambda: generate_agent_response(agent, conversation, messages)
-    )
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from conversations.archive import archivable, archive_conversation, restore_conversation, NotArchivable
+
+class Command(BaseCommand):
+    help = "Move completed conversations older than ARCHIVE_AFTER_DAYS into compressed archives"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Archive conversations completed more than this many days ago")
+        parser.add_argument('--limit', type=int, help="Archive at most this many conversations")
+        parser.add_argument('--restore', action='append', help="Restore this conversation instead (repeatable)")
+    
+    def handle(self, *args, **options):
+        if options['restore']:
+            for conversation_id in options['restore']:
+                restore_conversation(conversation_id)
+                self.stdout.write(f"Restored {conversation_id}")
+            return
+        
+        ids = archivable(options['days']).order_by('completed_at').values_list('id', flat=True)
+        if options['limit']:
+            ids = ids[:options['limit']]
+        
+        # One transaction per conversation keeps locks short
+        archived = 0
+        raw_size = 0
+        archived_size = 0
+        for conversation_id in list(ids):
+            try:
+                archive = archive_conversation(conversation_id)
+            except NotArchivable as e:
+                self.stdout.write(f"Skipped {conversation_id}: {e}")
+                continue
+            archived += 1
+            raw_size += archive.raw_size
+            archived_size += len(archive.data)
+            self.stdout.write(f"Archived {conversation_id} ({archive.message_count} messages)")
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} conversations, {raw_size} bytes stored in {archived_size}"
+        ))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from conversations.models import Message
+from conversations.tokenizer import count_tokens, get_encoding
+from conversations import counters
+
+class Command(BaseCommand):
+    help = (
+        "Store content and thinking token counts for messages that have none, then recompute "
+        "the token totals of their conversations (and of forks inheriting them) "
+        "as repair_conversation_counters does"
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--conversation', help="Only backfill this conversation")
+        parser.add_argument('--all', action='store_true', help="Recount messages that already have counts")
+    
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        messages = Message.objects.all()
+        if options['conversation']:
+            messages = messages.filter(conversation_id=options['conversation'])
+        if not options['all']:
+            messages = messages.filter(content_tokens__isnull=True)
+        messages = messages.only('id', 'conversation_id', 'content', 'thinking').order_by('id')
+        
+        self.stdout.write(f"Counting tokens with the {get_encoding().name} tokenizer")
+        
+        # Walk the primary key so each batch is one indexed range scan
+        updated = 0
+        last_id = None
+        while True:
+            batch = messages.filter(id__gt=last_id) if last_id is not None else messages
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            
+            for message in batch:
+                message.content_tokens = count_tokens(message.content)
+                message.thinking_tokens = count_tokens(message.thinking)
+            
+            # bulk_update sends no signals, so the conversation totals are recomputed here
+            with transaction.atomic():
+                Message.objects.bulk_update(batch, ['content_tokens', 'thinking_tokens'])
+                counters.repair(counters.with_forks({message.conversation_id for message in batch}))
+            
+            updated += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f"Updated {updated} messages")
+        
+        self.stdout.write(self.style.SUCCESS(f"Backfilled token counts for {updated} messages"))
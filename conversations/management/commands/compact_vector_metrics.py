@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from conversations.timeseries import compact
+
+class Command(BaseCommand):
+    help = "Pack vector metric samples older than VECTOR_METRICS_COMPACT_AFTER into compressed blocks"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--conversation', help="Only compact this conversation")
+        parser.add_argument('--older-than', type=int, help="Compact samples older than this many seconds")
+        parser.add_argument('--block-size', type=int, help="Samples per block")
+    
+    def handle(self, *args, **options):
+        older_than = None
+        if options['older_than'] is not None:
+            older_than = timezone.now() - timedelta(seconds=options['older_than'])
+        
+        blocks, moved = compact(
+            conversation_id=options['conversation'],
+            older_than=older_than,
+            block_size=options['block_size']
+        )
+        self.stdout.write(self.style.SUCCESS(f"Packed {moved} samples into {blocks} blocks"))
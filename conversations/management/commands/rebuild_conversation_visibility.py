@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from conversations import visibility
+
+class Command(BaseCommand):
+    help = "Rebuild the per-user conversation visibility index from creators and access grants"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+    
+    def handle(self, *args, **options):
+        deleted, total = visibility.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Visibility index rebuilt: {total} rows, {deleted} stale rows removed"
+        ))
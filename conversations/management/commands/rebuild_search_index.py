@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from conversations.search import get_message_search
+
+class Command(BaseCommand):
+    help = "Create the full-text search index of messages, or rebuild the fallback inverted index"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+    
+    def handle(self, *args, **options):
+        search = get_message_search()
+        self.stdout.write(f"Rebuilding the {search.name} search index")
+        indexed = search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Search index covers {indexed} messages"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from conversations.models import Conversation
+from conversations import counters
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized message counters of conversations from their messages"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--conversation', action='append', help="Only repair this conversation (repeatable)")
+    
+    def handle(self, *args, **options):
+        if options['conversation']:
+            repaired = counters.repair(options['conversation'])
+            self.stdout.write(self.style.SUCCESS(f"Repaired {repaired} conversations"))
+            return
+        
+        # Batches keep each UPDATE short so it does not hold row locks for long
+        repaired = 0
+        ids = Conversation.objects.order_by('id').values_list('id', flat=True)
+        last_id = None
+        while True:
+            batch = list((ids.filter(id__gt=last_id) if last_id is not None else ids)[:options['batch_size']])
+            if not batch:
+                break
+            repaired += counters.repair(batch)
+            last_id = batch[-1]
+            self.stdout.write(f"Repaired {repaired} conversations")
+        
+        self.stdout.write(self.style.SUCCESS(f"Repaired counters of {repaired} conversations"))
@@ -1,6 +1,46 @@
 from django.db import models
+from django.db.models import Q, F, Sum, Count, Max, Window
+from django.db.models.functions import Coalesce, Length
 from django.conf import settings
+from django.utils.dateparse import parse_datetime
 from agents.models import Agent
+from .tokenizer import count_tokens
+
+class ConversationQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """
+        Conversations user may read: all for admins, otherwise public ones plus
+        those in the user's ConversationVisibility rows (created or shared).
+        """
+        if user.role == 'admin':
+            return self
+        visible_ids = ConversationVisibility.objects.filter(user=user).values('conversation_id')
+        return self.filter(Q(is_public=True) | Q(id__in=visible_ids))
+    
+    def with_version(self):
+        """
+        Annotate what besides the conversation row changes its detail and
+        message responses: its agents and their membership.
+        """
+        return self.annotate(
+            agent_count=Count('agents', distinct=True),
+            agents_updated_at=Max('agents__updated_at'),
+            agents_left_at=Max('conversationagent__left_at')
+        )
+
+def upto(timestamp, message_id):
+    """Messages up to and including (timestamp, message_id) in transcript order."""
+    return Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lte=message_id)
+
+def history_filter(conversation_id, lineage):
+    """
+    Filter for the transcript of a conversation: its own messages plus, for a
+    fork, the prefix it shares with each ancestor listed in lineage.
+    """
+    condition = Q(conversation_id=conversation_id)
+    for ancestor_id, timestamp, message_id in lineage or ():
+        condition |= Q(conversation_id=ancestor_id) & upto(parse_datetime(timestamp), message_id)
+    return condition
 
 class Conversation(models.Model):
     id = models.CharField(max_length=255, primary_key=True)
@@ -17,7 +57,7 @@ class Conversation(models.Model):
         blank=True,
         related_name='created_conversations'
     )
-    is_public = models.BooleanField(default=False)
+    is_public = models.BooleanField(default=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     completed_at = models.DateTimeField(null=True, blank=True)
@@ -27,6 +67,38 @@ class Conversation(models.Model):
     enable_recursive_thinking = models.BooleanField(default=True)
     enable_vector_monitoring = models.BooleanField(default=True)
     enable_emergent_behavior = models.BooleanField(default=True)
+    # Identifies the autonomous runner currently allowed to advance the conversation
+    run_token = models.CharField(max_length=64, null=True, blank=True)
+    # Turns the current runner has completed; a queued turn only runs if it is the next one
+    run_turn = models.PositiveIntegerField(default=0)
+    # Denormalized from the messages by conversations.counters
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_agent = models.ForeignKey(
+        Agent,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    content_tokens = models.PositiveBigIntegerField(default=0)
+    thinking_tokens = models.PositiveBigIntegerField(default=0)
+    # Set while the messages are moved out to a ConversationArchive
+    archived_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Forks share the messages of their parent up to the fork point, the
+    # (timestamp, id) of the last inherited message, instead of copying them
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='forks'
+    )
+    fork_timestamp = models.DateTimeField(null=True, blank=True)
+    fork_message_id = models.CharField(max_length=255, null=True, blank=True)
+    # [ancestor id, timestamp, message id] of the last message inherited from
+    # each ancestor, nearest first; set once when the fork is created
+    lineage = models.JSONField(default=list, blank=True)
     
     agents = models.ManyToManyField(
         Agent,
@@ -34,8 +106,70 @@ class Conversation(models.Model):
         related_name='conversations'
     )
     
+    objects = ConversationQuerySet.as_manager()
+    
+    COUNTER_FIELDS = (
+        'message_count', 'last_message_at', 'last_agent', 'content_tokens', 'thinking_tokens'
+    )
+    # Only changed by conversations.archive
+    ARCHIVE_FIELDS = ('archived_at',)
+    # Only changed by the autonomous runner and when it is started
+    RUN_FIELDS = ('run_turn',)
+    
     def __str__(self):
         return f"{self.topic} ({self.id})"
+    
+    def save(self, *args, **kwargs):
+        # Counters, the archive state and the runner's turn are only written
+        # through conversations.counters, conversations.archive and
+        # conversations.tasks; a full save of a stale instance must not roll
+        # them back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS + self.ARCHIVE_FIELDS + self.RUN_FIELDS
+            ]
+        super().save(*args, **kwargs)
+    
+    def history(self):
+        """All messages of the transcript, including those inherited by a fork."""
+        return Message.objects.filter(history_filter(self.id, self.lineage))
+    
+    def fork_lineage(self, timestamp, message_id):
+        """The lineage of a fork of this conversation at (timestamp, message_id)."""
+        lineage = [[self.id, timestamp.isoformat(), message_id]]
+        for ancestor_id, ancestor_timestamp, ancestor_message_id in self.lineage or ():
+            # A fork point inside the inherited prefix cuts it shorter
+            key = min((parse_datetime(ancestor_timestamp), ancestor_message_id), (timestamp, message_id))
+            lineage.append([ancestor_id, key[0].isoformat(), key[1]])
+        return lineage
+    
+    def message_window(self, last=None, token_budget=None):
+        """The newest messages of the conversation, oldest first; see MessageQuerySet.window."""
+        return self.history().window(last=last, token_budget=token_budget)
+    
+    def version(self):
+        """
+        Cheap version of the conversation for conditional GETs, as
+        (version, last modified); needs the with_version() annotations.
+        """
+        version = [
+            self.updated_at, self.message_count, self.last_message_at, self.content_tokens,
+            self.thinking_tokens, self.archived_at, self.agent_count, self.agents_updated_at,
+            self.agents_left_at
+        ]
+        return version, max(
+            timestamp for timestamp in (self.updated_at, self.last_message_at, self.agents_updated_at)
+            if timestamp is not None
+        )
+    
+    def token_totals(self):
+        """Sum of the stored content and thinking token counts of all messages."""
+        return self.history().aggregate(
+            content_tokens=Coalesce(Sum('content_tokens'), 0),
+            thinking_tokens=Coalesce(Sum('thinking_tokens'), 0)
+        )
 
 class ConversationAgent(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
@@ -46,6 +180,52 @@ class ConversationAgent(models.Model):
     class Meta:
         unique_together = ('conversation', 'agent')
 
+class MessageQuerySet(models.QuerySet):
+    # Columns needed to put messages into an LLM prompt
+    CONTEXT_FIELDS = (
+        'id', 'conversation_id', 'timestamp', 'content', 'content_tokens',
+        'agent__id', 'agent__name'
+    )
+    
+    def for_context(self):
+        """Messages with their agent joined and only the prompt columns loaded."""
+        return self.select_related('agent').only(*self.CONTEXT_FIELDS)
+    
+    def after(self, timestamp, message_id):
+        """Messages that come after (timestamp, message_id) in transcript order."""
+        return self.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id))
+    
+    def upto(self, timestamp, message_id):
+        """Messages up to and including (timestamp, message_id) in transcript order."""
+        return self.filter(upto(timestamp, message_id))
+    
+    def before(self, timestamp, message_id):
+        """Messages that come before (timestamp, message_id) in transcript order."""
+        return self.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+    
+    def window(self, last=None, token_budget=None):
+        """
+        The newest messages, at most last of them and no more than token_budget
+        tokens in total (the newest message is returned even if it alone is over
+        budget). Returns a list in transcript order, fetched with one query.
+        """
+        messages = self.for_context().order_by('-timestamp', '-id')
+        if token_budget is not None:
+            # Messages without a stored count are estimated from their length
+            tokens = Coalesce(F('content_tokens'), Length('content') / 4 + 1)
+            messages = messages.annotate(
+                window_tokens=Window(Sum(tokens), order_by=[F('timestamp').desc(), F('id').desc()])
+            )
+            fitting = messages.filter(window_tokens__lte=token_budget)
+        else:
+            fitting = messages
+        
+        window = list(fitting[:last] if last else fitting)
+        if not window and token_budget is not None:
+            window = list(messages[:1])
+        window.reverse()
+        return window
+
 class Message(models.Model):
     id = models.CharField(max_length=255, primary_key=True)
     conversation = models.ForeignKey(
@@ -65,13 +245,45 @@ class Message(models.Model):
     sentiment = models.CharField(max_length=50, null=True, blank=True)
     keywords = models.JSONField(null=True, blank=True)
     embedding_id = models.CharField(max_length=255, null=True, blank=True)
+    # Token counts are filled in on save; null means not counted yet (see backfill_token_counts)
+    content_tokens = models.PositiveIntegerField(null=True, blank=True)
+    thinking_tokens = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = MessageQuerySet.as_manager()
+    
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Serves keyset reads of a conversation in transcript order
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='message_conv_ts_id_idx'),
+        ]
     
     def __str__(self):
         return f"Message from {self.agent.name} in {self.conversation.id}"
+    
+    def update_token_counts(self):
+        self.content_tokens = count_tokens(self.content)
+        self.thinking_tokens = count_tokens(self.thinking)
+    
+    def is_shared(self):
+        """Whether a fork of the conversation inherits this message."""
+        return Conversation.objects.filter(parent_id=self.conversation_id).filter(
+            Q(fork_timestamp__gt=self.timestamp)
+            | Q(fork_timestamp=self.timestamp, fork_message_id__gte=self.id)
+        ).exists()
+    
+    def save(self, *args, **kwargs):
+        # Remember what the conversation totals currently include for this message
+        self._counted_tokens = (self.content_tokens or 0, self.thinking_tokens or 0)
+        
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.update_token_counts()
+        elif {'content', 'thinking'} & set(update_fields):
+            self.update_token_counts()
+            kwargs['update_fields'] = set(update_fields) | {'content_tokens', 'thinking_tokens'}
+        super().save(*args, **kwargs)
 
 class VectorMetrics(models.Model):
     conversation = models.ForeignKey(
@@ -89,12 +301,49 @@ class VectorMetrics(models.Model):
     pattern_persistence = models.FloatField()
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # The metric columns, in the order they are packed into blocks
+    METRIC_FIELDS = (
+        'asymmetric_cognition', 'meta_language_coherence', 'recursive_depth',
+        'incompleteness_tolerance', 'cognitive_transparency', 'non_monotonic_exploration',
+        'pattern_persistence'
+    )
+    
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['conversation', 'timestamp'], name='vector_metrics_conv_ts_idx'),
+        ]
     
     def __str__(self):
         return f"Metrics for {self.conversation.id} at {self.timestamp}"
 
+class VectorMetricsBlock(models.Model):
+    """
+    Samples of one conversation between start and end, moved out of
+    VectorMetrics rows by conversations.timeseries.compact and stored
+    column-wise: delta-encoded timestamps and one float64 array per metric,
+    zlib-compressed.
+    """
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='vector_metric_blocks'
+    )
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    sample_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['start']
+        indexes = [
+            models.Index(fields=['conversation', 'start'], name='vector_block_conv_start_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Metrics block for {self.conversation_id} from {self.start} to {self.end}"
+
 class UserAccess(models.Model):
     ACCESS_CHOICES = (
         ('view', 'View'),
@@ -127,3 +376,69 @@ class UserAccess(models.Model):
     
     def __str__(self):
         return f"{self.user.email} has {self.access_level} access to {self.conversation.id}"
+
+class ConversationVisibility(models.Model):
+    """
+    Materialized (user, conversation) pairs for private conversations the user
+    can read, i.e. created or was granted access to. Public conversations are
+    matched on is_public instead. Maintained by conversations.visibility.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='conversation_visibility'
+    )
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='visibility'
+    )
+    
+    class Meta:
+        unique_together = ('user', 'conversation')
+    
+    def __str__(self):
+        return f"{self.conversation_id} visible to {self.user_id}"
+
+class ConversationArchive(models.Model):
+    """
+    The messages of an archived conversation as one immutable, compressed
+    segment: zlib-compressed NDJSON, one message record per line in
+    transcript order. Written and read by conversations.archive.
+    """
+    conversation = models.OneToOneField(
+        Conversation,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='archive'
+    )
+    format = models.PositiveSmallIntegerField(default=1)
+    data = models.BinaryField()
+    message_count = models.PositiveIntegerField()
+    raw_size = models.PositiveBigIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Archive of {self.conversation_id}"
+
+class MessageSearchTerm(models.Model):
+    """
+    Inverted index entry for the fallback message search: the positions of
+    one word in one message. Kept by conversations.search on databases
+    without full-text search; PostgreSQL uses a tsvector GIN index instead.
+    """
+    TERM_LENGTH = 64
+    
+    # Not a foreign key, so archiving can drop messages without touching the index first
+    message_id = models.CharField(max_length=255)
+    term = models.CharField(max_length=TERM_LENGTH)
+    positions = models.JSONField()
+    
+    class Meta:
+        unique_together = ('term', 'message_id')
+        indexes = [
+            models.Index(fields=['message_id'], name='message_search_term_msg_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.term} in {self.message_id}"
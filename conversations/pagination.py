@@ -0,0 +1,121 @@
+import json
+import base64
+from collections import deque
+from urllib.parse import urlencode
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from django.db.models import QuerySet
+from django.utils.dateparse import parse_datetime
+
+class MessageKeysetPagination(BasePagination):
+    """
+    Keyset pagination over messages in (timestamp, id) order.
+    
+    Without a cursor the newest page is returned. ?since=<cursor> returns the
+    messages after a cursor and ?before=<cursor> the ones before it, so clients
+    can poll for new messages and scroll back through history. Every page is a
+    range scan on the (conversation, timestamp, id) index, however deep it is.
+    Other iterables of messages in transcript order (archived conversations)
+    are paged the same way in a single pass that keeps at most one page.
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'limit'
+    since_query_param = 'since'
+    before_query_param = 'before'
+    invalid_cursor_message = 'Invalid cursor'
+    
+    def encode_cursor(self, message):
+        payload = json.dumps([message.timestamp.isoformat(), message.id])
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+    
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            timestamp, message_id = json.loads(base64.urlsafe_b64decode(padded).decode())
+            timestamp = parse_datetime(timestamp)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+        return timestamp, message_id
+    
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limit = self.get_page_size(request)
+        since = self.decode_cursor(request.query_params.get(self.since_query_param))
+        before = self.decode_cursor(request.query_params.get(self.before_query_param))
+        
+        # Read towards the requested side; one extra row tells whether there is more
+        self.forward = since is not None and before is None
+        if not isinstance(queryset, QuerySet):
+            rows = self.slice_messages(queryset, since, before, limit + 1)
+        else:
+            if since:
+                queryset = queryset.after(*since)
+            if before:
+                queryset = queryset.before(*before)
+            if self.forward:
+                rows = list(queryset.order_by('timestamp', 'id')[:limit + 1])
+            else:
+                rows = list(queryset.order_by('-timestamp', '-id')[:limit + 1])
+        
+        self.has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not self.forward:
+            rows.reverse()
+        
+        self.since_cursor = self.encode_cursor(rows[-1]) if rows else request.query_params.get(self.since_query_param)
+        self.before_cursor = self.encode_cursor(rows[0]) if rows else request.query_params.get(self.before_query_param)
+        self.limit = limit
+        self.page = rows
+        return rows
+    
+    def slice_messages(self, messages, since, before, count):
+        window = deque(maxlen=count)
+        for message in messages:
+            key = (message.timestamp, message.id)
+            if since and key <= since:
+                continue
+            if before and key >= before:
+                break
+            window.append(message)
+            if self.forward and len(window) == count:
+                break
+        return list(window) if self.forward else list(window)[::-1]
+    
+    def get_link(self, param, cursor):
+        if not cursor:
+            return None
+        url = self.request.build_absolute_uri(self.request.path)
+        query = {param: cursor, self.page_size_query_param: self.limit}
+        return f"{url}?{urlencode(query)}"
+    
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.since_query_param, self.since_cursor),
+            'previous': self.get_link(self.before_query_param, self.before_cursor),
+            'has_more': self.has_more,
+            'results': data,
+        })
+    
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'has_more': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,33 @@
+import json
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+class NDJSONParser(BaseParser):
+    """Newline-delimited JSON: one object per line, parsed into a list."""
+    media_type = 'application/x-ndjson'
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+        items = []
+        for number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line.decode(encoding)))
+            except ValueError as e:
+                raise ParseError(f'NDJSON parse error on line {number} - {e}')
+        return items
+
+class MessagePackParser(BaseParser):
+    """MessagePack request bodies (Content-Type: application/msgpack)."""
+    media_type = 'application/msgpack'
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        import msgpack
+        
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise ParseError(f'MessagePack parse error - {e}')
@@ -0,0 +1,443 @@
+import time
+import uuid
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from .redis_client import get_redis
+from .call_policy import LLMUnavailable
+
+logger = logging.getLogger(__name__)
+
+class RateLimitTimeout(LLMUnavailable):
+    """Raised when an LLM call could not get budget within the wait timeout."""
+    pass
+
+def is_rate_limit_error(error):
+    """Whether error is a 429 from the provider SDK (groq and openai both expose status_code)."""
+    return getattr(error, 'status_code', None) == 429
+
+def retry_after(error):
+    """Seconds the provider asked us to wait, from the Retry-After header if present."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return max(float(headers.get('retry-after')), 0)
+    except (TypeError, ValueError):
+        return 1.0
+
+def bucket_name(provider, model):
+    """Provider limits apply per model, so every model gets its own bucket."""
+    return f"{provider.name}:{model}"
+
+def usage_tokens(response):
+    """Total tokens reported by the provider for a completion or embedding, if any."""
+    usage = getattr(response, 'usage', None)
+    return getattr(usage, 'total_tokens', None)
+
+class RateLimitSlot:
+    """Budget held by one call; record_usage() settles the token reservation."""
+    def __init__(self, limiter, name, lease, tokens):
+        self.limiter = limiter
+        self.name = name
+        self.lease = lease
+        self.tokens = tokens
+        self.used_tokens = tokens
+        self.started_at = time.monotonic()
+    
+    def record_usage(self, tokens):
+        if tokens:
+            self.used_tokens = tokens
+
+class LLMRateLimiter:
+    """
+    Shared budget for calls to the LLM provider.
+    
+    Every bucket (one per provider and model) enforces LLM_REQUESTS_PER_MINUTE
+    and LLM_TOKENS_PER_MINUTE with token buckets that refill continuously and
+    can burst up to one minute's worth. Tokens are reserved up front from an
+    estimate and settled against the usage reported by the provider.
+    
+    Concurrency is adapted AIMD-style: each fast success raises the bucket's
+    in-flight limit by 1/limit, while a 429 or a call slower than
+    LLM_LATENCY_TARGET multiplies it by LLM_CONCURRENCY_BACKOFF (at most once
+    per second, so one burst of failures counts once). A 429 also pauses the
+    bucket for the provider's Retry-After.
+    
+    Callers that find no budget wait for it instead of failing, for up to
+    LLM_RATE_LIMIT_WAIT_TIMEOUT seconds.
+    """
+    decrease_cooldown = 1.0
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            'acquired': 0,
+            'waited': 0,
+            'wait_seconds': 0.0,
+            'throttled': 0,
+            'slow': 0,
+            'timeouts': 0,
+        }
+    
+    def try_acquire(self, name, lease, tokens):
+        """Take budget for one call. Returns 0 when granted, else the seconds to wait."""
+        raise NotImplementedError
+    
+    def release(self, name, lease, token_delta, outcome, latency, pause):
+        """Return the concurrency slot, settle tokens and adapt the concurrency limit."""
+        raise NotImplementedError
+    
+    def bucket_stats(self):
+        """Current state of every bucket, keyed by bucket name."""
+        raise NotImplementedError
+    
+    def _limits(self):
+        return (
+            settings.LLM_REQUESTS_PER_MINUTE,
+            settings.LLM_TOKENS_PER_MINUTE,
+            settings.LLM_CONCURRENCY_MIN,
+            settings.LLM_CONCURRENCY_MAX,
+            settings.LLM_CONCURRENCY_INITIAL,
+        )
+    
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+    
+    @contextmanager
+    def limit(self, name, tokens, timeout=None):
+        """Wait for budget for a call expected to use tokens, then hold a slot for it."""
+        if not settings.LLM_RATE_LIMIT_ENABLED:
+            yield RateLimitSlot(self, name, None, tokens)
+            return
+        
+        timeout = settings.LLM_RATE_LIMIT_WAIT_TIMEOUT if timeout is None else timeout
+        started_at = time.monotonic()
+        deadline = started_at + timeout
+        lease = uuid.uuid4().hex
+        
+        waited = False
+        while True:
+            wait = self.try_acquire(name, lease, tokens)
+            if not wait:
+                break
+            waited = True
+            if time.monotonic() + wait > deadline:
+                self._count('timeouts')
+                raise RateLimitTimeout(f"No LLM budget for {name} within {timeout}s")
+            # Jitter keeps waiters from waking up in lockstep
+            time.sleep(wait * random.uniform(1, 1.2))
+        
+        self._count('acquired')
+        if waited:
+            self._count('waited')
+            self._count('wait_seconds', time.monotonic() - started_at)
+        
+        slot = RateLimitSlot(self, name, lease, tokens)
+        outcome, pause = 'ok', 0
+        try:
+            yield slot
+        except Exception as e:
+            if is_rate_limit_error(e):
+                outcome, pause = 'throttled', retry_after(e)
+                self._count('throttled')
+            else:
+                outcome = 'error'
+            raise
+        finally:
+            latency = time.monotonic() - slot.started_at
+            if outcome == 'ok' and latency > settings.LLM_LATENCY_TARGET:
+                self._count('slow')
+            try:
+                self.release(name, lease, slot.used_tokens - tokens, outcome, latency, pause)
+            except Exception as e:
+                logger.warning("Could not release LLM rate limit slot: %s", e)
+    
+    def call(self, name, tokens, fn, usage=None, timeout=None):
+        """
+        Run fn(timeout) within the budget, queueing again after a 429.
+        fn is handed what is left of timeout once the budget was granted, so
+        time spent waiting is not added on top of the call (None without a
+        timeout). usage(result) returns the tokens actually used, when the
+        provider reports them.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        attempts = settings.LLM_RATE_LIMIT_MAX_RETRIES + 1
+        for attempt in range(attempts):
+            try:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                with self.limit(name, tokens, remaining) as slot:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._count('timeouts')
+                        raise RateLimitTimeout(f"No time left for the call to {name} after waiting for budget")
+                    result = fn(remaining)
+                    if usage is not None:
+                        slot.record_usage(usage(result))
+                    return result
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == attempts - 1:
+                    raise
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['enabled'] = settings.LLM_RATE_LIMIT_ENABLED
+        stats['buckets'] = self.bucket_stats()
+        return stats
+
+def bucket_summary(requests, tokens, in_flight, concurrency_limit, blocked_for):
+    """Shape the state of one bucket for the metrics endpoint."""
+    rpm = settings.LLM_REQUESTS_PER_MINUTE
+    tpm = settings.LLM_TOKENS_PER_MINUTE
+    return {
+        'requests_per_minute': rpm,
+        'tokens_per_minute': tpm,
+        'requests_available': round(requests, 2),
+        'tokens_available': round(tokens),
+        'request_utilization': round(1 - requests / rpm, 3),
+        'token_utilization': round(1 - tokens / tpm, 3),
+        'in_flight': in_flight,
+        'concurrency_limit': round(concurrency_limit, 2),
+        'blocked_for': round(blocked_for, 3),
+    }
+
+class InMemoryRateLimiter(LLMRateLimiter):
+    """Per-process limiter with the same semantics, used in tests and development."""
+    def __init__(self):
+        super().__init__()
+        self._buckets = {}
+    
+    def _bucket(self, name, now):
+        rpm, tpm, _, _, initial = self._limits()
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            bucket = self._buckets[name] = {
+                'requests': rpm, 'tokens': tpm, 'updated_at': now,
+                'limit': initial, 'blocked_until': 0, 'decreased_at': 0, 'leases': {},
+            }
+        
+        elapsed = max(now - bucket['updated_at'], 0)
+        bucket['requests'] = min(rpm, bucket['requests'] + elapsed * rpm / 60)
+        bucket['tokens'] = min(tpm, bucket['tokens'] + elapsed * tpm / 60)
+        bucket['updated_at'] = now
+        for lease, expires_at in list(bucket['leases'].items()):
+            if expires_at <= now:
+                del bucket['leases'][lease]
+        return bucket
+    
+    def try_acquire(self, name, lease, tokens):
+        rpm, tpm, _, _, _ = self._limits()
+        tokens = min(tokens, tpm)
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(name, now)
+            if bucket['blocked_until'] > now:
+                return bucket['blocked_until'] - now
+            if len(bucket['leases']) >= max(1, int(bucket['limit'])):
+                return settings.LLM_RATE_LIMIT_POLL_INTERVAL
+            
+            wait = max(
+                (1 - bucket['requests']) * 60 / rpm,
+                (tokens - bucket['tokens']) * 60 / tpm
+            )
+            if wait > 0:
+                return wait
+            
+            bucket['requests'] -= 1
+            bucket['tokens'] -= tokens
+            bucket['leases'][lease] = now + settings.LLM_RATE_LIMIT_LEASE_TTL
+            return 0
+    
+    def release(self, name, lease, token_delta, outcome, latency, pause):
+        _, tpm, minimum, maximum, _ = self._limits()
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(name, now)
+            bucket['leases'].pop(lease, None)
+            bucket['tokens'] = max(bucket['tokens'] - token_delta, -tpm)
+            
+            if outcome == 'throttled':
+                bucket['blocked_until'] = max(bucket['blocked_until'], now + pause)
+            
+            if outcome == 'throttled' or (outcome == 'ok' and latency > settings.LLM_LATENCY_TARGET):
+                if now - bucket['decreased_at'] >= self.decrease_cooldown:
+                    bucket['limit'] = max(minimum, bucket['limit'] * settings.LLM_CONCURRENCY_BACKOFF)
+                    bucket['decreased_at'] = now
+            elif outcome == 'ok':
+                bucket['limit'] = min(maximum, bucket['limit'] + 1 / bucket['limit'])
+    
+    def bucket_stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                name: bucket_summary(
+                    bucket['requests'], bucket['tokens'], len(bucket['leases']),
+                    bucket['limit'], max(bucket['blocked_until'] - now, 0)
+                )
+                for name, bucket in ((name, self._bucket(name, now)) for name in list(self._buckets))
+            }
+
+# Refills the bucket to the current Redis time and drops expired leases.
+# Expects prefix, name, rpm, tpm and the initial concurrency limit in ARGV[1..5].
+LUA_COMMON = """
+local prefix = ARGV[1]
+local name = ARGV[2]
+local rpm = tonumber(ARGV[3])
+local tpm = tonumber(ARGV[4])
+local bucket = prefix .. 'bucket:' .. name
+local inflight = prefix .. 'inflight:' .. name
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local state = redis.call('HMGET', bucket, 'requests', 'tokens', 'updated_at', 'limit', 'blocked_until', 'decreased_at')
+local requests = tonumber(state[1]) or rpm
+local tokens = tonumber(state[2]) or tpm
+local updated_at = tonumber(state[3]) or now
+local limit = tonumber(state[4]) or tonumber(ARGV[5])
+local blocked_until = tonumber(state[5]) or 0
+local decreased_at = tonumber(state[6]) or 0
+
+local elapsed = math.max(now - updated_at, 0)
+requests = math.min(rpm, requests + elapsed * rpm / 60000)
+tokens = math.min(tpm, tokens + elapsed * tpm / 60000)
+redis.call('ZREMRANGEBYSCORE', inflight, '-inf', now)
+
+local function save()
+    redis.call('HSET', bucket,
+        'requests', tostring(requests), 'tokens', tostring(tokens), 'updated_at', now,
+        'limit', tostring(limit), 'blocked_until', blocked_until, 'decreased_at', decreased_at)
+    redis.call('PEXPIRE', bucket, 3600000)
+    redis.call('SADD', prefix .. 'buckets', name)
+end
+"""
+
+# ARGV[6..9]: lease, tokens, lease ttl (ms), poll interval (ms). Returns 0 or the ms to wait.
+LUA_ACQUIRE = LUA_COMMON + """
+local lease = ARGV[6]
+local wanted = math.min(tonumber(ARGV[7]), tpm)
+
+if blocked_until > now then
+    save()
+    return blocked_until - now
+end
+if redis.call('ZCARD', inflight) >= math.max(1, math.floor(limit)) then
+    save()
+    return tonumber(ARGV[9])
+end
+
+local wait = math.max((1 - requests) * 60000 / rpm, (wanted - tokens) * 60000 / tpm)
+if wait > 0 then
+    save()
+    return math.ceil(wait)
+end
+
+requests = requests - 1
+tokens = tokens - wanted
+redis.call('ZADD', inflight, now + tonumber(ARGV[8]), lease)
+redis.call('PEXPIRE', inflight, tonumber(ARGV[8]))
+save()
+return 0
+"""
+
+# ARGV[6..15]: lease, token delta, outcome, latency (ms), latency target (ms),
+# pause (ms), min and max limit, backoff factor, decrease cooldown (ms).
+LUA_RELEASE = LUA_COMMON + """
+local outcome = ARGV[8]
+redis.call('ZREM', inflight, ARGV[6])
+tokens = math.max(tokens - tonumber(ARGV[7]), -tpm)
+
+if outcome == 'throttled' then
+    blocked_until = math.max(blocked_until, now + tonumber(ARGV[11]))
+end
+
+if outcome == 'throttled' or (outcome == 'ok' and tonumber(ARGV[9]) > tonumber(ARGV[10])) then
+    if now - decreased_at >= tonumber(ARGV[15]) then
+        limit = math.max(tonumber(ARGV[12]), limit * tonumber(ARGV[14]))
+        decreased_at = now
+    end
+elseif outcome == 'ok' then
+    limit = math.min(tonumber(ARGV[13]), limit + 1 / limit)
+end
+save()
+return 1
+"""
+
+LUA_STATS = LUA_COMMON + """
+return {tostring(requests), tostring(tokens), redis.call('ZCARD', inflight),
+        tostring(limit), math.max(blocked_until - now, 0)}
+"""
+
+class RedisRateLimiter(LLMRateLimiter):
+    """Limiter whose buckets live in Redis so that every worker draws from the same budget."""
+    prefix = 'llm_rate:'
+    
+    def __init__(self):
+        super().__init__()
+        self._scripts = {}
+    
+    def _script(self, source):
+        redis_client = get_redis()
+        key = (id(redis_client), source)
+        if key not in self._scripts:
+            self._scripts[key] = redis_client.register_script(source)
+        return self._scripts[key]
+    
+    def _args(self, name):
+        rpm, tpm, _, _, initial = self._limits()
+        return [self.prefix, name, rpm, tpm, initial]
+    
+    def try_acquire(self, name, lease, tokens):
+        wait = self._script(LUA_ACQUIRE)(args=self._args(name) + [
+            lease,
+            tokens,
+            int(settings.LLM_RATE_LIMIT_LEASE_TTL * 1000),
+            int(settings.LLM_RATE_LIMIT_POLL_INTERVAL * 1000),
+        ])
+        return wait / 1000
+    
+    def release(self, name, lease, token_delta, outcome, latency, pause):
+        _, _, minimum, maximum, _ = self._limits()
+        self._script(LUA_RELEASE)(args=self._args(name) + [
+            lease,
+            token_delta,
+            outcome,
+            int(latency * 1000),
+            int(settings.LLM_LATENCY_TARGET * 1000),
+            int(pause * 1000),
+            minimum,
+            maximum,
+            settings.LLM_CONCURRENCY_BACKOFF,
+            int(self.decrease_cooldown * 1000),
+        ])
+    
+    def bucket_stats(self):
+        stats = {}
+        for name in sorted(get_redis().smembers(self.prefix + 'buckets')):
+            name = name.decode()
+            requests, tokens, in_flight, limit, blocked_for = self._script(LUA_STATS)(args=self._args(name))
+            stats[name] = bucket_summary(
+                float(requests), float(tokens), in_flight, float(limit), blocked_for / 1000
+            )
+        return stats
+
+RATE_LIMITERS = {
+    'memory': InMemoryRateLimiter,
+    'redis': RedisRateLimiter,
+}
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    """Return the process-wide limiter selected by LLM_RATE_LIMIT_BACKEND."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            backend = settings.LLM_RATE_LIMIT_BACKEND.lower()
+            if backend not in RATE_LIMITERS:
+                raise ValueError(f"Unsupported LLM rate limit backend: {backend}")
+            _rate_limiter = RATE_LIMITERS[backend]()
+        return _rate_limiter
@@ -0,0 +1,17 @@
+import os
+import threading
+import redis
+from django.conf import settings
+
+_client = None
+_pid = None
+_lock = threading.Lock()
+
+def get_redis():
+    """Return the process-wide Redis client, reconnecting after a fork."""
+    global _client, _pid
+    with _lock:
+        if _client is None or _pid != os.getpid():
+            _client = redis.Redis.from_url(settings.REDIS_URL)
+            _pid = os.getpid()
+        return _client
@@ -0,0 +1,38 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Fallback for types the fast encoders do not know (lazy strings, Decimal, ...)
+_encoder = JSONEncoder()
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    application/json rendered with orjson, several times faster than the
+    standard library encoder on large message lists. Falls back to the regular
+    JSONRenderer when orjson is not installed.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        try:
+            import orjson
+        except ImportError:
+            return super().render(data, accepted_media_type, renderer_context)
+        
+        if data is None:
+            return b''
+        option = orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_encoder.default, option=option)
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack responses for clients that send Accept: application/msgpack."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        import msgpack
+        
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_encoder.default, use_bin_type=True)
@@ -0,0 +1,104 @@
+from itertools import islice
+from django.conf import settings
+from agents.models import Agent
+from .models import Conversation
+from .serializers import MessageSerializer
+from . import timeseries
+
+class Replay:
+    """
+    Reads the timeline of a conversation, its messages and optionally its
+    vector metric samples merged in time order, a chunk at a time.
+    
+    Each chunk is a fresh keyset query that continues after the last row
+    read, so memory stays flat however long the conversation is and no
+    database cursor is held open between chunks (a replay spans many
+    database_sync_to_async calls, each of which may close the connection).
+    """
+    def __init__(self, conversation_id, include_metrics=True, since=None, chunk_size=None):
+        self.conversation = Conversation.objects.only('id', 'lineage', 'archived_at').get(id=conversation_id)
+        self.include_metrics = include_metrics
+        self.since = since
+        self.chunk_size = chunk_size or settings.REPLAY_CHUNK_SIZE
+        
+        self.messages = []
+        self.message_key = None
+        self.messages_done = False
+        self.archived = None
+        
+        self.samples = []
+        self.sample_time = timeseries.to_micros(since) if since is not None else None
+        self.sample_skip = 0
+        self.samples_done = not include_metrics
+    
+    def _fetch_messages(self):
+        if self.conversation.archived_at is not None:
+            # Archived messages are streamed from the archive instead, decoded once
+            if self.archived is None:
+                from .archive import archived_messages
+                self.archived = archived_messages(self.conversation)
+                if self.since is not None:
+                    self.archived = (message for message in self.archived if message.timestamp >= self.since)
+            messages = list(islice(self.archived, self.chunk_size))
+            agents = Agent.objects.in_bulk({message.agent_id for message in messages})
+            for message in messages:
+                message.agent = agents.get(message.agent_id)
+        else:
+            messages = self.conversation.history().select_related('agent').order_by('timestamp', 'id')
+            if self.message_key is not None:
+                messages = messages.after(*self.message_key)
+            elif self.since is not None:
+                messages = messages.filter(timestamp__gte=self.since)
+            messages = list(messages[:self.chunk_size])
+            if messages:
+                self.message_key = (messages[-1].timestamp, messages[-1].id)
+        
+        self.messages_done = len(messages) < self.chunk_size
+        self.messages = [
+            (message.timestamp, {'type': 'replay_message', 'message': data})
+            for message, data in zip(messages, MessageSerializer(messages, many=True).data)
+        ][::-1]
+    
+    def _fetch_samples(self):
+        # Samples have no id to continue after, so a chunk skips the ones
+        # already sent that share the last sent timestamp
+        samples = list(islice(
+            timeseries.samples(self.conversation.id, since=self.sample_time),
+            self.sample_skip + self.chunk_size
+        ))[self.sample_skip:]
+        self.samples_done = len(samples) < self.chunk_size
+        if samples:
+            last = samples[-1][0]
+            same = sum(1 for time, _ in samples if time == last)
+            if last == self.sample_time:
+                self.sample_skip += same
+            else:
+                self.sample_time = last
+                self.sample_skip = same
+        
+        self.samples = []
+        for time, values in reversed(samples):
+            timestamp = timeseries.from_micros(time)
+            metrics = dict(zip(timeseries.METRIC_FIELDS, values), timestamp=timestamp.isoformat())
+            self.samples.append((timestamp, {'type': 'replay_metrics', 'metrics': metrics}))
+    
+    def next_chunk(self):
+        """
+        Up to chunk_size (timestamp, event) pairs in time order; an empty list
+        once the timeline is exhausted.
+        """
+        events = []
+        while len(events) < self.chunk_size:
+            if not self.messages and not self.messages_done:
+                self._fetch_messages()
+            if not self.samples and not self.samples_done:
+                self._fetch_samples()
+            if not self.messages and not self.samples:
+                break
+            
+            # Buffers are kept newest first, so the next event is at the end
+            if not self.samples or (self.messages and self.messages[-1][0] <= self.samples[-1][0]):
+                events.append(self.messages.pop())
+            else:
+                events.append(self.samples.pop())
+        return events
@@ -0,0 +1,425 @@
+import time
+import uuid
+import threading
+from collections import deque
+from contextlib import contextmanager
+from django.conf import settings
+from .redis_client import get_redis
+
+class TurnTimeout(Exception):
+    """Raised when a turn could not be scheduled within the wait timeout."""
+    pass
+
+class TurnScheduler:
+    """
+    Orders agent turns per conversation across every worker process.
+    
+    Each turn takes a ticket in its conversation's FIFO queue and may only run
+    once it is at the head of that queue and holds the conversation's lease.
+    On top of that, at most TURN_MAX_ACTIVE turns run at once across all
+    conversations, and free slots go to the conversations whose head ticket has
+    been waiting longest.
+    
+    Waiting tickets are kept alive by polling; a ticket whose waiter stops
+    polling for TURN_WAIT_TTL seconds is dropped. Leases expire after
+    TURN_LEASE_TTL seconds unless renewed, so a crashed worker cannot block a
+    conversation. Queues disappear as soon as they are empty.
+    """
+    def __init__(self, max_active=None, lease_ttl=None, wait_ttl=None):
+        self.max_active = max_active
+        self.lease_ttl = lease_ttl
+        self.wait_ttl = wait_ttl
+    
+    def enqueue(self, conversation_id):
+        """Add a turn to the conversation's queue and return its ticket."""
+        raise NotImplementedError
+    
+    def try_acquire(self, conversation_id, ticket):
+        """
+        Try to start the turn for ticket.
+        Returns True when the lease was granted, False while the turn must keep
+        waiting and None if the ticket is no longer queued.
+        """
+        raise NotImplementedError
+    
+    def renew(self, conversation_id, ticket):
+        """Extend the lease held by ticket. Returns False if it was lost."""
+        raise NotImplementedError
+    
+    def release(self, conversation_id, ticket):
+        """End the turn held by ticket and let the next one in."""
+        raise NotImplementedError
+    
+    def cancel(self, conversation_id, ticket):
+        """Withdraw a ticket that is still waiting."""
+        raise NotImplementedError
+    
+    def stats(self):
+        raise NotImplementedError
+    
+    def _wait_timeout(self, timeout):
+        return settings.TURN_WAIT_TIMEOUT if timeout is None else timeout
+    
+    def _max_poll_delay(self):
+        # Poll well within the wait TTL so the ticket never lapses while queued
+        return min(settings.TURN_POLL_INTERVAL * 10, (self.wait_ttl or settings.TURN_WAIT_TTL) / 3)
+    
+    @contextmanager
+    def turn(self, conversation_id, timeout=None):
+        """Block until it is this caller's turn in the conversation, then hold it."""
+        deadline = time.monotonic() + self._wait_timeout(timeout)
+        ticket = self.enqueue(conversation_id)
+        delay = settings.TURN_POLL_INTERVAL
+        
+        while True:
+            acquired = self.try_acquire(conversation_id, ticket)
+            if acquired:
+                break
+            if acquired is None:
+                ticket = self.enqueue(conversation_id)
+            if time.monotonic() >= deadline:
+                self.cancel(conversation_id, ticket)
+                raise TurnTimeout(f"Timed out waiting for a turn in conversation {conversation_id}")
+            time.sleep(delay)
+            delay = min(delay * 2, self._max_poll_delay())
+        
+        stop = threading.Event()
+        renewer = threading.Thread(
+            target=self._renew_until, args=(conversation_id, ticket, stop), daemon=True
+        )
+        renewer.start()
+        try:
+            yield ticket
+        finally:
+            stop.set()
+            self.release(conversation_id, ticket)
+    
+    def _renew_until(self, conversation_id, ticket, stop):
+        while not stop.wait(settings.TURN_LEASE_TTL / 3):
+            if not self.renew(conversation_id, ticket):
+                return
+
+def _ticket_time(ticket):
+    return int(ticket.split(':', 1)[0])
+
+class InMemoryTurnScheduler(TurnScheduler):
+    """Single-process stand-in with the same semantics, used in tests and development."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._waiting = {}
+        self._leases = {}
+    
+    def _now(self):
+        return int(time.monotonic() * 1000)
+    
+    def _settings(self):
+        return (
+            self.max_active or settings.TURN_MAX_ACTIVE,
+            int((self.lease_ttl or settings.TURN_LEASE_TTL) * 1000),
+            int((self.wait_ttl or settings.TURN_WAIT_TTL) * 1000),
+        )
+    
+    def _purge(self, now):
+        for conversation_id, (ticket, expires_at) in list(self._leases.items()):
+            if expires_at <= now:
+                del self._leases[conversation_id]
+                queue = self._queues.get(conversation_id)
+                if queue and ticket in queue:
+                    queue.remove(ticket)
+        
+        for conversation_id, queue in list(self._queues.items()):
+            if conversation_id not in self._leases:
+                while queue and self._waiting.get(queue[0], 0) <= now:
+                    self._waiting.pop(queue.popleft(), None)
+            if not queue:
+                del self._queues[conversation_id]
+    
+    def enqueue(self, conversation_id):
+        _, _, wait_ttl = self._settings()
+        with self._lock:
+            now = self._now()
+            ticket = f"{now}:{uuid.uuid4().hex}"
+            self._queues.setdefault(conversation_id, deque()).append(ticket)
+            self._waiting[ticket] = now + wait_ttl
+            return ticket
+    
+    def try_acquire(self, conversation_id, ticket):
+        max_active, lease_ttl, wait_ttl = self._settings()
+        with self._lock:
+            now = self._now()
+            if self._waiting.get(ticket, 0) <= now:
+                return None
+            self._waiting[ticket] = now + wait_ttl
+            self._purge(now)
+            
+            queue = self._queues.get(conversation_id)
+            if conversation_id in self._leases or not queue or queue[0] != ticket:
+                return False
+            
+            free = max_active - len(self._leases)
+            if free <= 0:
+                return False
+            
+            # Only the longest-waiting heads may take the free slots
+            ready = sorted(
+                (cid for cid, q in self._queues.items() if cid not in self._leases),
+                key=lambda cid: _ticket_time(self._queues[cid][0])
+            )
+            if conversation_id not in ready[:free]:
+                return False
+            
+            del self._waiting[ticket]
+            self._leases[conversation_id] = (ticket, now + lease_ttl)
+            return True
+    
+    def renew(self, conversation_id, ticket):
+        _, lease_ttl, _ = self._settings()
+        with self._lock:
+            lease = self._leases.get(conversation_id)
+            if not lease or lease[0] != ticket:
+                return False
+            self._leases[conversation_id] = (ticket, self._now() + lease_ttl)
+            return True
+    
+    def release(self, conversation_id, ticket):
+        with self._lock:
+            lease = self._leases.get(conversation_id)
+            if not lease or lease[0] != ticket:
+                return False
+            del self._leases[conversation_id]
+            queue = self._queues.get(conversation_id)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+            if not queue:
+                self._queues.pop(conversation_id, None)
+            return True
+    
+    def cancel(self, conversation_id, ticket):
+        with self._lock:
+            self._waiting.pop(ticket, None)
+            queue = self._queues.get(conversation_id)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+            if not queue:
+                self._queues.pop(conversation_id, None)
+    
+    def stats(self):
+        with self._lock:
+            self._purge(self._now())
+            return {
+                'backend': 'memory',
+                'active_turns': len(self._leases),
+                'waiting_conversations': len([cid for cid in self._queues if cid not in self._leases]),
+            }
+
+# Shared helpers for the Lua scripts. The state lives in five keys passed as
+# KEYS (queued tickets, waiting deadlines, lease holders, lease deadlines and
+# ready conversations); tickets are stored as "<conversation>\0<ticket>"
+# members, so a conversation's queue is a lexicographic range of the queue.
+LUA_COMMON = """
+local queue, waiting, holders, leases, ready = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local cid = ARGV[1]
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local function member(c, t) return c .. '\\0' .. t end
+
+local function head(c)
+    local first = redis.call('ZRANGEBYLEX', queue, '[' .. c .. '\\0', '(' .. c .. '\\1', 'LIMIT', 0, 1)[1]
+    if first then
+        return string.sub(first, #c + 2)
+    end
+end
+
+local function refresh_ready(c)
+    if redis.call('HEXISTS', holders, c) == 1 then
+        return
+    end
+    local h = head(c)
+    if h then
+        redis.call('ZADD', ready, tonumber(string.match(h, '^(%d+):')), c)
+    else
+        redis.call('ZREM', ready, c)
+    end
+end
+
+local function drop(c, t)
+    redis.call('ZREM', queue, member(c, t))
+    redis.call('ZREM', waiting, member(c, t))
+end
+
+-- Reclaim leases of workers that stopped renewing them and tickets whose waiters went away
+local function purge()
+    for _, c in ipairs(redis.call('ZRANGEBYSCORE', leases, '-inf', now)) do
+        local holder = redis.call('HGET', holders, c)
+        if holder then
+            drop(c, holder)
+        end
+        redis.call('HDEL', holders, c)
+        redis.call('ZREM', leases, c)
+        refresh_ready(c)
+    end
+    for _, m in ipairs(redis.call('ZRANGEBYSCORE', waiting, '-inf', now)) do
+        local c, t = string.match(m, '^(.*)%z(.*)$')
+        drop(c, t)
+        refresh_ready(c)
+    end
+end
+"""
+
+LUA_ENQUEUE = LUA_COMMON + """
+local ticket = string.format('%015d', now) .. ':' .. ARGV[2]
+local wait_ttl = tonumber(ARGV[3])
+redis.call('ZADD', queue, 0, member(cid, ticket))
+redis.call('ZADD', waiting, now + wait_ttl, member(cid, ticket))
+refresh_ready(cid)
+return ticket
+"""
+
+LUA_TRY_ACQUIRE = LUA_COMMON + """
+local ticket = ARGV[2]
+local wait_ttl = tonumber(ARGV[3])
+local lease_ttl = tonumber(ARGV[4])
+local max_active = tonumber(ARGV[5])
+
+local deadline = redis.call('ZSCORE', waiting, member(cid, ticket))
+if not deadline or tonumber(deadline) <= now then
+    return -1
+end
+redis.call('ZADD', waiting, now + wait_ttl, member(cid, ticket))
+purge()
+
+if redis.call('HEXISTS', holders, cid) == 1 or head(cid) ~= ticket then
+    return 0
+end
+
+local free = max_active - redis.call('ZCARD', leases)
+if free <= 0 then
+    return 0
+end
+
+-- Only the longest-waiting heads may take the free slots
+for _, c in ipairs(redis.call('ZRANGE', ready, 0, free - 1)) do
+    if c == cid then
+        redis.call('HSET', holders, cid, ticket)
+        redis.call('ZADD', leases, now + lease_ttl, cid)
+        redis.call('ZREM', ready, cid)
+        redis.call('ZREM', waiting, member(cid, ticket))
+        return 1
+    end
+end
+return 0
+"""
+
+LUA_RENEW = LUA_COMMON + """
+local ticket = ARGV[2]
+local lease_ttl = tonumber(ARGV[3])
+if redis.call('HGET', holders, cid) ~= ticket then
+    return 0
+end
+redis.call('ZADD', leases, now + lease_ttl, cid)
+return 1
+"""
+
+LUA_RELEASE = LUA_COMMON + """
+local ticket = ARGV[2]
+if redis.call('HGET', holders, cid) ~= ticket then
+    return 0
+end
+redis.call('HDEL', holders, cid)
+redis.call('ZREM', leases, cid)
+drop(cid, ticket)
+refresh_ready(cid)
+return 1
+"""
+
+LUA_CANCEL = LUA_COMMON + """
+local ticket = ARGV[2]
+drop(cid, ticket)
+refresh_ready(cid)
+return 1
+"""
+
+class RedisTurnScheduler(TurnScheduler):
+    """
+    Scheduler whose state lives in Redis so that every worker shares it. All
+    keys carry the same hash tag and are passed to the scripts as KEYS, so it
+    also runs on Redis Cluster.
+    """
+    prefix = '{turns}:'
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._scripts = {}
+    
+    def _script(self, source):
+        redis_client = get_redis()
+        key = (id(redis_client), source)
+        if key not in self._scripts:
+            self._scripts[key] = redis_client.register_script(source)
+        return self._scripts[key]
+    
+    def _keys(self):
+        return [self.prefix + name for name in ('queue', 'waiting', 'holders', 'leases', 'ready')]
+    
+    def _settings(self):
+        return (
+            self.max_active or settings.TURN_MAX_ACTIVE,
+            int((self.lease_ttl or settings.TURN_LEASE_TTL) * 1000),
+            int((self.wait_ttl or settings.TURN_WAIT_TTL) * 1000),
+        )
+    
+    def enqueue(self, conversation_id):
+        _, _, wait_ttl = self._settings()
+        ticket = self._script(LUA_ENQUEUE)(keys=self._keys(), args=[
+            conversation_id, uuid.uuid4().hex, wait_ttl
+        ])
+        return ticket.decode()
+    
+    def try_acquire(self, conversation_id, ticket):
+        max_active, lease_ttl, wait_ttl = self._settings()
+        result = self._script(LUA_TRY_ACQUIRE)(keys=self._keys(), args=[
+            conversation_id, ticket, wait_ttl, lease_ttl, max_active
+        ])
+        if result < 0:
+            return None
+        return result == 1
+    
+    def renew(self, conversation_id, ticket):
+        _, lease_ttl, _ = self._settings()
+        return self._script(LUA_RENEW)(keys=self._keys(), args=[conversation_id, ticket, lease_ttl]) == 1
+    
+    def release(self, conversation_id, ticket):
+        return self._script(LUA_RELEASE)(keys=self._keys(), args=[conversation_id, ticket]) == 1
+    
+    def cancel(self, conversation_id, ticket):
+        self._script(LUA_CANCEL)(keys=self._keys(), args=[conversation_id, ticket])
+    
+    def stats(self):
+        redis_client = get_redis()
+        return {
+            'backend': 'redis',
+            'active_turns': redis_client.zcard(self.prefix + 'leases'),
+            'waiting_conversations': redis_client.zcard(self.prefix + 'ready'),
+        }
+
+TURN_SCHEDULERS = {
+    'memory': InMemoryTurnScheduler,
+    'redis': RedisTurnScheduler,
+}
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_turn_scheduler():
+    """Return the process-wide scheduler selected by TURN_SCHEDULER_BACKEND."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            backend = settings.TURN_SCHEDULER_BACKEND.lower()
+            if backend not in TURN_SCHEDULERS:
+                raise ValueError(f"Unsupported turn scheduler backend: {backend}")
+            _scheduler = TURN_SCHEDULERS[backend]()
+        return _scheduler
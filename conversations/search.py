@@ -0,0 +1,240 @@
+import re
+import math
+import time
+import threading
+from collections import OrderedDict, defaultdict
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from .models import Message, MessageSearchTerm
+
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+QUERY_PATTERN = re.compile(r'(-?)"([^"]*)"|(-?)(\S+)')
+
+# Term frequencies kept by the fallback backend between refreshes
+SEARCH_STATS_MAX_TERMS = 10000
+
+def tokenize(text):
+    """Lower-cased words of text, in order, cut to the length of an index term."""
+    return [word.lower()[:MessageSearchTerm.TERM_LENGTH] for word in WORD_PATTERN.findall(text or '')]
+
+def parse_query(query):
+    """
+    Split a web-style query into (phrases, excluded phrases). Quoted text is a
+    phrase, other words are one-word phrases and a leading - excludes a phrase.
+    OR is not supported by the fallback backend and is treated as a word.
+    """
+    phrases, excluded = [], []
+    for minus, quoted, bare_minus, bare in QUERY_PATTERN.findall(query):
+        words = tokenize(quoted if quoted else bare)
+        if not words:
+            continue
+        (excluded if (minus or bare_minus) else phrases).append(words)
+    return phrases, excluded
+
+class MessageSearch:
+    """
+    Ranked full-text search over message content and thinking.
+    
+    search(messages, query) narrows a Message queryset (already filtered by
+    conversation, agent, time and visibility) to the matches of query and
+    returns them best first, each with a rank attribute.
+    """
+    name = None
+    
+    def search(self, messages, query):
+        raise NotImplementedError
+    
+    def index(self, messages):
+        """Index new or changed messages."""
+        pass
+    
+    def remove(self, message_ids):
+        """Drop deleted messages from the index."""
+        pass
+    
+    def rebuild(self, batch_size=1000):
+        """Rebuild the index from scratch; returns the number of messages indexed."""
+        raise NotImplementedError
+
+class PostgresMessageSearch(MessageSearch):
+    """
+    tsvector search. The vector is computed by an expression that a GIN index
+    of the same expression (created by ensure_index) serves, so there is no
+    column to keep up to date. Content weighs more than thinking.
+    """
+    name = 'postgres'
+    index_name = 'message_search_idx'
+    
+    def vector(self):
+        from django.contrib.postgres.search import SearchVector
+        config = settings.MESSAGE_SEARCH_CONFIG
+        return SearchVector('content', weight='A', config=config) + \
+            SearchVector('thinking', weight='B', config=config)
+    
+    def search(self, messages, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+        vector = self.vector()
+        query = SearchQuery(query, search_type='websearch', config=settings.MESSAGE_SEARCH_CONFIG)
+        return messages.annotate(search=vector).filter(search=query).annotate(
+            rank=SearchRank(vector, query)
+        ).order_by('-rank', '-timestamp', '-id')
+    
+    def ensure_index(self):
+        """Create the GIN index on the search expression unless it exists."""
+        from django.contrib.postgres.indexes import GinIndex
+        with connection.cursor() as cursor:
+            existing = connection.introspection.get_constraints(cursor, Message._meta.db_table)
+        if self.index_name in existing:
+            return False
+        with connection.schema_editor() as schema_editor:
+            schema_editor.add_index(Message, GinIndex(self.vector(), name=self.index_name))
+        return True
+    
+    def rebuild(self, batch_size=1000):
+        self.ensure_index()
+        return Message.objects.count()
+
+class InvertedIndexMessageSearch(MessageSearch):
+    """
+    Fallback for databases without full-text search (SQLite test runs): an
+    inverted index of MessageSearchTerm rows, one per word and message with
+    the word's positions, maintained from the message signals. Matches need
+    every phrase; phrases are checked on the positions and results are ranked
+    by tf-idf.
+    
+    The corpus statistics tf-idf needs (the message count and the number of
+    messages per term) are kept per process for MESSAGE_SEARCH_STATS_TTL
+    seconds instead of being counted on every search; ranks drift slightly
+    while they are stale, matches do not.
+    """
+    name = 'inverted'
+    
+    def __init__(self, stats_ttl=None):
+        self.stats_ttl = stats_ttl
+        self._lock = threading.Lock()
+        self._total = None
+        # term -> (messages containing it, expiry), least recently refreshed first
+        self._frequencies = OrderedDict()
+    
+    def _terms(self, message):
+        positions = defaultdict(list)
+        for position, word in enumerate(tokenize(message.content) + [''] + tokenize(message.thinking)):
+            if word:
+                positions[word].append(position)
+        return positions
+    
+    def index(self, messages):
+        messages = list(messages)
+        if not messages:
+            return
+        MessageSearchTerm.objects.filter(message_id__in=[message.id for message in messages]).delete()
+        MessageSearchTerm.objects.bulk_create([
+            MessageSearchTerm(message_id=message.id, term=term, positions=positions)
+            for message in messages
+            for term, positions in self._terms(message).items()
+        ], batch_size=1000)
+    
+    def remove(self, message_ids):
+        MessageSearchTerm.objects.filter(message_id__in=list(message_ids)).delete()
+    
+    def rebuild(self, batch_size=1000):
+        MessageSearchTerm.objects.all().delete()
+        with self._lock:
+            self._total = None
+            self._frequencies.clear()
+        indexed = 0
+        last_id = None
+        messages = Message.objects.only('id', 'content', 'thinking').order_by('id')
+        while True:
+            batch = list((messages.filter(id__gt=last_id) if last_id is not None else messages)[:batch_size])
+            if not batch:
+                return indexed
+            self.index(batch)
+            indexed += len(batch)
+            last_id = batch[-1].id
+    
+    @staticmethod
+    def _has_phrase(positions, phrase):
+        return any(
+            all(start + offset in positions.get(word, ()) for offset, word in enumerate(phrase))
+            for start in positions.get(phrase[0], ())
+        )
+    
+    def _corpus_stats(self, terms):
+        """(message count, {term: messages containing it}), counted again once stale."""
+        now = time.monotonic()
+        expires = now + (self.stats_ttl or settings.MESSAGE_SEARCH_STATS_TTL)
+        with self._lock:
+            total = self._total[0] if self._total and self._total[1] > now else None
+            frequency = {
+                term: self._frequencies[term][0] for term in terms
+                if term in self._frequencies and self._frequencies[term][1] > now
+            }
+        
+        if total is None:
+            total = Message.objects.count()
+        missing = terms - frequency.keys()
+        if missing:
+            counted = dict(
+                MessageSearchTerm.objects.filter(term__in=missing).values_list('term').annotate(n=Count('id'))
+            )
+            frequency.update({term: counted.get(term, 0) for term in missing})
+        
+        with self._lock:
+            if not self._total or self._total[1] <= now:
+                self._total = (total, expires)
+            for term in missing:
+                self._frequencies.pop(term, None)
+                self._frequencies[term] = (frequency[term], expires)
+            while len(self._frequencies) > SEARCH_STATS_MAX_TERMS:
+                self._frequencies.popitem(last=False)
+        return total, frequency
+    
+    def search(self, messages, query):
+        phrases, excluded = parse_query(query)
+        if not phrases:
+            return []
+        
+        terms = {word for phrase in phrases for word in phrase}
+        candidates = MessageSearchTerm.objects.filter(
+            term__in=terms, message_id__in=messages.values('id')
+        ).values('message_id').annotate(n=Count('term')).filter(n=len(terms)).values('message_id')
+        
+        postings = defaultdict(dict)
+        excluded_terms = {word for phrase in excluded for word in phrase}
+        for row in MessageSearchTerm.objects.filter(
+            message_id__in=candidates, term__in=terms | excluded_terms
+        ).values('message_id', 'term', 'positions'):
+            postings[row['message_id']][row['term']] = set(row['positions'])
+        
+        total, frequency = self._corpus_stats(terms)
+        
+        scores = {}
+        for message_id, positions in postings.items():
+            if not all(self._has_phrase(positions, phrase) for phrase in phrases):
+                continue
+            if any(self._has_phrase(positions, phrase) for phrase in excluded):
+                continue
+            scores[message_id] = sum(
+                (1 + math.log(len(positions[term]))) * math.log(1 + max(total, 1) / max(frequency[term], 1))
+                for term in terms
+            )
+        
+        results = list(messages.filter(id__in=list(scores)))
+        for message in results:
+            message.rank = scores[message.id]
+        results.sort(key=lambda message: (message.rank, message.timestamp, message.id), reverse=True)
+        return results
+
+_search = None
+
+def get_message_search():
+    """The search backend for MESSAGE_SEARCH_BACKEND; auto picks by database."""
+    global _search
+    if _search is None:
+        backend = settings.MESSAGE_SEARCH_BACKEND
+        if backend == 'auto':
+            backend = 'postgres' if connection.vendor == 'postgresql' else 'inverted'
+        _search = PostgresMessageSearch() if backend == 'postgres' else InvertedIndexMessageSearch()
+    return _search
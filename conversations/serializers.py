@@ -20,9 +20,67 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = (
             'id', 'conversation', 'agent', 'agent_name', 'agent_color', 
             'agent_avatar', 'content', 'timestamp', 'thinking', 'confidence',
-            'sentiment', 'keywords', 'embedding_id'
+            'sentiment', 'keywords', 'embedding_id', 'content_tokens', 'thinking_tokens'
         )
-        read_only_fields = ('created_at',)
+        read_only_fields = ('created_at', 'content_tokens', 'thinking_tokens')
+
+class CompactMessageSerializer(MessageSerializer):
+    """A message without its agent's display fields, for the normalized list shape."""
+    class Meta(MessageSerializer.Meta):
+        fields = tuple(
+            field for field in MessageSerializer.Meta.fields
+            if field not in ('agent_name', 'agent_color', 'agent_avatar')
+        )
+
+class MessageAgentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Agent
+        fields = ('name', 'color', 'avatar')
+
+class MessageSearchResultSerializer(MessageSerializer):
+    rank = serializers.FloatField(read_only=True)
+    
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ('rank',)
+
+class MessageImportListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError("No messages to import.")
+        
+        # One query for all agents and one for ids that are already taken
+        agent_ids = {item['agent'] for item in attrs}
+        known = set(Agent.objects.filter(id__in=agent_ids).values_list('id', flat=True))
+        if agent_ids - known:
+            raise serializers.ValidationError(
+                {'agent': [f"Unknown agents: {', '.join(sorted(agent_ids - known))}"]}
+            )
+        
+        ids = [item['id'] for item in attrs if item.get('id')]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError({'id': ["Message ids must be unique."]})
+        taken = list(Message.objects.filter(id__in=ids).values_list('id', flat=True)[:10])
+        if taken:
+            raise serializers.ValidationError({'id': [f"Messages already exist: {', '.join(taken)}"]})
+        return attrs
+
+class MessageImportSerializer(serializers.Serializer):
+    """
+    A message in a bulk import. Unlike MessageSerializer it validates without
+    touching the database; agents and ids are checked once for the whole batch.
+    """
+    id = serializers.CharField(max_length=255, required=False)
+    agent = serializers.CharField(max_length=255)
+    content = serializers.CharField()
+    timestamp = serializers.DateTimeField()
+    thinking = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    confidence = serializers.FloatField(required=False, allow_null=True)
+    sentiment = serializers.CharField(max_length=50, required=False, allow_null=True, allow_blank=True)
+    keywords = serializers.JSONField(required=False, allow_null=True)
+    embedding_id = serializers.CharField(max_length=255, required=False, allow_null=True, allow_blank=True)
+    
+    class Meta:
+        list_serializer_class = MessageImportListSerializer
 
 class VectorMetricsSerializer(serializers.ModelSerializer):
     class Meta:
@@ -34,6 +92,17 @@ class VectorMetricsSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ('created_at',)
 
+class VectorMetricsSampleSerializer(serializers.Serializer):
+    """A sample in a batch; validates without touching the database."""
+    timestamp = serializers.DateTimeField()
+    asymmetric_cognition = serializers.FloatField()
+    meta_language_coherence = serializers.FloatField()
+    recursive_depth = serializers.FloatField()
+    incompleteness_tolerance = serializers.FloatField()
+    cognitive_transparency = serializers.FloatField()
+    non_monotonic_exploration = serializers.FloatField()
+    pattern_persistence = serializers.FloatField()
+
 class UserAccessSerializer(serializers.ModelSerializer):
     user_email = serializers.CharField(source='user.email', read_only=True)
     granted_by_email = serializers.CharField(source='granted_by.email', read_only=True)
@@ -53,7 +122,6 @@ class ConversationSerializer(serializers.ModelSerializer):
         required=False
     )
     created_by_email = serializers.CharField(source='created_by.email', read_only=True)
-    message_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Conversation
@@ -63,12 +131,15 @@ class ConversationSerializer(serializers.ModelSerializer):
             'is_public', 'created_at', 'updated_at', 'completed_at',
             'is_active', 'constraints', 'enable_meta_cognition',
             'enable_recursive_thinking', 'enable_vector_monitoring',
-            'enable_emergent_behavior', 'agents', 'message_count'
+            'enable_emergent_behavior', 'agents', 'message_count',
+            'last_message_at', 'last_agent', 'content_tokens', 'thinking_tokens',
+            'archived_at', 'parent', 'fork_timestamp', 'fork_message_id'
+        )
+        read_only_fields = (
+            'created_at', 'updated_at', 'created_by', 'message_count',
+            'last_message_at', 'last_agent', 'content_tokens', 'thinking_tokens',
+            'archived_at', 'parent', 'fork_timestamp', 'fork_message_id'
         )
-        read_only_fields = ('created_at', 'updated_at', 'created_by')
-    
-    def get_message_count(self, obj):
-        return obj.messages.count()
     
     def create(self, validated_data):
         agents_data = validated_data.pop('agents', [])
@@ -82,14 +153,38 @@ class ConversationSerializer(serializers.ModelSerializer):
         
         return conversation
 
+class ConversationForkSerializer(serializers.Serializer):
+    """
+    Options of a fork: the message to branch after (default: the newest),
+    the fork's id and agents, and settings that differ from the parent's.
+    """
+    id = serializers.CharField(max_length=255, required=False)
+    message = serializers.CharField(max_length=255, required=False)
+    agents = serializers.PrimaryKeyRelatedField(many=True, queryset=Agent.objects.all(), required=False)
+    topic = serializers.CharField(max_length=255, required=False)
+    objective = serializers.CharField(required=False)
+    system_prompt = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+    max_turns = serializers.IntegerField(required=False)
+    temperature = serializers.FloatField(required=False)
+    language = serializers.CharField(max_length=50, required=False)
+    constraints = serializers.JSONField(required=False, allow_null=True)
+    is_public = serializers.BooleanField(required=False)
+    
+    def validate_id(self, value):
+        if Conversation.objects.filter(id=value).exists():
+            raise serializers.ValidationError("A conversation with this id already exists.")
+        return value
+
 class ConversationDetailSerializer(ConversationSerializer):
+    """
+    Conversation with its agents. Messages are read from the keyset-paginated
+    messages endpoint and access grants from the access endpoint.
+    """
     agents = ConversationAgentSerializer(
         source='conversationagent_set',
         many=True,
         read_only=True
     )
-    messages = MessageSerializer(many=True, read_only=True)
-    user_access = UserAccessSerializer(many=True, read_only=True)
     
     class Meta(ConversationSerializer.Meta):
-        fields = ConversationSerializer.Meta.fields + ('messages', 'user_access')
+        fields = ConversationSerializer.Meta.fields
@@ -0,0 +1,59 @@
+from django.db.models.signals import post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from .models import Conversation, Message, UserAccess
+from .context import context_builder
+from .access import access_cache
+from .search import get_message_search, PostgresMessageSearch
+from . import counters, visibility
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, **kwargs):
+    get_message_search().index([instance])
+    if created:
+        # Cached transcripts only pick up messages after their newest one
+        if Conversation.objects.filter(
+            id=instance.conversation_id, last_message_at__gt=instance.timestamp
+        ).exists():
+            context_builder.invalidate(instance.conversation_id)
+        counters.messages_added(instance.conversation_id, [instance])
+        return
+    
+    # Edits change text that is already in cached transcripts
+    context_builder.invalidate(instance.conversation_id)
+    counters.message_edited(instance, getattr(instance, '_counted_tokens', (0, 0)))
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    get_message_search().remove([instance.id])
+    context_builder.invalidate(instance.conversation_id)
+    counters.message_removed(instance)
+
+@receiver(post_save, sender=Conversation)
+def conversation_saved(sender, instance, **kwargs):
+    # The creator or is_public may have been set or changed
+    visibility.sync_conversation(instance.id)
+    access_cache.invalidate(instance.id)
+
+@receiver(post_delete, sender=Conversation)
+def conversation_deleted(sender, instance, **kwargs):
+    access_cache.invalidate(instance.id)
+
+@receiver(post_save, sender=UserAccess)
+@receiver(post_delete, sender=UserAccess)
+def access_changed(sender, instance, **kwargs):
+    visibility.sync_conversation(instance.conversation_id)
+    access_cache.invalidate(instance.conversation_id, instance.user_id)
+
+@receiver(post_migrate)
+def create_search_index(sender, **kwargs):
+    # The GIN index is on an expression, so it is created here rather than in a migration
+    search = get_message_search()
+    if sender.name == 'conversations' and isinstance(search, PostgresMessageSearch):
+        search.ensure_index()
+
+@receiver(post_migrate)
+def backfill_visibility(sender, **kwargs):
+    # Existing conversations get their visibility rows on the first migrate
+    # that creates the index; later changes are kept in sync by the handlers above
+    if sender.name == 'conversations':
+        visibility.backfill()
@@ -0,0 +1,131 @@
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from llm_sandbox.celery import app
+from .models import Conversation, Message
+from .serializers import MessageSerializer
+from .llm_service import generate_agent_response
+from .consumers import ConversationConsumer
+from .scheduler import get_turn_scheduler, TurnTimeout
+
+logger = logging.getLogger(__name__)
+
+def next_agent(conversation):
+    """Pick the agent that follows the author of the last message, round-robin."""
+    agents = list(conversation.agents.order_by('conversationagent__joined_at', 'id'))
+    if not agents:
+        return None
+    
+    agent_ids = [agent.id for agent in agents]
+    if conversation.last_agent_id not in agent_ids:
+        return agents[0]
+    return agents[(agent_ids.index(conversation.last_agent_id) + 1) % len(agents)]
+
+def stop_runner(conversation_id, run_token, event):
+    """Deactivate the conversation if run_token still owns it and notify clients."""
+    with transaction.atomic():
+        conversation = Conversation.objects.select_for_update().get(id=conversation_id)
+        if conversation.run_token != run_token:
+            return
+        
+        conversation.run_token = None
+        conversation.is_active = False
+        if event['type'] == 'conversation_completed':
+            conversation.completed_at = timezone.now()
+        conversation.save()
+    
+    ConversationConsumer.conversation_updated(conversation_id, {
+        'conversation_id': conversation_id,
+        **event
+    })
+
+def take_turn(conversation_id, run_token, turn, agent):
+    """
+    Generate agent's reply and save it if run_token still owns the conversation
+    and turn has not been taken yet, then queue the following turn once the
+    message is committed.
+    """
+    conversation = Conversation.objects.get(id=conversation_id)
+    response = generate_agent_response(agent=agent, conversation=conversation)
+    
+    # Only the current run may write, once per turn; a pause during the LLM
+    # call or a redelivered task drops the turn
+    with transaction.atomic():
+        conversation = Conversation.objects.select_for_update().get(id=conversation_id)
+        if conversation.run_token != run_token or not conversation.is_active or conversation.run_turn != turn:
+            return None
+        
+        message = Message.objects.create(
+            id=response['id'],
+            conversation=conversation,
+            agent=agent,
+            content=response['content'],
+            timestamp=timezone.now(),
+            thinking=response.get('thinking'),
+            confidence=response.get('confidence')
+        )
+        Conversation.objects.filter(id=conversation_id).update(run_turn=turn + 1)
+        
+        def advance():
+            ConversationConsumer.new_message(conversation_id, MessageSerializer(message).data)
+            run_conversation_turn.delay(conversation_id, run_token, turn + 1)
+        transaction.on_commit(advance)
+    return message
+
+@app.task(bind=True, max_retries=3, acks_late=True)
+def run_conversation_turn(self, conversation_id, run_token, turn=0):
+    """
+    Advance an autonomous conversation by one turn, then queue the next one.
+    
+    Each task handles a single turn, so the saved message is the checkpoint and
+    a pause, completion or restart (which replaces run_token) takes effect
+    before the next turn starts. Turns are numbered per run and each is
+    written at most once, so a task redelivered under acks_late after its
+    turn was saved does nothing instead of starting a second chain. A run
+    completes after max_turns turns of its own; messages inherited from a
+    parent or imported do not count.
+    """
+    conversation = Conversation.objects.filter(id=conversation_id).first()
+    if conversation is None or conversation.run_token != run_token:
+        return 'superseded'
+    
+    if conversation.run_turn != turn:
+        return 'duplicate'
+    
+    if not conversation.is_active or conversation.completed_at:
+        return 'stopped'
+    
+    if turn >= conversation.max_turns:
+        stop_runner(conversation_id, run_token, {'type': 'conversation_completed'})
+        return 'completed'
+    
+    agent = next_agent(conversation)
+    if agent is None:
+        stop_runner(conversation_id, run_token, {
+            'type': 'conversation_paused',
+            'reason': 'Conversation has no agents'
+        })
+        return 'stopped'
+    
+    # Manual generation for the same conversation waits for this turn and vice versa
+    try:
+        with get_turn_scheduler().turn(conversation_id):
+            message = take_turn(conversation_id, run_token, turn, agent)
+    except Exception as e:
+        # Waiting for the turn is retried at once, failed LLM calls with backoff
+        waiting = isinstance(e, TurnTimeout)
+        limit = settings.TURN_TIMEOUT_RETRIES if waiting else self.max_retries
+        if self.request.retries < limit:
+            raise self.retry(exc=e, countdown=1 if waiting else 2 ** self.request.retries, max_retries=limit)
+        
+        logger.error("Autonomous run of %s stopped: %s", conversation_id, e)
+        stop_runner(conversation_id, run_token, {
+            'type': 'conversation_paused',
+            'reason': str(e)
+        })
+        return 'failed'
+    
+    if message is None:
+        return 'superseded'
+    return message.id
@@ -0,0 +1,306 @@
+import sys
+import heapq
+import math
+import struct
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import accumulate
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Max
+from django.utils import timezone
+from .models import VectorMetrics, VectorMetricsBlock
+
+METRIC_FIELDS = VectorMetrics.METRIC_FIELDS
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+# Candidate buckets per output point when LTTB runs on min/max preselected points
+LTTB_PRESELECT_RATIO = 2
+
+def to_micros(value):
+    return (value - EPOCH) // MICROSECOND
+
+def from_micros(value):
+    return EPOCH + value * MICROSECOND
+
+def _little_endian(column):
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+def pack(samples):
+    """
+    Encode (microseconds, values) samples in time order: a sample count, the
+    timestamps as int64 deltas and one float64 column per metric, compressed.
+    """
+    stamps = [time for time, _ in samples]
+    times = array('q', (time - previous for previous, time in zip([0] + stamps, stamps)))
+    columns = [array('d', (values[i] for _, values in samples)) for i in range(len(METRIC_FIELDS))]
+    raw = struct.pack('<I', len(samples)) + b''.join(
+        _little_endian(column).tobytes() for column in [times] + columns
+    )
+    return zlib.compress(raw)
+
+def unpack(data):
+    """Decode a block into a list of (microseconds, values) samples."""
+    raw = zlib.decompress(data)
+    count, = struct.unpack_from('<I', raw)
+    offset = 4
+    columns = []
+    for typecode in 'q' + 'd' * len(METRIC_FIELDS):
+        column = array(typecode)
+        column.frombytes(raw[offset:offset + count * column.itemsize])
+        offset += count * column.itemsize
+        columns.append(_little_endian(column))
+    return list(zip(accumulate(columns[0]), zip(*columns[1:])))
+
+def ingest_samples(conversation_id, rows, batch_size=None):
+    """Insert validated samples with bulk_create in chunks; returns how many were written."""
+    batch_size = batch_size or settings.MESSAGE_IMPORT_BATCH_SIZE
+    metrics = [VectorMetrics(conversation_id=conversation_id, **row) for row in rows]
+    with transaction.atomic():
+        for start in range(0, len(metrics), batch_size):
+            VectorMetrics.objects.bulk_create(metrics[start:start + batch_size])
+    return len(metrics)
+
+def _write_block(conversation_id, ids, samples):
+    VectorMetricsBlock.objects.create(
+        conversation_id=conversation_id,
+        start=from_micros(samples[0][0]),
+        end=from_micros(samples[-1][0]),
+        sample_count=len(samples),
+        data=pack(samples)
+    )
+    # Deleted by id, so rows written meanwhile are left for the next run
+    for start in range(0, len(ids), 500):
+        rows = VectorMetrics.objects.filter(id__in=ids[start:start + 500])
+        rows._raw_delete(rows.db)
+
+def compact(conversation_id=None, older_than=None, block_size=None):
+    """
+    Move VectorMetrics rows older than older_than (default:
+    VECTOR_METRICS_COMPACT_AFTER seconds ago) into VectorMetricsBlocks of at
+    most block_size samples, one transaction per conversation. Returns
+    (blocks created, samples moved).
+    """
+    block_size = block_size or settings.VECTOR_METRICS_BLOCK_SIZE
+    if older_than is None:
+        older_than = timezone.now() - timedelta(seconds=settings.VECTOR_METRICS_COMPACT_AFTER)
+    
+    rows = VectorMetrics.objects.filter(timestamp__lt=older_than).order_by()
+    if conversation_id is not None:
+        rows = rows.filter(conversation_id=conversation_id)
+    
+    blocks = 0
+    moved = 0
+    for conversation in list(rows.values_list('conversation_id', flat=True).distinct()):
+        with transaction.atomic():
+            ids = []
+            samples = []
+            for row in rows.filter(conversation_id=conversation).order_by('timestamp', 'id').values_list(
+                'id', 'timestamp', *METRIC_FIELDS
+            ).iterator():
+                ids.append(row[0])
+                samples.append((to_micros(row[1]), row[2:]))
+                if len(samples) == block_size:
+                    _write_block(conversation, ids, samples)
+                    blocks += 1
+                    moved += len(samples)
+                    ids, samples = [], []
+            if samples:
+                _write_block(conversation, ids, samples)
+                blocks += 1
+                moved += len(samples)
+    return blocks, moved
+
+def _block_samples(blocks, since, until):
+    """
+    Samples of blocks ordered by start, in time order. Blocks are only decoded
+    once the merge reaches their start, so at most the overlapping ones are in
+    memory at a time.
+    """
+    heap = []
+    blocks = iter(blocks)
+    pending = next(blocks, None)
+    sequence = 0
+    while heap or pending is not None:
+        while pending is not None and (not heap or to_micros(pending.start) <= heap[0][0]):
+            decoded = iter([
+                sample for sample in unpack(pending.data)
+                if (since is None or sample[0] >= since) and (until is None or sample[0] <= until)
+            ])
+            first = next(decoded, None)
+            if first is not None:
+                heapq.heappush(heap, (first[0], sequence, first, decoded))
+                sequence += 1
+            pending = next(blocks, None)
+        if not heap:
+            continue
+        _, order, sample, decoded = heapq.heappop(heap)
+        yield sample
+        following = next(decoded, None)
+        if following is not None:
+            heapq.heappush(heap, (following[0], order, following, decoded))
+
+def samples(conversation_id, since=None, until=None):
+    """
+    All samples of a conversation with since <= time <= until (microseconds),
+    from its blocks and its not yet compacted rows, in time order.
+    """
+    blocks = VectorMetricsBlock.objects.filter(conversation_id=conversation_id)
+    rows = VectorMetrics.objects.filter(conversation_id=conversation_id)
+    if since is not None:
+        blocks = blocks.filter(end__gte=from_micros(since))
+        rows = rows.filter(timestamp__gte=from_micros(since))
+    if until is not None:
+        blocks = blocks.filter(start__lte=from_micros(until))
+        rows = rows.filter(timestamp__lte=from_micros(until))
+    
+    raw = (
+        (to_micros(row[0]), row[1:])
+        for row in rows.order_by('timestamp', 'id').values_list('timestamp', *METRIC_FIELDS).iterator()
+    )
+    return heapq.merge(
+        _block_samples(blocks.order_by('start').iterator(), since, until), raw,
+        key=lambda sample: sample[0]
+    )
+
+def time_range(conversation_id):
+    """(first, last) sample time of a conversation in microseconds, or None if it has none."""
+    raw = VectorMetrics.objects.filter(conversation_id=conversation_id).aggregate(
+        first=Min('timestamp'), last=Max('timestamp')
+    )
+    packed = VectorMetricsBlock.objects.filter(conversation_id=conversation_id).aggregate(
+        first=Min('start'), last=Max('end')
+    )
+    firsts = [value['first'] for value in (raw, packed) if value['first'] is not None]
+    lasts = [value['last'] for value in (raw, packed) if value['last'] is not None]
+    if not firsts:
+        return None
+    return to_micros(min(firsts)), to_micros(max(lasts))
+
+class Buckets:
+    """
+    Single pass over samples into count equal time buckets between since and
+    until, keeping per metric the min and max (with their times), the sum and
+    the count. Memory depends on the number of buckets, not of samples.
+    """
+    def __init__(self, since, until, count, fields):
+        self.since = since
+        self.width = max(1, math.ceil((until - since + 1) / count))
+        self.count = count
+        self.columns = [METRIC_FIELDS.index(field) for field in fields]
+        self.fields = fields
+        self.counts = [0] * count
+        self.sums = [[0.0] * count for _ in fields]
+        self.minima = [[None] * count for _ in fields]
+        self.maxima = [[None] * count for _ in fields]
+    
+    def add(self, samples):
+        for time, values in samples:
+            bucket = min((time - self.since) // self.width, self.count - 1)
+            self.counts[bucket] += 1
+            for i, column in enumerate(self.columns):
+                value = values[column]
+                self.sums[i][bucket] += value
+                low = self.minima[i][bucket]
+                if low is None or value < low[1]:
+                    self.minima[i][bucket] = (time, value)
+                high = self.maxima[i][bucket]
+                if high is None or value > high[1]:
+                    self.maxima[i][bucket] = (time, value)
+        return self
+    
+    def filled(self):
+        return [bucket for bucket, count in enumerate(self.counts) if count]
+    
+    def summary(self):
+        """Column-wise min/max/mean per non-empty bucket."""
+        filled = self.filled()
+        series = {
+            't': [from_micros(self.since + bucket * self.width) for bucket in filled],
+            'count': [self.counts[bucket] for bucket in filled],
+        }
+        for i, field in enumerate(self.fields):
+            series[field] = {
+                'min': [self.minima[i][bucket][1] for bucket in filled],
+                'max': [self.maxima[i][bucket][1] for bucket in filled],
+                'mean': [self.sums[i][bucket] / self.counts[bucket] for bucket in filled],
+            }
+        return series
+    
+    def extremes(self, i):
+        """The min and max points of metric i per bucket, in time order."""
+        points = []
+        for bucket in self.filled():
+            low, high = self.minima[i][bucket], self.maxima[i][bucket]
+            points.extend(sorted({low, high}))
+        return points
+
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets: threshold (time, value) points that keep the shape of points."""
+    if threshold >= len(points):
+        return list(points)
+    if threshold < 3:
+        # Too few points for a triangle; keep the ends
+        return [points[0], points[-1]][:threshold]
+    
+    every = (len(points) - 2) / (threshold - 2)
+    selected = [points[0]]
+    a = points[0]
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        following = points[end:min(int((i + 2) * every) + 1, len(points))]
+        average_time = sum(point[0] for point in following) / len(following)
+        average_value = sum(point[1] for point in following) / len(following)
+        
+        a = max(
+            points[start:end],
+            key=lambda point: abs(
+                (a[0] - average_time) * (point[1] - a[1]) - (a[0] - point[0]) * (average_value - a[1])
+            )
+        )
+        selected.append(a)
+    selected.append(points[-1])
+    return selected
+
+def downsample(conversation_id, since=None, until=None, points=500, method='minmax', fields=METRIC_FIELDS):
+    """
+    A series of at most points points per metric between since and until
+    (datetimes, default: all samples), computed in one pass over the samples.
+    
+    minmax returns the min, max and mean of each time bucket. lttb returns
+    chart points chosen by LTTB from the min and max points of
+    LTTB_PRESELECT_RATIO times as many buckets (MinMaxLTTB), which keeps
+    memory bounded on long ranges.
+    """
+    bounds = time_range(conversation_id)
+    if bounds is None:
+        return {'method': method, 'count': 0, 'series': {}}
+    since = to_micros(since) if since is not None else bounds[0]
+    until = to_micros(until) if until is not None else bounds[1]
+    
+    bucket_count = points if method == 'minmax' else points * LTTB_PRESELECT_RATIO
+    buckets = Buckets(since, max(since, until), bucket_count, fields).add(samples(conversation_id, since, until))
+    result = {
+        'method': method,
+        'since': from_micros(since),
+        'until': from_micros(until),
+        'count': sum(buckets.counts),
+    }
+    if method == 'minmax':
+        result['bucket_seconds'] = buckets.width / 1e6
+        result['series'] = buckets.summary()
+    else:
+        result['series'] = {}
+        for i, field in enumerate(fields):
+            chosen = lttb(buckets.extremes(i), points)
+            result['series'][field] = {
+                't': [from_micros(time) for time, _ in chosen],
+                'v': [value for _, value in chosen],
+            }
+    return result
@@ -0,0 +1,87 @@
+import re
+import math
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Same pre-tokenization as the cl100k/llama3 BPE vocabularies
+PIECE_PATTERN = re.compile(r"'(?:s|t|re|ve|m|ll|d)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+")
+
+class ApproximateEncoding:
+    """
+    Stand-in for a BPE encoding when tiktoken is not installed.
+    Short pieces count as one token and longer ones as one per five characters,
+    which stays within a few percent of the real count for English prose.
+    """
+    name = 'approximate'
+    
+    def count(self, text):
+        return sum(
+            1 if len(piece) <= 8 else math.ceil(len(piece) / 5)
+            for piece in PIECE_PATTERN.findall(text)
+        )
+
+class TiktokenEncoding:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.name = encoding.name
+    
+    def count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+@lru_cache(maxsize=None)
+def get_encoding(name=None):
+    """
+    Load the encoding once per process; building BPE tables is expensive.
+    tiktoken downloads the BPE file on first use, so when it cannot be loaded
+    (offline, unknown name) the approximation is used and cached instead.
+    """
+    name = name or settings.LLM_TOKENIZER
+    try:
+        import tiktoken
+    except ImportError:
+        return ApproximateEncoding()
+    try:
+        return TiktokenEncoding(tiktoken.get_encoding(name))
+    except Exception as e:
+        logger.warning("Could not load the %s encoding, counting tokens approximately: %s", name, e)
+        return ApproximateEncoding()
+
+class TokenCounter:
+    """
+    Token counts with a bounded LRU of recent results.
+    Messages are counted when written and again when prompts are assembled, so
+    the same texts come by repeatedly. Entries are keyed by the string hash and
+    length, so cached texts are not kept alive.
+    """
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def count(self, text):
+        if not text:
+            return 0
+        
+        key = (hash(text), len(text))
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                return self._counts[key]
+        
+        tokens = get_encoding().count(text)
+        with self._lock:
+            self._counts[key] = tokens
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return tokens
+
+token_counter = TokenCounter()
+
+def count_tokens(text):
+    """Number of tokens in text under the configured tokenizer."""
+    return token_counter.count(text)
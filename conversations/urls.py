@@ -1,11 +1,13 @@
 from django.urls import path, include
 from rest_framework_nested import routers
 from .views import (
-    ConversationViewSet, MessageViewSet, 
+    ConversationViewSet, MessageViewSet, MessageSearchViewSet,
     VectorMetricsViewSet, UserAccessViewSet
 )
 
 router = routers.SimpleRouter()
+# Registered before the conversations so search/ is not taken for a conversation id
+router.register(r'search', MessageSearchViewSet, basename='message-search')
 router.register(r'', ConversationViewSet, basename='conversation')
 
 # Nested routes
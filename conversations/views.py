@@ -1,69 +1,192 @@
+import uuid
+import itertools
+from functools import partial
+from datetime import timedelta
 from rest_framework import viewsets, permissions, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.parsers import JSONParser
+from rest_framework.exceptions import ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db.models import Count, Max, Sum
 from django.shortcuts import get_object_or_404
 from .models import Conversation, Message, VectorMetrics, UserAccess
+from agents.models import Agent
 from .serializers import (
     ConversationSerializer, ConversationDetailSerializer, MessageSerializer,
-    VectorMetricsSerializer, UserAccessSerializer
+    VectorMetricsSerializer, UserAccessSerializer, MessageImportSerializer,
+    MessageSearchResultSerializer, CompactMessageSerializer, MessageAgentSerializer,
+    ConversationForkSerializer, VectorMetricsSampleSerializer
 )
 from users.permissions import IsStandardOrAdmin
 from .permissions import HasConversationAccess
-from .llm_service import generate_agent_response
+from .pagination import MessageKeysetPagination
+from .conditional import ConditionalGetMixin
+from .parsers import NDJSONParser, MessagePackParser
+from .ingest import import_messages
+from .forking import fork_conversation, NotForkable
+from .timeseries import ingest_samples, downsample, METRIC_FIELDS
+from .export import export_response
+from .search import get_message_search
+from .archive import (
+    archive_conversation, restore_conversation, restore_if_archived, archived_messages, NotArchivable
+)
+from .llm_service import generate_agent_response, stream_agent_response, generate_round
 from .consumers import ConversationConsumer
+from .scheduler import get_turn_scheduler, TurnTimeout
+from .call_policy import LLMUnavailable
+from .tasks import run_conversation_turn
 
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [permissions.IsAuthenticated, HasConversationAccess]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['is_active', 'is_public', 'language']
     search_fields = ['topic', 'objective']
-    ordering_fields = ['created_at', 'updated_at', 'topic']
+    ordering_fields = ['created_at', 'updated_at', 'topic', 'last_message_at', 'message_count']
     ordering = ['-created_at']
     
     def get_queryset(self):
         user = self.request.user
         
-        # Admin users can see all conversations
-        if user.role == 'admin':
-            return Conversation.objects.all()
+        # Message counters are stored on the conversation, so rows only need
+        # their creator and agent ids alongside
+        conversations = Conversation.objects.select_related('created_by').prefetch_related('agents')
+        if self.action == 'retrieve':
+            conversations = conversations.prefetch_related('conversationagent_set__agent')
         
-        # Standard and guest users can see public conversations, their own conversations,
-        # and conversations they have access to
-        return Conversation.objects.filter(
-            Q(is_public=True) | 
-            Q(created_by=user) |
-            Q(user_access__user=user)
-        ).distinct()
+        # Admins see everything; other users see public conversations plus their
+        # own and shared ones, looked up in the visibility index
+        return conversations.visible_to(user)
     
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return ConversationDetailSerializer
         return ConversationSerializer
     
+    def list(self, request, *args, **kwargs):
+        # The page changes whenever a conversation in the filtered set does
+        summary = self.filter_queryset(self.get_queryset()).order_by().aggregate(
+            count=Count('id'),
+            updated_at=Max('updated_at'),
+            last_message_at=Max('last_message_at'),
+            message_count=Sum('message_count'),
+            # Archiving and restoring do not move updated_at
+            archived=Count('archived_at'),
+            archived_at=Max('archived_at')
+        )
+        return self.conditional(
+            request, summary, None, partial(super().list, request, *args, **kwargs)
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        conversation = Conversation.objects.visible_to(request.user).with_version().filter(
+            pk=kwargs['pk']
+        ).first()
+        if conversation is None:
+            return super().retrieve(request, *args, **kwargs)
+        self.check_object_permissions(request, conversation)
+        
+        version, last_modified = conversation.version()
+        return self.conditional(
+            request, version, last_modified, partial(super().retrieve, request, *args, **kwargs)
+        )
+    
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
     
+    def destroy(self, request, *args, **kwargs):
+        conversation = self.get_object()
+        # Forks read their history from their ancestors' messages
+        if conversation.forks.exists():
+            return Response(
+                {"detail": "Conversations with forks cannot be deleted"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return super().destroy(request, *args, **kwargs)
+    
+    @action(detail=True, methods=['post'])
+    def fork(self, request, pk=None):
+        """
+        Branch the conversation after a message (default: the newest). The
+        fork shares the history up to that message instead of copying it.
+        """
+        conversation = self.get_object()
+        serializer = ConversationForkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = dict(serializer.validated_data)
+        
+        # The shared history must be in the hot table
+        restore_if_archived(conversation)
+        try:
+            fork = fork_conversation(
+                conversation.id,
+                message_id=options.pop('message', None),
+                agents=options.pop('agents', None),
+                created_by=request.user,
+                **options
+            )
+        except NotForkable as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(ConversationSerializer(fork).data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """Stream the conversation and its messages as NDJSON (?compress=gzip to gzip it)."""
+        conversation = self.get_object()
+        return export_response(
+            Conversation.objects.filter(id=conversation.id),
+            f'conversation-{conversation.id}',
+            compress=request.query_params.get('compress') == 'gzip'
+        )
+    
+    @action(detail=False, methods=['get'], url_path='export')
+    def export_all(self, request):
+        """Stream every conversation matching the list filters as NDJSON."""
+        return export_response(
+            self.filter_queryset(self.get_queryset()),
+            'conversations',
+            compress=request.query_params.get('compress') == 'gzip'
+        )
+    
     @action(detail=True, methods=['post'])
     def start(self, request, pk=None):
         conversation = self.get_object()
+        # Archived messages go back to the hot table before new turns are added
+        restore_if_archived(conversation)
+        
+        # Autonomous conversations are driven turn by turn by a Celery worker
+        autonomous = str(request.data.get('autonomous', '')).lower() in ('1', 'true')
         
-        if conversation.is_active:
+        if conversation.is_active and not autonomous:
             return Response(
                 {"detail": "Conversation is already active"},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         conversation.is_active = True
+        if autonomous:
+            # A new token supersedes any runner that is still going
+            conversation.run_token = uuid.uuid4().hex
         conversation.save()
         
+        if autonomous:
+            run_token = conversation.run_token
+            Conversation.objects.filter(id=conversation.id).update(run_turn=0)
+            transaction.on_commit(
+                lambda: run_conversation_turn.delay(conversation.id, run_token, 0)
+            )
+        
         # Notify clients via WebSocket
         ConversationConsumer.conversation_updated(conversation.id, {
             'type': 'conversation_started',
-            'conversation_id': conversation.id
+            'conversation_id': conversation.id,
+            'autonomous': autonomous
         })
         
         return Response({"detail": "Conversation started"})
@@ -79,6 +202,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
             )
         
         conversation.is_active = False
+        conversation.run_token = None
         conversation.save()
         
         # Notify clients via WebSocket
@@ -95,6 +219,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
         
         conversation.is_active = False
         conversation.completed_at = timezone.now()
+        conversation.run_token = None
         conversation.save()
         
         # Notify clients via WebSocket
@@ -105,6 +230,35 @@ class ConversationViewSet(viewsets.ModelViewSet):
         
         return Response({"detail": "Conversation marked as completed"})
     
+    @action(detail=True, methods=['post'])
+    def archive(self, request, pk=None):
+        conversation = self.get_object()
+        
+        try:
+            archive = archive_conversation(conversation.id)
+        except NotArchivable as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            "detail": "Conversation archived",
+            "message_count": archive.message_count,
+            "raw_size": archive.raw_size,
+            "archived_size": len(archive.data)
+        })
+    
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        conversation = self.get_object()
+        
+        if conversation.archived_at is None:
+            return Response(
+                {"detail": "Conversation is not archived"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        restore_conversation(conversation.id)
+        return Response({"detail": "Conversation restored"})
+    
     @action(detail=True, methods=['post'])
     def generate_response(self, request, pk=None):
         conversation = self.get_object()
@@ -125,38 +279,151 @@ class ConversationViewSet(viewsets.ModelViewSet):
         # Get the agent
         agent = get_object_or_404(conversation.agents, id=agent_id)
         
-        # Get conversation messages
-        messages = conversation.messages.all().order_by('timestamp')
+        # Stream token deltas over the WebSocket when requested
+        stream = str(request.data.get('stream', '')).lower() in ('1', 'true')
         
-        # Generate response
+        # Force the completion cache on or off (default: only for temperature 0)
+        use_cache = request.data.get('use_cache')
+        if use_cache is not None:
+            use_cache = str(use_cache).lower() in ('1', 'true')
+        
+        # Generate response; the scheduler keeps turns of this conversation in order
         try:
-            response = generate_agent_response(
-                agent=agent,
-                conversation=conversation,
-                messages=messages
-            )
+            with get_turn_scheduler().turn(conversation.id, timeout=settings.TURN_REQUEST_WAIT_TIMEOUT):
+                if stream:
+                    message_id = str(uuid.uuid4())
+                    deltas = itertools.count()
+                    response = stream_agent_response(
+                        agent=agent,
+                        conversation=conversation,
+                        on_delta=lambda delta: ConversationConsumer.message_delta(
+                            conversation.id, message_id, agent.id, next(deltas), delta
+                        ),
+                        message_id=message_id,
+                        use_cache=use_cache
+                    )
+                else:
+                    response = generate_agent_response(
+                        agent=agent,
+                        conversation=conversation,
+                        use_cache=use_cache
+                    )
+                
+                # Save the response
+                message = Message.objects.create(
+                    id=response['id'],
+                    conversation=conversation,
+                    agent=agent,
+                    content=response['content'],
+                    timestamp=timezone.now(),
+                    thinking=response.get('thinking'),
+                    confidence=response.get('confidence')
+                )
+                
+                # Notify clients via WebSocket
+                data = MessageSerializer(message).data
+                if stream:
+                    ConversationConsumer.message_completed(conversation.id, data)
+                else:
+                    ConversationConsumer.new_message(conversation.id, data)
             
-            # Save the response
-            message = Message.objects.create(
-                id=response['id'],
-                conversation=conversation,
-                agent=agent,
-                content=response['content'],
-                timestamp=response['timestamp'],
-                thinking=response.get('thinking'),
-                confidence=response.get('confidence')
+            return Response(data)
+        except TurnTimeout:
+            return Response(
+                {"detail": "Conversation is busy, try again later"},
+                status=status.HTTP_409_CONFLICT
+            )
+        except LLMUnavailable as e:
+            return Response(
+                {"detail": str(e)},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
-            
-            # Notify clients via WebSocket
-            ConversationConsumer.new_message(conversation.id, MessageSerializer(message).data)
-            
-            return Response(MessageSerializer(message).data)
         except Exception as e:
             return Response(
                 {"detail": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=True, methods=['post'])
+    def generate_round(self, request, pk=None):
+        conversation = self.get_object()
+        agent_ids = request.data.get('agent_ids')
+        
+        if not conversation.is_active:
+            return Response(
+                {"detail": "Cannot generate responses for inactive conversation"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Agents answer in the requested order, or in the order they joined
+        agents = conversation.agents.order_by('conversationagent__joined_at', 'id')
+        if agent_ids:
+            agents_by_id = {agent.id: agent for agent in agents.filter(id__in=agent_ids)}
+            missing = [agent_id for agent_id in agent_ids if agent_id not in agents_by_id]
+            if missing:
+                return Response(
+                    {"detail": f"Agents not in conversation: {', '.join(missing)}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            agents = [agents_by_id[agent_id] for agent_id in agent_ids]
+        else:
+            agents = list(agents)
+        
+        if not agents:
+            return Response(
+                {"detail": "Conversation has no agents"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        use_cache = request.data.get('use_cache')
+        if use_cache is not None:
+            use_cache = str(use_cache).lower() in ('1', 'true')
+        
+        # The whole round is one turn of the conversation
+        try:
+            with get_turn_scheduler().turn(conversation.id, timeout=settings.TURN_REQUEST_WAIT_TIMEOUT):
+                results = generate_round(agents, conversation, use_cache=use_cache)
+                
+                # Commit in agent order with strictly increasing timestamps so the
+                # transcript order does not depend on which completion finished first
+                base_timestamp = timezone.now()
+                created = []
+                errors = []
+                with transaction.atomic():
+                    for index, (agent, response, error) in enumerate(results):
+                        if error is not None:
+                            errors.append({"agent_id": agent.id, "detail": str(error)})
+                            continue
+                        
+                        created.append(Message.objects.create(
+                            id=response['id'],
+                            conversation=conversation,
+                            agent=agent,
+                            content=response['content'],
+                            timestamp=base_timestamp + timedelta(microseconds=index),
+                            thinking=response.get('thinking'),
+                            confidence=response.get('confidence')
+                        ))
+        except TurnTimeout:
+            return Response(
+                {"detail": "Conversation is busy, try again later"},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        # Notify clients via WebSocket
+        data = MessageSerializer(created, many=True).data
+        for message_data in data:
+            ConversationConsumer.new_message(conversation.id, message_data)
+        
+        if created:
+            response_status = status.HTTP_200_OK
+        elif all(isinstance(error, LLMUnavailable) for _, _, error in results):
+            response_status = status.HTTP_503_SERVICE_UNAVAILABLE
+        else:
+            response_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+        
+        return Response({"messages": data, "errors": errors}, status=response_status)
+    
     @action(detail=True, methods=['post'])
     def share(self, request, pk=None):
         conversation = self.get_object()
@@ -224,17 +491,68 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated, HasConversationAccess]
-    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    pagination_class = MessageKeysetPagination
+    filter_backends = [DjangoFilterBackend]
     filterset_fields = ['agent']
-    ordering_fields = ['timestamp']
-    ordering = ['timestamp']
     
     def get_queryset(self):
         conversation_id = self.kwargs.get('conversation_pk')
-        return Message.objects.filter(conversation_id=conversation_id)
+        if self.request.method in permissions.SAFE_METHODS:
+            # A fork reads the messages it shares with its ancestors...
+            conversation = Conversation.objects.filter(id=conversation_id).only('id', 'lineage').first()
+            messages = conversation.history() if conversation else Message.objects.none()
+        else:
+            # ...but only ever writes its own
+            messages = Message.objects.filter(conversation_id=conversation_id)
+        return messages.select_related('agent')
+    
+    @property
+    def normalized(self):
+        # ?shape=normalized sends each agent's display fields once per page
+        return self.action == 'list' and self.request.query_params.get('shape') == 'normalized'
+    
+    def get_serializer_class(self):
+        if self.normalized:
+            return CompactMessageSerializer
+        return MessageSerializer
+    
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.normalized:
+            agents = {message.agent_id: message.agent for message in self.paginator.page}
+            response.data['agents'] = {
+                agent_id: MessageAgentSerializer(agent).data
+                for agent_id, agent in sorted(agents.items()) if agent is not None
+            }
+        return response
+    
+    def list(self, request, *args, **kwargs):
+        conversation = get_object_or_404(Conversation.objects.with_version(), id=self.kwargs.get('conversation_pk'))
+        self.check_object_permissions(request, conversation)
+        
+        # New, edited and deleted messages all move the conversation's version
+        version, _ = conversation.version()
+        if conversation.archived_at is not None:
+            render = partial(self.list_archived, request, conversation)
+        else:
+            render = partial(super().list, request, *args, **kwargs)
+        return self.conditional(request, version, None, render)
+    
+    def list_archived(self, request, conversation):
+        """Serve the messages of an archived conversation from its archive."""
+        messages = archived_messages(conversation)
+        agent = request.query_params.get('agent')
+        if agent:
+            messages = (message for message in messages if message.agent_id == agent)
+        
+        page = self.paginate_queryset(messages)
+        agents = Agent.objects.in_bulk({message.agent_id for message in page})
+        for message in page:
+            message.agent = agents.get(message.agent_id)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
     
     def perform_create(self, serializer):
         conversation_id = self.kwargs.get('conversation_pk')
@@ -242,13 +560,102 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         # Check if the user has access to the conversation
         self.check_object_permissions(self.request, conversation)
+        restore_if_archived(conversation)
         
         serializer.save(conversation=conversation)
         
         # Notify clients via WebSocket
         ConversationConsumer.new_message(conversation.id, serializer.data)
+    
+    def perform_update(self, serializer):
+        if serializer.instance.is_shared():
+            raise ValidationError({"detail": "Messages shared with forks cannot be changed"})
+        serializer.save()
+    
+    def perform_destroy(self, instance):
+        if instance.is_shared():
+            raise ValidationError({"detail": "Messages shared with forks cannot be deleted"})
+        instance.delete()
+    
+    @action(detail=False, methods=['post'], url_path='import',
+            parser_classes=[JSONParser, NDJSONParser, MessagePackParser])
+    def import_messages(self, request, conversation_pk=None):
+        """
+        Import many messages at once, as a JSON array or an NDJSON body.
+        The batch is validated as a whole and either imported completely or not at all.
+        """
+        conversation = get_object_or_404(Conversation, id=conversation_pk)
+        self.check_object_permissions(request, conversation)
+        restore_if_archived(conversation)
+        
+        rows = request.data if isinstance(request.data, list) else [request.data]
+        if len(rows) > settings.MESSAGE_IMPORT_MAX:
+            return Response(
+                {"detail": f"At most {settings.MESSAGE_IMPORT_MAX} messages can be imported at once"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = MessageImportSerializer(data=rows, many=True)
+        serializer.is_valid(raise_exception=True)
+        messages = import_messages(conversation.id, serializer.validated_data)
+        
+        # One notification for the whole import; clients page in the messages
+        ConversationConsumer.messages_imported(conversation.id, messages)
+        
+        return Response({
+            'conversation': conversation.id,
+            'imported': len(messages),
+            'ids': [message.id for message in messages]
+        }, status=status.HTTP_201_CREATED)
+
+class MessageSearchViewSet(viewsets.GenericViewSet):
+    """
+    Ranked full-text search over the content and thinking of all messages the
+    user can read. ?q= takes a web-style query ("exact phrase", -excluded);
+    conversation, agent, since and until narrow the search.
+    """
+    serializer_class = MessageSearchResultSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        params = self.request.query_params
+        visible = Conversation.objects.visible_to(self.request.user)
+        if params.get('conversation'):
+            # Searching a fork covers the history it inherits
+            conversation = get_object_or_404(visible.only('id', 'lineage'), id=params['conversation'])
+            messages = conversation.history().select_related('agent')
+        else:
+            messages = Message.objects.filter(conversation__in=visible.values('id')).select_related('agent')
+        
+        if params.get('agent'):
+            messages = messages.filter(agent_id=params['agent'])
+        for param, lookup in (('since', 'timestamp__gte'), ('until', 'timestamp__lt')):
+            if params.get(param):
+                value = parse_datetime(params[param])
+                if value is None:
+                    raise ValidationError({param: "Invalid datetime"})
+                messages = messages.filter(**{lookup: value})
+        return messages
+    
+    def list(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {"detail": "q is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results = get_message_search().search(self.get_queryset(), query)
+        page = self.paginate_queryset(results)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
 
 class VectorMetricsViewSet(viewsets.ModelViewSet):
+    """
+    Raw samples that are not compacted yet. Samples older than
+    VECTOR_METRICS_COMPACT_AFTER seconds are moved into packed blocks by
+    compact_vector_metrics and no longer listed here; series/ reads all
+    samples of a conversation, downsampled on the server.
+    """
     serializer_class = VectorMetricsSerializer
     permission_classes = [permissions.IsAuthenticated, HasConversationAccess]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
@@ -259,6 +666,13 @@ class VectorMetricsViewSet(viewsets.ModelViewSet):
         conversation_id = self.kwargs.get('conversation_pk')
         return VectorMetrics.objects.filter(conversation_id=conversation_id)
     
+    def list(self, request, *args, **kwargs):
+        """
+        List the samples that are not compacted yet. Compacted samples are
+        only returned by series/, which callers reading history should use.
+        """
+        return super().list(request, *args, **kwargs)
+    
     def perform_create(self, serializer):
         conversation_id = self.kwargs.get('conversation_pk')
         conversation = get_object_or_404(Conversation, id=conversation_id)
@@ -267,6 +681,64 @@ class VectorMetricsViewSet(viewsets.ModelViewSet):
         self.check_object_permissions(self.request, conversation)
         
         serializer.save(conversation=conversation)
+    
+    @action(detail=False, methods=['post'], url_path='batch',
+            parser_classes=[JSONParser, NDJSONParser, MessagePackParser])
+    def batch(self, request, conversation_pk=None):
+        """Ingest many samples at once, as a JSON array, NDJSON or MessagePack body."""
+        conversation = get_object_or_404(Conversation, id=conversation_pk)
+        self.check_object_permissions(request, conversation)
+        
+        rows = request.data if isinstance(request.data, list) else [request.data]
+        if len(rows) > settings.VECTOR_METRICS_BATCH_MAX:
+            return Response(
+                {"detail": f"At most {settings.VECTOR_METRICS_BATCH_MAX} samples can be sent at once"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = VectorMetricsSampleSerializer(data=rows, many=True)
+        serializer.is_valid(raise_exception=True)
+        ingested = ingest_samples(conversation.id, serializer.validated_data)
+        return Response({'conversation': conversation.id, 'ingested': ingested}, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'])
+    def series(self, request, conversation_pk=None):
+        """
+        Samples between since and until downsampled to at most points per
+        metric: min/max/mean per time bucket (method=minmax) or chart points
+        (method=lttb). fields= picks metrics, comma-separated.
+        """
+        conversation = get_object_or_404(Conversation, id=conversation_pk)
+        self.check_object_permissions(request, conversation)
+        params = request.query_params
+        
+        bounds = {}
+        for param in ('since', 'until'):
+            if params.get(param):
+                bounds[param] = parse_datetime(params[param])
+                if bounds[param] is None:
+                    raise ValidationError({param: "Invalid datetime"})
+                # Times without an offset are in the server's time zone
+                if timezone.is_naive(bounds[param]):
+                    bounds[param] = timezone.make_aware(bounds[param])
+        
+        method = params.get('method', 'minmax')
+        if method not in ('minmax', 'lttb'):
+            raise ValidationError({'method': "Must be minmax or lttb"})
+        
+        try:
+            points = int(params.get('points', 500))
+        except ValueError:
+            raise ValidationError({'points': "Must be an integer"})
+        if not 1 <= points <= settings.VECTOR_METRICS_MAX_POINTS:
+            raise ValidationError({'points': f"Must be between 1 and {settings.VECTOR_METRICS_MAX_POINTS}"})
+        
+        fields = tuple(params['fields'].split(',')) if params.get('fields') else METRIC_FIELDS
+        unknown = set(fields) - set(METRIC_FIELDS)
+        if unknown:
+            raise ValidationError({'fields': f"Unknown metrics: {', '.join(sorted(unknown))}"})
+        
+        return Response(downsample(conversation.id, points=points, method=method, fields=fields, **bounds))
 
 class UserAccessViewSet(viewsets.ModelViewSet):
     serializer_class = UserAccessSerializer
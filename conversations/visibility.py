@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models import F
+from .models import Conversation, ConversationVisibility, UserAccess
+
+def sync_conversation(conversation_id):
+    """Bring the visibility rows of one conversation in line with its creator and grants."""
+    created_by = Conversation.objects.filter(id=conversation_id).values_list('created_by_id', flat=True).first()
+    wanted = set(UserAccess.objects.filter(conversation_id=conversation_id).values_list('user_id', flat=True))
+    if created_by is not None:
+        wanted.add(created_by)
+    
+    with transaction.atomic():
+        existing = set(
+            ConversationVisibility.objects.filter(conversation_id=conversation_id).values_list('user_id', flat=True)
+        )
+        if existing - wanted:
+            ConversationVisibility.objects.filter(
+                conversation_id=conversation_id, user_id__in=existing - wanted
+            ).delete()
+        if wanted - existing:
+            ConversationVisibility.objects.bulk_create(
+                [ConversationVisibility(conversation_id=conversation_id, user_id=user_id)
+                 for user_id in wanted - existing],
+                ignore_conflicts=True
+            )
+
+def rebuild(batch_size=1000):
+    """
+    Recompute the whole visibility index from creators and UserAccess rows in
+    one transaction. Returns (stale rows deleted, rows in the index).
+    """
+    with transaction.atomic():
+        deleted, _ = ConversationVisibility.objects.exclude(
+            conversation__created_by=F('user')
+        ).exclude(
+            conversation__user_access__user=F('user')
+        ).delete()
+        
+        pairs = Conversation.objects.filter(created_by__isnull=False).values_list(
+            'id', 'created_by_id'
+        ).union(UserAccess.objects.values_list('conversation_id', 'user_id'))
+        
+        batch = []
+        for conversation_id, user_id in pairs.iterator():
+            batch.append(ConversationVisibility(conversation_id=conversation_id, user_id=user_id))
+            if len(batch) >= batch_size:
+                ConversationVisibility.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        if batch:
+            ConversationVisibility.objects.bulk_create(batch, ignore_conflicts=True)
+    return deleted, ConversationVisibility.objects.count()
+
+def backfill():
+    """
+    Build the index once for data that predates it: rebuild() when the index
+    is empty but conversations have creators or grants. Returns whether it ran.
+    """
+    if ConversationVisibility.objects.exists():
+        return False
+    if not (Conversation.objects.filter(created_by__isnull=False).exists() or UserAccess.objects.exists()):
+        return False
+    rebuild()
+    return True
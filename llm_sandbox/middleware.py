@@ -0,0 +1,62 @@
+import re
+import gzip
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_brotli = re.compile(r'\bbr\b')
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
+# Only API payloads are compressed: HTML pages (admin, browsable API) carry
+# CSRF tokens, which compressing next to reflected input would expose (BREACH)
+COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack', 'application/x-ndjson')
+
+class CompressionMiddleware:
+    """
+    Compress API responses (the COMPRESSIBLE_TYPES content types) of at least
+    RESPONSE_COMPRESSION_MIN_SIZE bytes with brotli when the client accepts it
+    and the brotli package is installed, otherwise with gzip. HTML and other
+    responses, streaming responses and the exports (which compress
+    themselves) are left alone.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        response = self.get_response(request)
+        
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in COMPRESSIBLE_TYPES:
+            return response
+        if len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+        
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and re_accepts_brotli.search(accept_encoding):
+            content = brotli.compress(response.content, quality=settings.RESPONSE_BROTLI_QUALITY)
+            encoding = 'br'
+        elif re_accepts_gzip.search(accept_encoding):
+            content = gzip.compress(response.content, compresslevel=settings.RESPONSE_GZIP_LEVEL, mtime=0)
+            encoding = 'gzip'
+        else:
+            return response
+        
+        # Compressing a larger body would be pointless
+        if len(content) >= len(response.content):
+            return response
+        
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+        # The body is no longer byte-for-byte what a strong ETag promised
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
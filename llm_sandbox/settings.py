@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'llm_sandbox.middleware.CompressionMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -119,6 +120,9 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Render application/json with orjson (when installed) instead of the stdlib encoder
+API_FAST_JSON = os.environ.get('API_FAST_JSON', 'False').lower() == 'true'
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -130,8 +134,25 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # JSON by default; MessagePack for clients that send Accept: application/msgpack
+    'DEFAULT_RENDERER_CLASSES': (
+        'conversations.renderers.FastJSONRenderer' if API_FAST_JSON else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'conversations.renderers.MessagePackRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'conversations.parsers.MessagePackParser',
+    ),
 }
 
+# Response compression of API payloads
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '5'))
+
 # JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -146,19 +167,22 @@ CORS_ALLOWED_ORIGINS = os.environ.get(
     'http://localhost:3000,http://127.0.0.1:3000'
 ).split(',')
 
+# Redis shared by channels, celery and the LLM caches
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
 # Channels settings
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            'hosts': [os.environ.get('REDIS_URL', 'redis://localhost:6379/0')],
+            'hosts': [REDIS_URL],
         },
     },
 }
 
 # Celery settings
-CELERY_BROKER_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
-CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
@@ -166,7 +190,105 @@ CELERY_TIMEZONE = TIME_ZONE
 
 # LLM settings
 LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'groq')
+LLM_MODEL = os.environ.get('LLM_MODEL', '')
+LLM_EMBEDDING_MODEL = os.environ.get('LLM_EMBEDDING_MODEL', '')
+LLM_POOL_SIZE = int(os.environ.get('LLM_POOL_SIZE', '20'))
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '60'))
+LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', '5'))
+LLM_STUB_LATENCY = float(os.environ.get('LLM_STUB_LATENCY', '0'))
+LLM_TOKENIZER = os.environ.get('LLM_TOKENIZER', 'cl100k_base')
+LLM_CONTEXT_TOKEN_BUDGET = int(os.environ.get('LLM_CONTEXT_TOKEN_BUDGET', '6000'))
+LLM_CONTEXT_MAX_MESSAGES = int(os.environ.get('LLM_CONTEXT_MAX_MESSAGES', '0'))
+LLM_CONTEXT_CACHE_SIZE = int(os.environ.get('LLM_CONTEXT_CACHE_SIZE', '256'))
+LLM_CONTEXT_SUMMARY = os.environ.get('LLM_CONTEXT_SUMMARY', 'False').lower() == 'true'
+LLM_CONTEXT_SUMMARY_STEP = int(os.environ.get('LLM_CONTEXT_SUMMARY_STEP', '10'))
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'True').lower() == 'true'
+LLM_CACHE_REDIS = os.environ.get('LLM_CACHE_REDIS', 'True').lower() == 'true'
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '1024'))
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', '86400'))
+LLM_ROUND_MAX_CONCURRENCY = int(os.environ.get('LLM_ROUND_MAX_CONCURRENCY', '4'))
+
+# Bulk message import
+MESSAGE_IMPORT_MAX = int(os.environ.get('MESSAGE_IMPORT_MAX', '10000'))
+MESSAGE_IMPORT_BATCH_SIZE = int(os.environ.get('MESSAGE_IMPORT_BATCH_SIZE', '500'))
+
+# Rows fetched per round trip when streaming NDJSON exports
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '2000'))
+
+# Archival of completed conversations into compressed segments
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_COMPRESSION_LEVEL = int(os.environ.get('ARCHIVE_COMPRESSION_LEVEL', '9'))
+
+# Full-text search over messages: postgres (tsvector), inverted (fallback) or auto
+MESSAGE_SEARCH_BACKEND = os.environ.get('MESSAGE_SEARCH_BACKEND', 'auto')
+MESSAGE_SEARCH_CONFIG = os.environ.get('MESSAGE_SEARCH_CONFIG', 'english')
+# Seconds the fallback backend reuses its corpus statistics (message count, term frequencies)
+MESSAGE_SEARCH_STATS_TTL = int(os.environ.get('MESSAGE_SEARCH_STATS_TTL', '60'))
+
+# Vector metrics: batch ingestion, compaction into packed blocks and downsampled series
+VECTOR_METRICS_BATCH_MAX = int(os.environ.get('VECTOR_METRICS_BATCH_MAX', '10000'))
+VECTOR_METRICS_BLOCK_SIZE = int(os.environ.get('VECTOR_METRICS_BLOCK_SIZE', '4096'))
+VECTOR_METRICS_COMPACT_AFTER = int(os.environ.get('VECTOR_METRICS_COMPACT_AFTER', '3600'))
+VECTOR_METRICS_MAX_POINTS = int(os.environ.get('VECTOR_METRICS_MAX_POINTS', '5000'))
+
+# Replay of stored conversations over WebSocket
+REPLAY_CHUNK_SIZE = int(os.environ.get('REPLAY_CHUNK_SIZE', '200'))
+REPLAY_MAX_DELAY = float(os.environ.get('REPLAY_MAX_DELAY', '5'))
+REPLAY_MAX_SPEED = float(os.environ.get('REPLAY_MAX_SPEED', '1000'))
+
+# Log of broadcast WebSocket events that reconnecting clients resume from: redis or memory
+EVENT_LOG_BACKEND = os.environ.get('EVENT_LOG_BACKEND', 'redis')
+EVENT_LOG_MAX_EVENTS = int(os.environ.get('EVENT_LOG_MAX_EVENTS', '1000'))
+EVENT_LOG_TTL = int(os.environ.get('EVENT_LOG_TTL', '86400'))
+
+# Cache of per-user access decisions on conversations
+ACCESS_CACHE_ENABLED = os.environ.get('ACCESS_CACHE_ENABLED', 'True').lower() == 'true'
+ACCESS_CACHE_TTL = int(os.environ.get('ACCESS_CACHE_TTL', '3600'))
+
+# Turn scheduling across worker processes
+TURN_SCHEDULER_BACKEND = os.environ.get('TURN_SCHEDULER_BACKEND', 'redis')
+TURN_MAX_ACTIVE = int(os.environ.get('TURN_MAX_ACTIVE', '64'))
+TURN_LEASE_TTL = float(os.environ.get('TURN_LEASE_TTL', '120'))
+TURN_WAIT_TTL = float(os.environ.get('TURN_WAIT_TTL', '15'))
+TURN_WAIT_TIMEOUT = float(os.environ.get('TURN_WAIT_TIMEOUT', '300'))
+# HTTP requests give up quickly instead of holding a worker thread while another turn runs
+TURN_REQUEST_WAIT_TIMEOUT = float(os.environ.get('TURN_REQUEST_WAIT_TIMEOUT', '5'))
+TURN_POLL_INTERVAL = float(os.environ.get('TURN_POLL_INTERVAL', '0.05'))
+# Times an autonomous turn that timed out waiting for the conversation is requeued
+TURN_TIMEOUT_RETRIES = int(os.environ.get('TURN_TIMEOUT_RETRIES', '5'))
+
+# Rate limiting of LLM calls across worker processes (per provider and model)
+LLM_RATE_LIMIT_ENABLED = os.environ.get('LLM_RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+LLM_RATE_LIMIT_BACKEND = os.environ.get('LLM_RATE_LIMIT_BACKEND', 'redis')
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get('LLM_REQUESTS_PER_MINUTE', '30'))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get('LLM_TOKENS_PER_MINUTE', '6000'))
+LLM_CONCURRENCY_MIN = int(os.environ.get('LLM_CONCURRENCY_MIN', '1'))
+LLM_CONCURRENCY_MAX = int(os.environ.get('LLM_CONCURRENCY_MAX', '16'))
+LLM_CONCURRENCY_INITIAL = int(os.environ.get('LLM_CONCURRENCY_INITIAL', '4'))
+LLM_CONCURRENCY_BACKOFF = float(os.environ.get('LLM_CONCURRENCY_BACKOFF', '0.5'))
+LLM_LATENCY_TARGET = float(os.environ.get('LLM_LATENCY_TARGET', '15'))
+LLM_RATE_LIMIT_WAIT_TIMEOUT = float(os.environ.get('LLM_RATE_LIMIT_WAIT_TIMEOUT', '300'))
+LLM_RATE_LIMIT_MAX_RETRIES = int(os.environ.get('LLM_RATE_LIMIT_MAX_RETRIES', '5'))
+LLM_RATE_LIMIT_LEASE_TTL = float(os.environ.get('LLM_RATE_LIMIT_LEASE_TTL', '300'))
+LLM_RATE_LIMIT_POLL_INTERVAL = float(os.environ.get('LLM_RATE_LIMIT_POLL_INTERVAL', '0.05'))
+
+# Deadlines, retries, hedging and circuit breaking of LLM calls
+LLM_CALL_DEADLINE = float(os.environ.get('LLM_CALL_DEADLINE', '90'))
+LLM_CALL_MAX_RETRIES = int(os.environ.get('LLM_CALL_MAX_RETRIES', '2'))
+LLM_RETRY_BACKOFF = float(os.environ.get('LLM_RETRY_BACKOFF', '0.5'))
+LLM_RETRY_MAX_BACKOFF = float(os.environ.get('LLM_RETRY_MAX_BACKOFF', '8'))
+LLM_HEDGE_ENABLED = os.environ.get('LLM_HEDGE_ENABLED', 'True').lower() == 'true'
+LLM_HEDGE_PERCENTILE = float(os.environ.get('LLM_HEDGE_PERCENTILE', '95'))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_HEDGE_MAX_RATIO = float(os.environ.get('LLM_HEDGE_MAX_RATIO', '0.1'))
+LLM_CIRCUIT_WINDOW = int(os.environ.get('LLM_CIRCUIT_WINDOW', '20'))
+LLM_CIRCUIT_MIN_CALLS = int(os.environ.get('LLM_CIRCUIT_MIN_CALLS', '10'))
+LLM_CIRCUIT_FAILURE_RATE = float(os.environ.get('LLM_CIRCUIT_FAILURE_RATE', '0.5'))
+LLM_CIRCUIT_RESET_TIMEOUT = float(os.environ.get('LLM_CIRCUIT_RESET_TIMEOUT', '30'))
+
 GROQ_API_KEY = os.environ.get('GROQ_API_KEY', '')
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')
 
 # Upstash Vector settings
 UPSTASH_VECTOR_URL = os.environ.get('UPSTASH_VECTOR_REST_URL', '')
@@ -2,6 +2,7 @@ import uuid
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from .models import TrainingDataset, DatasetConversation, ModelTrainingJob
@@ -12,6 +13,7 @@ from .serializers import (
 from users.permissions import IsStandardOrAdmin
 from conversations.permissions import HasConversationAccess
 from conversations.models import Conversation
+from conversations.export import export_response
 from .tasks import start_model_training
 
 class TrainingDatasetViewSet(viewsets.ModelViewSet):
@@ -75,6 +77,16 @@ class TrainingDatasetViewSet(viewsets.ModelViewSet):
             status=status.HTTP_201_CREATED
         )
     
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """Stream the dataset's conversations and their messages as NDJSON."""
+        dataset = self.get_object()
+        return export_response(
+            Conversation.objects.filter(datasetconversation__dataset=dataset),
+            f'dataset-{dataset.id}',
+            compress=request.query_params.get('compress') == 'gzip'
+        )
+    
     @action(detail=True, methods=['post'])
     def remove_conversation(self, request, pk=None):
         dataset = self.get_object()
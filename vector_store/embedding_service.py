@@ -1,15 +1,16 @@
 import numpy as np
 import uuid
-from django.conf import settings
-import groq
 from .upstash_client import UpstashVectorClient
 from .models import Embedding, VectorIndex
 from conversations.models import Message
+from conversations.llm_providers import get_provider
+from conversations.tokenizer import count_tokens
+from conversations.llm_service import call_llm
 
 class EmbeddingService:
     def __init__(self):
         self.upstash_client = UpstashVectorClient()
-        self.groq_client = groq.Client(api_key=settings.GROQ_API_KEY)
+        self.provider = get_provider()
         self.default_index = "message_embeddings"
         self.dimensions = 1536  # Default for most embedding models
     
@@ -32,10 +33,15 @@ class EmbeddingService:
             )
     
     def generate_embedding(self, text):
-        """Generate embedding vector for text using Groq."""
-        response = self.groq_client.embeddings.create(
-            model="llama3-embedding-v1",
-            input=text
+        """Generate embedding vector for text using the configured LLM provider."""
+        model = self.provider.embedding_model
+        response = call_llm(
+            model,
+            count_tokens(text),
+            lambda timeout: self.provider.get_client().embeddings.create(
+                model=model, input=text, timeout=timeout
+            ),
+            hedge=True
         )
         return response.data[0].embedding
     